@@ -4,12 +4,15 @@ from .models import (
     User, Ingredient, Recipe, RecipeIngredient,
     Follow, Tag
 )
+from .recipe_ingredients import ingredients_changed
+from .shopping_cart import apply_to_carts
 
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     list_display = (
-        "id", "username", "email", "first_name", "last_name", "is_staff"
+        "id", "username", "email", "first_name", "last_name",
+        "recipes_count", "is_staff"
     )
     search_fields = ("email", "username")
     list_filter = ("is_staff", "is_superuser", "is_active")
@@ -47,10 +50,24 @@ class RecipeAdmin(admin.ModelAdmin):
     filter_horizontal = ("tags",)
     empty_value_display = "-пусто-"
 
+    def save_related(self, request, form, formsets, change):
+        # Инлайны меняют ингредиенты, поэтому сводные корзины
+        # пересчитываются для этого рецепта целиком.
+        changed = change and any(
+            formset.has_changed() for formset in formsets
+        )
+        if changed:
+            apply_to_carts(-1, recipe_ids=[form.instance.pk])
+        super().save_related(request, form, formsets, change)
+        if changed:
+            apply_to_carts(1, recipe_ids=[form.instance.pk])
+            ingredients_changed([form.instance.pk])
+
     def count_favorites(self, obj):
-        return obj.favorited_by.count()
+        return obj.favorites_count
 
     count_favorites.short_description = "В избранном"
+    count_favorites.admin_order_field = "favorites_count"
 
 
 @admin.register(Tag)
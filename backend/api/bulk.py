@@ -0,0 +1,59 @@
+"""
+Массовая запись через COPY ... FROM STDIN (psycopg2 copy_expert):
+строки CSV формируются из итератора по мере того, как их читает
+сервер, поэтому загрузка идёт потоком без промежуточных списков.
+"""
+import csv
+import io
+from itertools import islice
+
+from django.db import connection
+
+
+class RowsFile(io.TextIOBase):
+    """Файловый объект для COPY: строки CSV формируются из итератора
+    по мере чтения. None записывается пустым полем, то есть NULL."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = io.StringIO()
+            writer = csv.writer(chunk)
+            writer.writerows(islice(self._rows, 1000))
+            if not chunk.tell():
+                break
+            self._buffer += chunk.getvalue()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def copy_rows(table, columns, rows):
+    """Записывает строки rows в table одним COPY и возвращает их
+    число."""
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN "
+            "WITH (FORMAT csv)",
+            RowsFile(rows),
+        )
+        return cursor.rowcount
+
+
+def reserve_ids(model, count):
+    """Берёт count значений из последовательности первичного ключа
+    model, чтобы связанные строки можно было записать COPY сразу."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+            "FROM generate_series(1, %s)",
+            [model._meta.db_table, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,71 @@
+"""
+Денормализованные счётчики: Recipe.favorites_count,
+User.recipes_count и User.followers_count, а также Recipe.tags_mask.
+Текущие изменения применяются сигналами (api/signals.py) в той же
+транзакции, что и само изменение; функции ниже пересчитывают счётчики с нуля.
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, Follow, Recipe, User, recipe_tags_mask
+
+
+def _count_subquery(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        Value(0),
+    )
+
+
+def favorites_count_expression():
+    return _count_subquery(Favorite.objects, "recipe")
+
+
+def recipes_count_expression():
+    return _count_subquery(Recipe.objects, "author")
+
+
+def followers_count_expression():
+    return _count_subquery(Follow.objects, "author")
+
+
+def reconcile_favorites_count():
+    """Исправляет расхождения и возвращает число исправленных рецептов."""
+    return (
+        Recipe.objects.alias(actual=favorites_count_expression())
+        .exclude(favorites_count=F("actual"))
+        .update(favorites_count=favorites_count_expression())
+    )
+
+
+def reconcile_recipes_count():
+    """Исправляет расхождения и возвращает число исправленных авторов."""
+    return (
+        User.objects.alias(actual=recipes_count_expression())
+        .exclude(recipes_count=F("actual"))
+        .update(recipes_count=recipes_count_expression())
+    )
+
+
+def reconcile_followers_count():
+    """Исправляет расхождения и возвращает число исправленных авторов."""
+    return (
+        User.objects.alias(actual=followers_count_expression())
+        .exclude(followers_count=F("actual"))
+        .update(followers_count=followers_count_expression())
+    )
+
+
+def reconcile_tags_mask():
+    """Исправляет расхождения и возвращает число исправленных рецептов."""
+    return (
+        Recipe.objects.alias(actual=recipe_tags_mask())
+        .exclude(tags_mask=F("actual"))
+        .update(tags_mask=recipe_tags_mask())
+    )
@@ -0,0 +1,63 @@
+"""
+Функции ETag для условных GET-запросов (django.views.decorators.http
+.condition). Все они дешевле, чем сам ответ: версии каталогов берутся
+из кэша, а для рецепта выполняется один запрос без сериализации.
+"""
+import hashlib
+
+from .models import Recipe
+from .versions import (
+    INGREDIENTS_CATALOG,
+    TAGS_CATALOG,
+    get_version,
+)
+
+
+def _digest(*parts):
+    return hashlib.sha1(
+        "|".join(str(part) for part in parts).encode()
+    ).hexdigest()
+
+
+def tags_etag(request, *args, **kwargs):
+    return _digest("tags", get_version(TAGS_CATALOG), kwargs.get("pk"))
+
+
+def ingredients_etag(request, *args, **kwargs):
+    return _digest(
+        "ingredients",
+        get_version(INGREDIENTS_CATALOG),
+        kwargs.get("pk"),
+        request.query_params.get("name", ""),
+    )
+
+
+def recipe_etag(request, *args, **kwargs):
+    """Метка рецепта: время изменения, данные автора и флаги
+    текущего пользователя, которые входят в ответ."""
+    state = (
+        Recipe.objects.filter(pk=kwargs.get("pk"))
+        .with_user_flags(request.user)
+        .values_list(
+            "updated_at",
+            "is_favorited",
+            "is_in_shopping_cart",
+            "author_is_subscribed",
+            "author__email",
+            "author__username",
+            "author__first_name",
+            "author__last_name",
+            "author__avatar",
+            "author__avatar_variants",
+        )
+        .first()
+    )
+    if state is None:
+        return None
+    return _digest(
+        "recipe",
+        kwargs.get("pk"),
+        get_version(INGREDIENTS_CATALOG),
+        getattr(request.user, "pk", None),
+        *state,
+    )
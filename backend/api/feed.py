@@ -0,0 +1,138 @@
+"""
+Лента подписок: таблица FeedEntry с рецептами авторов, на которых
+подписан пользователь, читается keyset-пагинацией по своему индексу.
+
+Новый рецепт раскладывается по лентам подписчиков фоновой задачей
+одним INSERT ... SELECT (fan-out on write). Для авторов, у которых
+подписчиков больше FEED_FANOUT_MAX_FOLLOWERS, это слишком дорого:
+их рецепты не записываются в ленты, а сливаются со страницей ленты
+при чтении (read_feed) прямо из рецептов. Порог чтения вдвое ниже
+порога записи: автор, чьё число подписчиков колеблется около порога,
+обслуживается обоими путями, а повторы схлопывает UNION.
+"""
+from django.conf import settings
+from django.db import connection
+
+from .models import FeedEntry, Follow, Recipe, User
+
+# Сколько последних рецептов автора попадает в ленту при подписке.
+FEED_BACKFILL_RECIPES = 50
+
+FEED = FeedEntry._meta.db_table
+FOLLOW = Follow._meta.db_table
+RECIPE = Recipe._meta.db_table
+USER = User._meta.db_table
+
+
+def fan_out(recipe_ids):
+    """Добавляет рецепты в ленты подписчиков их авторов, кроме
+    популярных авторов."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {FEED} (user_id, recipe_id, author_id, pub_date)
+            SELECT f.user_id, r.id, r.author_id, r.pub_date
+            FROM {RECIPE} r
+            JOIN {USER} a ON a.id = r.author_id
+            JOIN {FOLLOW} f ON f.author_id = r.author_id
+            WHERE r.id = ANY(%s) AND a.followers_count <= %s
+            ON CONFLICT (user_id, recipe_id) DO NOTHING
+            """,
+            [list(recipe_ids), settings.FEED_FANOUT_MAX_FOLLOWERS],
+        )
+
+
+def backfill(user_id, author_id):
+    """Кладёт в ленту последние рецепты автора после подписки."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {FEED} (user_id, recipe_id, author_id, pub_date)
+            SELECT %s, r.id, r.author_id, r.pub_date
+            FROM {RECIPE} r
+            WHERE r.author_id = %s
+            ORDER BY r.pub_date DESC, r.id DESC
+            LIMIT %s
+            ON CONFLICT (user_id, recipe_id) DO NOTHING
+            """,
+            [user_id, author_id, FEED_BACKFILL_RECIPES],
+        )
+
+
+def backfill_followers(user_ids):
+    """Как backfill, но сразу для всех подписок пользователей user_ids
+    одним запросом; для массовой загрузки данных."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {FEED} (user_id, recipe_id, author_id, pub_date)
+            SELECT f.user_id, r.id, r.author_id, r.pub_date
+            FROM {FOLLOW} f
+            CROSS JOIN LATERAL (
+                SELECT id, author_id, pub_date FROM {RECIPE}
+                WHERE author_id = f.author_id
+                ORDER BY pub_date DESC, id DESC
+                LIMIT %s
+            ) r
+            WHERE f.user_id = ANY(%s)
+            ON CONFLICT (user_id, recipe_id) DO NOTHING
+            """,
+            [FEED_BACKFILL_RECIPES, list(user_ids)],
+        )
+
+
+def remove_author(user_id, author_id):
+    FeedEntry.objects.filter(user=user_id, author=author_id).delete()
+
+
+def read_feed(user_id, key, reverse, limit):
+    """
+    Страница ленты пользователя: до limit пар (pub_date, recipe_id)
+    с ключом меньше key по убыванию, а при reverse — больше key по
+    возрастанию; без key — с начала. Записи FeedEntry сливаются с
+    рецептами популярных авторов: от каждого источника (и от каждого
+    автора) берётся не больше limit строк по его индексу —
+    feed_user_pub_date_idx и recipe_author_pub_date_idx.
+    """
+    compare, direction = (">", "ASC") if reverse else ("<", "DESC")
+    after_entry = after_recipe = "TRUE"
+    key_params = []
+    if key is not None:
+        after_entry = f"(e.pub_date, e.recipe_id) {compare} (%s, %s)"
+        after_recipe = f"(r.pub_date, r.id) {compare} (%s, %s)"
+        key_params = list(key)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT pub_date, recipe_id FROM (
+                (
+                    SELECT e.pub_date, e.recipe_id FROM {FEED} e
+                    WHERE e.user_id = %s AND {after_entry}
+                    ORDER BY e.pub_date {direction},
+                        e.recipe_id {direction}
+                    LIMIT %s
+                )
+                UNION
+                (
+                    SELECT r.pub_date, r.id FROM {FOLLOW} f
+                    JOIN {USER} a ON a.id = f.author_id
+                    CROSS JOIN LATERAL (
+                        SELECT r.pub_date, r.id FROM {RECIPE} r
+                        WHERE r.author_id = f.author_id AND {after_recipe}
+                        ORDER BY r.pub_date {direction}, r.id {direction}
+                        LIMIT %s
+                    ) r
+                    WHERE f.user_id = %s AND a.followers_count > %s
+                )
+            ) AS feed (pub_date, recipe_id)
+            ORDER BY pub_date {direction}, recipe_id {direction}
+            LIMIT %s
+            """,
+            [
+                user_id, *key_params, limit,
+                *key_params, limit,
+                user_id, settings.FEED_FANOUT_MAX_FOLLOWERS // 2,
+                limit,
+            ],
+        )
+        return cursor.fetchall()
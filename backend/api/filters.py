@@ -1,7 +1,13 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Exists, F, OuterRef
 from rest_framework import filters
 import django_filters
 from .models import (
+    RECIPE_SEARCH_CONFIG,
     Recipe,
+    RecipeIngredient,
     Tag,
     Ingredient,
 )
@@ -17,6 +23,38 @@ class IngredientSearchFilter(filters.SearchFilter):
     search_param = "name"
 
 
+class RecipeSearchFilter(filters.SearchFilter):
+    """
+    Полнотекстовый поиск по ?search= через Recipe.search_vector
+    (GIN-индекс, русская морфология). Каждое слово запроса ищется
+    как префикс, результаты сортируются по релевантности.
+    """
+
+    word_re = re.compile(r"\w+")
+
+    def get_search_query(self, request):
+        words = self.word_re.findall(
+            " ".join(self.get_search_terms(request))
+        )
+        if not words:
+            return None
+        return SearchQuery(
+            " & ".join(f"{word}:*" for word in words),
+            config=RECIPE_SEARCH_CONFIG,
+            search_type="raw",
+        )
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if query is None:
+            return queryset
+        return (
+            queryset.filter(search_vector=query)
+            .annotate(search_rank=SearchRank(F("search_vector"), query))
+            .order_by("-search_rank", "-pub_date", "-id")
+        )
+
+
 class IngredientNameFilter(django_filters.FilterSet):
     name = django_filters.CharFilter(lookup_expr='istartswith')
 
@@ -25,11 +63,18 @@ class IngredientNameFilter(django_filters.FilterSet):
         fields = ['name']
 
 
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    """Список чисел через запятую: ?ingredients=1,2,3."""
+
+
 class RecipeFilter(django_filters.FilterSet):
+    # Любой из тегов: одна проверка Recipe.tags_mask вместо JOIN
+    # с таблицей тегов и DISTINCT.
     tags = django_filters.ModelMultipleChoiceFilter(
         field_name="tags__slug",
         to_field_name="slug",
         queryset=Tag.objects.all(),
+        method="filter_tags",
         label="Filter by tag slugs",
     )
     author = django_filters.NumberFilter(field_name="author__id")
@@ -41,9 +86,63 @@ class RecipeFilter(django_filters.FilterSet):
         method="filter_is_in_shopping_cart_custom"
     )
 
+    # Подзапросы EXISTS / NOT EXISTS по recipe_ingredient_lookup_idx
+    # вместо JOIN с DISTINCT: строки рецептов не размножаются.
+    ingredients = NumberInFilter(
+        method="filter_ingredients",
+        label="Recipes containing all of the ingredient ids",
+    )
+    exclude_ingredients = NumberInFilter(
+        method="filter_exclude_ingredients",
+        label="Recipes containing none of the ingredient ids",
+    )
+
     class Meta:
         model = Recipe
-        fields = ["author", "tags", "is_favorited", "is_in_shopping_cart"]
+        fields = [
+            "author",
+            "tags",
+            "is_favorited",
+            "is_in_shopping_cart",
+            "ingredients",
+            "exclude_ingredients",
+        ]
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        mask = 0
+        for tag in value:
+            mask |= tag.mask
+        return queryset.alias(
+            tag_bits=F("tags_mask").bitand(mask)
+        ).exclude(tag_bits=0)
+
+    @staticmethod
+    def recipe_ingredients():
+        return RecipeIngredient.objects.filter(recipe=OuterRef("pk"))
+
+    def filter_ingredients(self, queryset, name, value):
+        for ingredient_id in set(value):
+            queryset = queryset.filter(
+                Exists(self.recipe_ingredients().filter(
+                    ingredient=ingredient_id
+                ))
+            )
+        return queryset
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        # По проверке на ингредиент, как в filter_ingredients: условие
+        # ingredient IN (...) планировщик проверяет по индексу recipe
+        # с чтением таблицы, а пара (ингредиент, рецепт) читается
+        # одним индексом.
+        for ingredient_id in set(value):
+            queryset = queryset.filter(
+                ~Exists(self.recipe_ingredients().filter(
+                    ingredient=ingredient_id
+                ))
+            )
+        return queryset
 
     def filter_is_favorited_custom(self, queryset, name, value):
         print(
@@ -0,0 +1,117 @@
+"""
+Уменьшенные копии изображений рецептов и аватаров в WebP и JPEG.
+Запрос сохраняет только оригинал; копии строит фоновый пул
+(api/tasks.py) после фиксации транзакции и записывает их имена
+в image_variants (avatar_variants) вида
+{"source": оригинал, размер: {формат: имя}}.
+Пока копий нет, клиенты используют оригинал.
+"""
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .media import release_variants
+from .models import Recipe, User
+from .recipe_cache import invalidate_recipes
+from .tasks import run_after_commit
+
+# Размеры вписываются в рамку с сохранением пропорций и не увеличиваются.
+RECIPE_SIZES = {"card": (480, 360), "detail": (1200, 900)}
+AVATAR_SIZES = {"avatar": (160, 160)}
+
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+# Модель: (поле оригинала, поле копий, размеры).
+TARGETS = {
+    Recipe: ("image", "image_variants", RECIPE_SIZES),
+    User: ("avatar", "avatar_variants", AVATAR_SIZES),
+}
+
+
+def variants_outdated(instance):
+    """Копии построены не для текущего оригинала (или оригинал
+    удалён, а копии остались)."""
+    image_field, variants_field, _ = TARGETS[type(instance)]
+    source = getattr(instance, image_field).name or ""
+    return getattr(instance, variants_field).get("source", "") != source
+
+
+def schedule_variants(instance):
+    """Ставит построение копий в очередь после фиксации транзакции."""
+    run_after_commit(build_variants, type(instance), instance.pk)
+
+
+def _encode(image, size, image_format, options):
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    if image_format == "JPEG" and copy.mode != "RGB":
+        background = Image.new("RGB", copy.size, "white")
+        rgba = copy.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        copy = background
+    buffer = BytesIO()
+    copy.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def render_variants(source, sizes, directory):
+    """Сохраняет копии оригинала source в directory и возвращает
+    словарь вариантов."""
+    with default_storage.open(source) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    variants = {"source": source}
+    for size_name, size in sizes.items():
+        variants[size_name] = {}
+        for extension, (image_format, options) in FORMATS.items():
+            # Хранилище назовёт файл по хешу содержимого
+            # (api/storage.py), здесь важны только каталог и расширение.
+            variants[size_name][extension] = default_storage.save(
+                posixpath.join(directory, f"{size_name}.{extension}"),
+                ContentFile(_encode(image, size, image_format, options)),
+            )
+    return variants
+
+
+def build_variants(model, pk):
+    """Строит копии для текущего оригинала объекта. Результат
+    записывается, только если оригинал не сменился за время работы."""
+    image_field, variants_field, sizes = TARGETS[model]
+    row = model.objects.filter(pk=pk).values(image_field, variants_field)
+    row = row.first()
+    if row is None:
+        return
+    source, old_variants = row[image_field] or "", row[variants_field]
+    if old_variants.get("source", "") == source:
+        return
+    directory = posixpath.join(
+        model._meta.get_field(image_field).upload_to, "variants"
+    )
+    variants = render_variants(source, sizes, directory) if source else {}
+
+    changes = {variants_field: variants}
+    if model is Recipe:
+        # Время изменения входит в ETag карточки рецепта.
+        changes["updated_at"] = timezone.now()
+    updated = model.objects.filter(pk=pk, **{image_field: source}).update(
+        **changes
+    )
+    if not updated:
+        release_variants(model, image_field, variants)
+        return
+    release_variants(model, image_field, old_variants)
+    if model is Recipe:
+        invalidate_recipes([pk])
+    else:
+        invalidate_recipes(
+            Recipe.objects.filter(author=pk).values_list("pk", flat=True)
+        )
@@ -0,0 +1,63 @@
+import threading
+from bisect import bisect_left
+
+from .models import Ingredient
+from .versions import INGREDIENTS_CATALOG, get_version
+
+
+class IngredientIndex:
+    """
+    Префиксный индекс ингредиентов в памяти процесса.
+    Ключи приведены через casefold() и отсортированы, поэтому
+    префиксные совпадения находятся бинарным поиском, а совпадения
+    по подстроке добавляются следом линейным проходом.
+    """
+
+    def __init__(self, rows):
+        entries = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in rows
+        )
+        self._keys = [key for key, *_ in entries]
+        self._items = [
+            {"id": pk, "name": name, "measurement_unit": measurement_unit}
+            for _, pk, name, measurement_unit in entries
+        ]
+
+    def __len__(self):
+        return len(self._items)
+
+    def search(self, query):
+        query = query.casefold()
+        if not query:
+            return list(self._items)
+        start = bisect_left(self._keys, query)
+        end = bisect_left(self._keys, query + chr(0x10FFFF), start)
+        prefix_matches = self._items[start:end]
+        substring_matches = [
+            item
+            for key, item in zip(self._keys, self._items)
+            if query in key and not key.startswith(query)
+        ]
+        return prefix_matches + substring_matches
+
+
+_lock = threading.Lock()
+_state = None
+
+
+def get_ingredient_index():
+    """Индекс текущего процесса; перестраивается, когда версия
+    каталога ингредиентов изменилась."""
+    global _state
+    version = get_version(INGREDIENTS_CATALOG)
+    state = _state
+    if state is not None and state[0] == version:
+        return state[1]
+    with _lock:
+        if _state is None or _state[0] != version:
+            rows = Ingredient.objects.values_list(
+                "id", "name", "measurement_unit"
+            )
+            _state = (version, IngredientIndex(rows))
+        return _state[1]
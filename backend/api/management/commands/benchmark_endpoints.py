@@ -0,0 +1,449 @@
+import json
+import math
+import os
+import statistics
+import time
+from contextlib import nullcontext
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef
+from django.test import override_settings
+from django.urls import get_resolver, resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import urls as api_urls
+from api.models import Ingredient, Recipe, ShoppingCart, Tag, User
+
+BUDGETS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    "benchmark_budgets.json",
+)
+BUDGET_KEYS = ("queries", "p95_ms", "bytes")
+# Нижняя граница бюджета задержки: у быстрых эндпоинтов p95
+# в несколько миллисекунд сильнее зависит от машины, чем от кода.
+LATENCY_FLOOR_MS = 10
+BULK_SIZE = 5
+# Маршруты api.urls без замеров: запись медиафайлов, изменение
+# учётной записи и письма djoser.
+NOT_BENCHMARKED = {
+    "api-root": "static index of routes",
+    "users-user-me-avatar": "writes media files",
+    "users-activation": "account management",
+    "users-resend-activation": "account management",
+    "users-reset-password": "account management",
+    "users-reset-password-confirm": "account management",
+    "users-reset-username": "account management",
+    "users-reset-username-confirm": "account management",
+    "users-set-password": "account management",
+    "users-set-username": "account management",
+}
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу."""
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+class QueryTimer:
+    """Обёртка выполнения запросов (connection.execute_wrapper):
+    считает запросы и их суммарное время."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+def pick_dataset(prefix):
+    """Пользователи, рецепты и ингредиенты для запросов: самые
+    «тяжёлые» из сгенерированных generate_fixture_data."""
+    users = User.objects.filter(username__startswith=f"{prefix}-")
+    reader = (
+        users.alias(follows=Count("follower"))
+        .filter(Exists(ShoppingCart.objects.filter(user=OuterRef("pk"))))
+        .order_by("-follows", "pk")
+        .first()
+    )
+    if reader is None:
+        raise CommandError(
+            f"No users with prefix '{prefix}' and a shopping cart; "
+            "run generate_fixture_data."
+        )
+    recipes = Recipe.objects.filter(
+        author__username__startswith=f"{prefix}-"
+    )
+    recipe = recipes.order_by("-favorites_count", "pk").first()
+    toggled = list(
+        recipes.exclude(favorites__user=reader)
+        .exclude(shopping_cart__user=reader)
+        .exclude(author=reader)
+        .order_by("-popularity", "pk")
+        .values_list("pk", flat=True)[:BULK_SIZE]
+    )
+    followed = (
+        users.exclude(pk=reader.pk)
+        .exclude(following__user=reader)
+        .order_by("-followers_count", "pk")
+        .first()
+    )
+    if not toggled or followed is None:
+        raise CommandError(
+            "The dataset is too small: the reader already has every "
+            "recipe and author."
+        )
+    ingredients = list(
+        Ingredient.objects.alias(uses=Count("ingredient_recipes"))
+        .order_by("-uses", "pk")[:5]
+    )
+    return {
+        "reader": reader,
+        "author": users.order_by("-recipes_count", "pk").first(),
+        "followed": followed,
+        "recipe": recipe,
+        "toggled": toggled,
+        "last_page": max(math.ceil(
+            Recipe.objects.count() / settings.REST_FRAMEWORK["PAGE_SIZE"]
+        ), 1),
+        "ingredients": ingredients,
+        "tags": list(Tag.objects.order_by("pk")[:2]),
+        "word": max(recipe.name.split(), key=len),
+    }
+
+
+def scenarios(data):
+    """
+    Сценарии: списки шагов (имя, метод, путь, тело, ожидаемый статус,
+    с авторизацией). Шаги сценария выполняются подряд в каждой
+    итерации; сценарии с записью выполняются в откатываемой транзакции.
+    """
+    recipe = data["recipe"].pk
+    toggled = data["toggled"][0]
+    author = data["author"].pk
+    followed = data["followed"].pk
+    ingredient = data["ingredients"][0]
+    ids = ",".join(str(item.pk) for item in data["ingredients"])
+    tags = "&".join(f"tags={tag.slug}" for tag in data["tags"])
+    bulk = {"recipes": data["toggled"]}
+
+    def get(name, path, authenticated=True):
+        return [(name, "get", path, None, 200, authenticated)]
+
+    def toggle(name, path, body=None, created=201, removed=204):
+        return [
+            (f"{name}: add", "post", path, body, created, True),
+            (f"{name}: remove", "delete", path, body, removed, True),
+        ]
+
+    return [
+        get("tags", "/api/tags/", False),
+        get("tag", f"/api/tags/{data['tags'][0].pk}/", False),
+        get(
+            "ingredients: autocomplete",
+            "/api/ingredients/?" + urlencode({"name": ingredient.name[:3]}),
+            False,
+        ),
+        get("ingredient", f"/api/ingredients/{ingredient.pk}/", False),
+        get("recipes: anonymous", "/api/recipes/", False),
+        get("recipes", "/api/recipes/"),
+        get("recipes: last page", f"/api/recipes/?page={data['last_page']}"),
+        get("recipes: cursor", "/api/recipes/?pagination=cursor"),
+        get("recipes: tags", f"/api/recipes/?{tags}"),
+        get("recipes: author", f"/api/recipes/?author={author}"),
+        get("recipes: is_favorited", "/api/recipes/?is_favorited=1"),
+        get(
+            "recipes: is_in_shopping_cart",
+            "/api/recipes/?is_in_shopping_cart=1",
+        ),
+        get(
+            "recipes: search",
+            "/api/recipes/?" + urlencode({"search": data["word"]}),
+        ),
+        get("recipes: ingredients", f"/api/recipes/?ingredients={ids}"),
+        get(
+            "recipes: exclude_ingredients",
+            f"/api/recipes/?exclude_ingredients={ingredient.pk}",
+        ),
+        get("recipes: ordering", "/api/recipes/?ordering=-popularity"),
+        get("recipe: anonymous", f"/api/recipes/{recipe}/", False),
+        get("recipe", f"/api/recipes/{recipe}/"),
+        get("recipe: short link", f"/api/recipes/{recipe}/get-link/"),
+        get("recipes: trending", "/api/recipes/trending/?window=7d"),
+        get("recipes: cook", f"/api/recipes/cook/?ingredients={ids}"),
+        get("recipes: feed", "/api/recipes/feed/"),
+        get("users", "/api/users/"),
+        get("user", f"/api/users/{author}/"),
+        get("users: me", "/api/users/me/"),
+        get("subscriptions", "/api/users/subscriptions/"),
+        get(
+            "subscriptions: recipes_limit",
+            "/api/users/subscriptions/?recipes_limit=3",
+        ),
+        get(
+            "shopping list: txt",
+            "/api/recipes/download_shopping_cart/?format=txt",
+        ),
+        get(
+            "shopping list: csv",
+            "/api/recipes/download_shopping_cart/?format=csv",
+        ),
+        get(
+            "shopping list: pdf",
+            "/api/recipes/download_shopping_cart/?format=pdf",
+        ),
+        toggle("favorite", f"/api/recipes/{toggled}/favorite/"),
+        toggle("shopping cart", f"/api/recipes/{toggled}/shopping_cart/"),
+        toggle(
+            "favorite bulk",
+            "/api/recipes/favorite/bulk/",
+            bulk,
+            created=200,
+            removed=200,
+        ),
+        toggle(
+            "shopping cart bulk",
+            "/api/recipes/shopping_cart/bulk/",
+            bulk,
+            created=200,
+            removed=200,
+        ),
+        toggle("subscribe", f"/api/users/{followed}/subscribe/"),
+    ]
+
+
+def route_names():
+    names = set()
+    for pattern in get_resolver(api_urls).url_patterns:
+        for route in getattr(pattern, "url_patterns", [pattern]):
+            if route.name:
+                names.add(route.name)
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the api.urls endpoints in-process against the dataset of "
+        "generate_fixture_data and records, per endpoint, the query "
+        "count, total SQL time, wall time p50/p95 and response size. "
+        "Results are compared with the checked-in budgets "
+        "(benchmark_budgets.json) and written to a JSON report; the "
+        "command fails when a budget is exceeded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=2,
+            help="Unmeasured runs per scenario, to fill caches.",
+        )
+        parser.add_argument(
+            "--prefix",
+            default="fixture",
+            help="Username prefix used by generate_fixture_data.",
+        )
+        parser.add_argument("--budgets", default=BUDGETS_PATH)
+        parser.add_argument(
+            "--report",
+            default="benchmark-report.json",
+            help="JSON report path, '-' to skip.",
+        )
+        parser.add_argument(
+            "--write-budgets",
+            action="store_true",
+            help=(
+                "Replace the budgets with the measured values: exact "
+                "query counts, p95 and size with --headroom (p95 not "
+                f"below {LATENCY_FLOOR_MS} ms)."
+            ),
+        )
+        parser.add_argument("--headroom", type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("--iterations must be positive.")
+        data = pick_dataset(options["prefix"])
+        plan = scenarios(data)
+        token, created = Token.objects.get_or_create(user=data["reader"])
+        try:
+            # Тестовый клиент обращается к хосту testserver.
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+            ):
+                results = self.run(plan, token.key, options)
+        finally:
+            if created:
+                token.delete()
+        budgets = self.load_budgets(options["budgets"])
+        if options["write_budgets"]:
+            budgets = self.write_budgets(
+                results, options["budgets"], options["headroom"]
+            )
+        violations = self.compare(results, budgets)
+        covered = {
+            resolve(path.split("?")[0]).url_name
+            for steps in plan
+            for _, _, path, *_ in steps
+        }
+        uncovered = sorted(route_names() - covered - NOT_BENCHMARKED.keys())
+        for name in uncovered:
+            self.stderr.write(self.style.WARNING(
+                f"Route {name} has no benchmark scenario."
+            ))
+        if options["report"] != "-":
+            self.write_report(options, data, results, uncovered)
+        if violations:
+            raise CommandError(
+                f"{violations} endpoints exceed their budgets."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(results)} endpoints within budgets."
+        ))
+
+    def run(self, plan, token, options):
+        clients = {False: APIClient(), True: APIClient()}
+        clients[True].credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        results = {}
+        for steps in plan:
+            samples = {step[0]: [] for step in steps}
+            # Переключатели меняют не только связи, но и RecipeActivity,
+            # popularity и ленты: их прогон откатывается целиком, иначе
+            # каждый запуск искажал бы trending и ordering=-popularity.
+            # Работа после коммита (версии, фоновые задачи) в замер
+            # переключателей поэтому не входит.
+            writes = any(step[1] != "get" for step in steps)
+            with transaction.atomic() if writes else nullcontext():
+                for iteration in range(
+                    options["warmup"] + options["iterations"]
+                ):
+                    for step in steps:
+                        sample = self.measure(clients, *step)
+                        if iteration >= options["warmup"]:
+                            samples[step[0]].append(sample)
+                if writes:
+                    transaction.set_rollback(True)
+            for name, method, path, *_ in steps:
+                results[name] = self.summarize(
+                    method, path, samples[name]
+                )
+        return results
+
+    def measure(self, clients, name, method, path, body, expected, auth):
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            started = time.perf_counter()
+            request = getattr(clients[auth], method)
+            response = (
+                request(path, body, format="json") if body else request(path)
+            )
+            content = (
+                b"".join(response.streaming_content)
+                if response.streaming else response.content
+            )
+            wall = time.perf_counter() - started
+        if response.status_code != expected:
+            raise CommandError(
+                f"{name}: {method.upper()} {path} returned "
+                f"{response.status_code}, expected {expected}."
+            )
+        return (
+            timer.count,
+            timer.seconds * 1000,
+            wall * 1000,
+            len(content),
+        )
+
+    def summarize(self, method, path, samples):
+        queries, sql, wall, sizes = zip(*samples)
+        return {
+            "method": method.upper(),
+            "path": path,
+            "queries": max(queries),
+            "sql_ms": round(statistics.median(sql), 2),
+            "p50_ms": round(percentile(wall, 50), 2),
+            "p95_ms": round(percentile(wall, 95), 2),
+            "bytes": max(sizes),
+        }
+
+    def load_budgets(self, path):
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def write_budgets(self, results, path, headroom):
+        budgets = {
+            name: {
+                "queries": result["queries"],
+                "p95_ms": max(
+                    math.ceil(result["p95_ms"] * headroom), LATENCY_FLOOR_MS
+                ),
+                "bytes": math.ceil(result["bytes"] * headroom),
+            }
+            for name, result in sorted(results.items())
+        }
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(budgets, file, ensure_ascii=False, indent=2)
+            file.write("\n")
+        self.stdout.write(f"Budgets written to {path}.")
+        return budgets
+
+    def compare(self, results, budgets):
+        """Дополняет результаты бюджетом и превышениями; возвращает
+        число эндпоинтов с превышениями."""
+        exceeded = 0
+        for name, result in results.items():
+            budget = budgets.get(name)
+            result["budget"] = budget
+            result["violations"] = [
+                f"{key} {result[key]} > {budget[key]}"
+                for key in BUDGET_KEYS
+                if budget and key in budget and result[key] > budget[key]
+            ]
+            if budget is None:
+                verdict = self.style.WARNING("NO BUDGET")
+            elif result["violations"]:
+                exceeded += 1
+                verdict = self.style.ERROR(
+                    "OVER: " + ", ".join(result["violations"])
+                )
+            else:
+                verdict = self.style.SUCCESS("OK")
+            self.stdout.write(
+                f"{name:<32} {result['queries']:>3} q "
+                f"{result['sql_ms']:>8.2f} ms sql "
+                f"{result['p50_ms']:>8.2f} / {result['p95_ms']:>8.2f} ms "
+                f"{result['bytes']:>8} B  {verdict}"
+            )
+        return exceeded
+
+    def write_report(self, options, data, results, uncovered):
+        report = {
+            "iterations": options["iterations"],
+            "warmup": options["warmup"],
+            "dataset": {
+                "prefix": options["prefix"],
+                "users": User.objects.count(),
+                "recipes": Recipe.objects.count(),
+                "reader": data["reader"].pk,
+                "recipe": data["recipe"].pk,
+            },
+            "results": results,
+            "uncovered_routes": uncovered,
+        }
+        with open(options["report"], "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+            file.write("\n")
+        self.stdout.write(f"Report written to {options['report']}.")
@@ -0,0 +1,228 @@
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.filters import RecipeFilter
+from api.models import Ingredient, Recipe, RecipeIngredient, User
+from api.versions import (
+    INGREDIENTS_CATALOG,
+    RECIPE_INGREDIENTS,
+    bump_version,
+)
+
+BENCHMARK_USERNAME = "ingredient-filter-benchmark"
+PAGE_SIZE = 6
+# Единственный допустимый способ чтения составов в фильтрах.
+EXPECTED_SCAN = "Index Only Scan recipe_ingredient_lookup_idx"
+
+SCAN_RE = re.compile(
+    r"(Seq Scan|Parallel Seq Scan|Index Only Scan|Index Scan|"
+    r"Bitmap Heap Scan)(?: Backward)?(?: using (\S+))? on (\S+)"
+)
+EXECUTION_TIME_RE = re.compile(r"Execution Time: ([\d.]+) ms")
+
+
+def generate(author, rows, per_recipe, ingredients):
+    """Синтетические данные одним INSERT ... SELECT на таблицу.
+    Ингредиенты распределены неравномерно: первые встречаются
+    в большинстве рецептов, последние — в единицах."""
+    ingredient_ids = [
+        ingredient.pk for ingredient in Ingredient.objects.bulk_create(
+            Ingredient(
+                name=f"{BENCHMARK_USERNAME} {number}",
+                measurement_unit="г",
+            )
+            for number in range(ingredients)
+        )
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {Recipe._meta.db_table} (
+                author_id, name, image, image_variants, text,
+                cooking_time, pub_date, updated_at,
+                favorites_count, popularity, tags_mask
+            )
+            SELECT %s, 'Рецепт ' || i, '', '{{}}', '', 1 + mod(i, 120),
+                now() - i * interval '1 minute', now(), 0, 0, 0
+            FROM generate_series(1, %s) i
+            """,
+            [author.pk, max(rows // per_recipe, 1)],
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {RecipeIngredient._meta.db_table}
+                (recipe_id, ingredient_id, amount)
+            SELECT r.id,
+                (%s::bigint[])[1 + floor(%s * power(random(), 3))::int], 1
+            FROM {Recipe._meta.db_table} r
+            CROSS JOIN generate_series(1, %s)
+            WHERE r.author_id = %s
+            ON CONFLICT DO NOTHING
+            """,
+            [ingredient_ids, ingredients, per_recipe, author.pk],
+        )
+        for model in (Recipe, RecipeIngredient, Ingredient):
+            # VACUUM заполняет карту видимости: без неё Index Only Scan
+            # всё равно читает таблицу.
+            cursor.execute(f"VACUUM ANALYZE {model._meta.db_table}")
+    return ingredient_ids
+
+
+def cleanup(author):
+    recipes = Recipe._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {RecipeIngredient._meta.db_table}
+            WHERE recipe_id IN (SELECT id FROM {recipes} WHERE author_id = %s)
+            """,
+            [author.pk],
+        )
+        cursor.execute(
+            f"DELETE FROM {recipes} WHERE author_id = %s", [author.pk]
+        )
+    Ingredient.objects.filter(
+        name__startswith=f"{BENCHMARK_USERNAME} "
+    ).delete()
+    author.delete()
+
+
+def cases(ingredient_ids):
+    popular, second, third = ingredient_ids[:3]
+    rare = ingredient_ids[-1]
+    return [
+        ("popular ingredient", {"ingredients": f"{popular}"}),
+        ("rare ingredient", {"ingredients": f"{rare}"}),
+        ("two ingredients", {"ingredients": f"{popular},{second}"}),
+        ("exclude popular", {"exclude_ingredients": f"{popular}"}),
+        (
+            "include and exclude",
+            {
+                "ingredients": f"{second}",
+                "exclude_ingredients": f"{popular},{third}",
+            },
+        ),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates --rows RecipeIngredient rows, runs the ingredients / "
+        "exclude_ingredients recipe filters under EXPLAIN ANALYZE and "
+        "reports how recipe ingredients are read and how long each query "
+        "takes. Fails unless every plan reads recipe ingredients only "
+        "with an Index Only Scan on recipe_ingredient_lookup_idx. Use a "
+        "non-production database: generated rows are deleted afterwards "
+        "unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument(
+            "--per-recipe",
+            type=int,
+            default=10,
+            help="Ingredients per generated recipe.",
+        )
+        parser.add_argument("--ingredients", type=int, default=2000)
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Runs per query; the fastest one is reported.",
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the generated data for further experiments.",
+        )
+        parser.add_argument(
+            "--report-only",
+            action="store_true",
+            help=(
+                "Report plans without checking them. Only for smoke runs "
+                "on tiny datasets, where the planner rightly prefers "
+                "other scans."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["ingredients"] < 3:
+            raise CommandError("--ingredients must be at least 3.")
+        if User.objects.filter(username=BENCHMARK_USERNAME).exists():
+            raise CommandError(
+                f"User {BENCHMARK_USERNAME} already exists: a previous "
+                "run was kept or interrupted. Remove it first."
+            )
+        author = User.objects.create_user(
+            email=f"{BENCHMARK_USERNAME}@example.com",
+            username=BENCHMARK_USERNAME,
+            first_name="Benchmark",
+            last_name="Benchmark",
+        )
+        try:
+            started = time.monotonic()
+            ingredient_ids = generate(
+                author,
+                options["rows"],
+                options["per_recipe"],
+                options["ingredients"],
+            )
+            self.stdout.write(
+                "Generated {} recipe ingredients in {:.1f} s.".format(
+                    RecipeIngredient.objects.filter(
+                        recipe__author=author
+                    ).count(),
+                    time.monotonic() - started,
+                )
+            )
+            unexpected = self.run_cases(ingredient_ids, options)
+        finally:
+            if not options["keep"]:
+                cleanup(author)
+            bump_version(INGREDIENTS_CATALOG)
+            bump_version(RECIPE_INGREDIENTS)
+        if unexpected and not options["report_only"]:
+            raise CommandError(
+                f"Recipe ingredients are not read by {EXPECTED_SCAN} "
+                "only in: " + ", ".join(unexpected)
+            )
+
+    def run_cases(self, ingredient_ids, options):
+        table = RecipeIngredient._meta.db_table
+        unexpected = []
+        for name, data in cases(ingredient_ids):
+            queryset = RecipeFilter(
+                data, queryset=Recipe.objects.order_by("-pub_date", "-id")
+            ).qs[:PAGE_SIZE]
+            plans = [
+                queryset.explain(analyze=True, buffers=True)
+                for _ in range(max(options["repeat"], 1))
+            ]
+            best = min(
+                plans,
+                key=lambda plan: float(
+                    EXECUTION_TIME_RE.search(plan).group(1)
+                ),
+            )
+            scans = sorted({
+                f"{node} {index}" if index else node
+                for node, index, relation in SCAN_RE.findall(best)
+                if relation == table
+            })
+            if scans != [EXPECTED_SCAN]:
+                unexpected.append(name)
+            self.stdout.write(
+                "{:<22} {:>9} ms  {}".format(
+                    name,
+                    EXECUTION_TIME_RE.search(best).group(1),
+                    "; ".join(scans),
+                )
+            )
+            if options["verbosity"] > 1:
+                self.stdout.write(str(queryset.query))
+                self.stdout.write(best)
+        return unexpected
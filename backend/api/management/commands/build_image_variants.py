@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from api.images import TARGETS, build_variants
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds missing or outdated WebP/JPEG variants of recipe images "
+        "and avatars, e.g. for uploads made before the variants existed "
+        "or lost on a worker restart."
+    )
+
+    def handle(self, *args, **options):
+        for model, (image_field, variants_field, _) in TARGETS.items():
+            built = failed = 0
+            rows = model.objects.values_list(
+                "pk", image_field, variants_field
+            )
+            for pk, source, variants in rows.iterator(chunk_size=500):
+                if variants.get("source", "") == (source or ""):
+                    continue
+                try:
+                    build_variants(model, pk)
+                except OSError as error:
+                    failed += 1
+                    self.stderr.write(
+                        f"{model.__name__} {pk}: {source}: {error}"
+                    )
+                else:
+                    built += 1
+            self.stdout.write(self.style.SUCCESS(
+                f"{model.__name__}: built {built}, failed {failed}."
+            ))
@@ -0,0 +1,106 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.images import TARGETS
+from api.models import MediaFile
+
+
+def referenced_names():
+    """Имена всех файлов, на которые ссылаются записи: оригиналы
+    и их уменьшенные копии. Строки читаются из БД порциями."""
+    names = set()
+    for model, (image_field, variants_field, _) in TARGETS.items():
+        rows = model.objects.values_list(image_field, variants_field)
+        for name, variants in rows.iterator(chunk_size=2000):
+            if name:
+                names.add(name)
+            for size, formats in variants.items():
+                if size != "source":
+                    names.update(formats.values())
+    return names
+
+
+def walk_files(root):
+    """Обходит дерево каталогов через os.scandir, не собирая
+    список файлов целиком."""
+    pending = [root]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds media files that no recipe or user references and that "
+        "are older than the grace period. Reports them by default; "
+        "deletes them with --delete."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help="Delete orphaned files instead of only listing them.",
+        )
+        parser.add_argument(
+            "--grace-hours",
+            type=float,
+            default=24,
+            help=(
+                "Skip files modified more recently than this: they may "
+                "belong to an upload or variant build in progress."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        media_root = os.fspath(settings.MEDIA_ROOT)
+        cutoff = time.time() - options["grace_hours"] * 3600
+        referenced = referenced_names()
+        orphans = orphan_bytes = scanned = 0
+        removed = []
+
+        for model, (image_field, _, _) in TARGETS.items():
+            upload_to = model._meta.get_field(image_field).upload_to
+            directory = os.path.join(media_root, upload_to)
+            for entry in walk_files(directory):
+                scanned += 1
+                name = os.path.relpath(entry.path, media_root).replace(
+                    os.sep, "/"
+                )
+                if name in referenced:
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > cutoff:
+                    continue
+                orphans += 1
+                orphan_bytes += stat.st_size
+                self.stdout.write(name)
+                if options["delete"]:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                    removed.append(name)
+
+        # Счётчик ссылок (api/media.py) мог остаться завышенным
+        # у загрузки, запись которой так и не сохранилась.
+        for start in range(0, len(removed), 1000):
+            MediaFile.objects.filter(
+                name__in=removed[start:start + 1000]
+            ).delete()
+
+        action = "Deleted" if options["delete"] else "Found"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scanned} files. {action} {orphans} orphaned files, "
+            f"{orphan_bytes / 1024 / 1024:.1f} MB."
+        ))
@@ -0,0 +1,96 @@
+import base64
+import json
+import sys
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.models import Recipe
+
+
+def recipe_record(recipe, inline_images):
+    """Запись JSONL для рецепта; её разбирает import_recipes.
+    Если файла изображения нет, остаётся только ссылка."""
+    image = {"name": recipe.image.name}
+    if inline_images and recipe.image.name:
+        try:
+            with default_storage.open(recipe.image.name) as file:
+                image["data"] = base64.b64encode(file.read()).decode()
+        except FileNotFoundError:
+            pass
+    return {
+        "id": recipe.pk,
+        "author": {
+            "email": recipe.author.email,
+            "username": recipe.author.username,
+            "first_name": recipe.author.first_name,
+            "last_name": recipe.author.last_name,
+        },
+        "name": recipe.name,
+        "text": recipe.text,
+        "cooking_time": recipe.cooking_time,
+        "pub_date": recipe.pub_date.isoformat(),
+        "image": image,
+        "tags": [
+            {"slug": tag.slug, "name": tag.name, "color": tag.color}
+            for tag in recipe.tags.all()
+        ],
+        "ingredients": [
+            {
+                "name": item.ingredient.name,
+                "measurement_unit": item.ingredient.measurement_unit,
+                "amount": item.amount,
+            }
+            for item in recipe.recipe_ingredients.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports recipes as JSON Lines, one recipe per line, with "
+        "authors, tags and ingredients referenced by natural keys. "
+        "Images are referenced by their media name (copy MEDIA_ROOT "
+        "alongside) or embedded with --inline-images."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output",
+            nargs="?",
+            default="-",
+            help="Output file, '-' for stdout.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--inline-images",
+            action="store_true",
+            help="Embed image files as base64.",
+        )
+
+    def handle(self, *args, **options):
+        recipes = (
+            Recipe.objects.select_related("author")
+            .prefetch_related("tags", "recipe_ingredients__ingredient")
+            .order_by("pk")
+            .iterator(chunk_size=options["chunk_size"])
+        )
+        output = (
+            sys.stdout if options["output"] == "-"
+            else open(options["output"], "w", encoding="utf-8")
+        )
+        exported = 0
+        try:
+            for recipe in recipes:
+                output.write(json.dumps(
+                    recipe_record(recipe, options["inline_images"]),
+                    ensure_ascii=False,
+                ))
+                output.write("\n")
+                exported += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(
+            f"Exported {exported} recipes."
+        ))
@@ -0,0 +1,458 @@
+import json
+import posixpath
+import random
+import time
+from array import array
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+
+from api.bulk import copy_rows, reserve_ids
+from api.counters import (
+    reconcile_favorites_count,
+    reconcile_followers_count,
+    reconcile_recipes_count,
+)
+from api.feed import backfill_followers
+from api.images import RECIPE_SIZES, render_variants
+from api.models import (
+    Favorite,
+    Follow,
+    Ingredient,
+    Recipe,
+    RecipeActivity,
+    RecipeIngredient,
+    ShoppingCart,
+    Tag,
+    User,
+    recipe_search_vector,
+)
+from api.shopping_cart import apply_to_carts
+from api.trending import WINDOWS, rollup
+from api.versions import RECIPE_INGREDIENTS, TAGS_CATALOG, bump_version
+
+# Хвост Парето: у немногих пользователей много рецептов, подписок
+# и избранного, у большинства — мало.
+PARETO_ALPHA = 1.5
+# Популярность авторов, рецептов и ингредиентов убывает по Ципфу.
+ZIPF_EXPONENT = 1.1
+AUTHOR_SHARE = 0.2
+PLACEHOLDER_IMAGES = 12
+PASSWORD = "fixture-password"
+# Пользователи обрабатываются порциями в запросах с ANY(%s).
+USER_CHUNK = 5000
+
+DEFAULT_TAGS = (
+    ("Завтрак", "#E26C2D", "breakfast"),
+    ("Обед", "#49B64E", "lunch"),
+    ("Ужин", "#8775D2", "dinner"),
+)
+FIRST_NAMES = (
+    "Анна", "Иван", "Мария", "Пётр", "Ольга", "Сергей", "Елена", "Дмитрий",
+)
+LAST_NAMES = (
+    "Иванова", "Смирнов", "Кузнецова", "Попов", "Соколова", "Лебедев",
+)
+DISHES = (
+    "суп", "салат", "пирог", "рагу", "каша", "запеканка", "омлет", "плов",
+)
+ADJECTIVES = (
+    "домашний", "быстрый", "летний", "острый", "нежный", "праздничный",
+)
+TEXT = (
+    "Подготовьте ингредиенты. Смешайте, доведите до готовности "
+    "и подавайте горячим."
+)
+AMOUNTS = (1, 2, 5, 10, 50, 100, 200, 250, 500)
+
+
+def zipf_weights(count):
+    """Накопленные веса Ципфа для rng.choices(cum_weights=...)."""
+    return list(accumulate(
+        1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(count)
+    ))
+
+
+def heavy_tail(rng, mean, limit):
+    """Неотрицательное целое с хвостом Парето и средним около mean."""
+    value = rng.paretovariate(PARETO_ALPHA) - 1
+    return min(round(value * mean * (PARETO_ALPHA - 1)), limit)
+
+
+def pick(rng, population, cum_weights, count, exclude=None):
+    """До count различных элементов population с весами."""
+    chosen = set()
+    for _ in range(4):
+        if len(chosen) >= count:
+            break
+        chosen.update(rng.choices(
+            population, cum_weights=cum_weights, k=count - len(chosen)
+        ))
+        chosen.discard(exclude)
+    return list(chosen)[:count]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a deterministic synthetic dataset for load testing: "
+        "users, recipes with ingredients, tags and placeholder images, "
+        "follows, favorites, shopping carts and trending activity, with "
+        "skewed (Pareto / Zipf) distributions. Rows are streamed with "
+        "COPY. Needs the ingredient catalog (load_ingredients). All "
+        "generated users share the password '" + PASSWORD + "'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument(
+            "--recipes-per-author",
+            type=float,
+            default=10,
+            help=(
+                f"Mean recipes per author; {AUTHOR_SHARE:.0%} of users "
+                "are authors."
+            ),
+        )
+        parser.add_argument(
+            "--follows", type=float, default=10, help="Mean per user."
+        )
+        parser.add_argument(
+            "--favorites", type=float, default=20, help="Mean per user."
+        )
+        parser.add_argument(
+            "--cart-entries", type=float, default=3, help="Mean per user."
+        )
+        parser.add_argument(
+            "--prefix",
+            default="fixture",
+            help="Username prefix of generated users.",
+        )
+
+    def handle(self, *args, **options):
+        self.seed = options["seed"]
+        self.prefix = options["prefix"]
+        if User.objects.filter(
+            username__startswith=f"{self.prefix}-"
+        ).exists():
+            raise CommandError(
+                f"Users with prefix '{self.prefix}' already exist; "
+                "choose another --prefix."
+            )
+        self.ingredient_ids = list(
+            Ingredient.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        if not self.ingredient_ids:
+            raise CommandError(
+                "The ingredient catalog is empty; run load_ingredients."
+            )
+        # Даты отсчитываются от начала текущих суток, чтобы повторный
+        # запуск в тот же день дал те же данные.
+        self.anchor = timezone.now().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        started = time.monotonic()
+        with transaction.atomic():
+            self.tags = self.step("tags", self.ensure_tags)
+            self.images = self.step("placeholder images", self.make_images)
+            self.user_ids = self.step(
+                "users", self.create_users, options["users"]
+            )
+            self.step(
+                "recipes", self.create_recipes, options["recipes_per_author"]
+            )
+            self.step("recipe ingredients", self.create_recipe_ingredients)
+            self.step("recipe tags", self.create_recipe_tags)
+            self.step("follows", self.create_follows, options["follows"])
+            self.step(
+                "favorites",
+                self.create_relations,
+                Favorite,
+                "favorites",
+                options["favorites"],
+            )
+            self.step(
+                "shopping carts",
+                self.create_relations,
+                ShoppingCart,
+                "carts",
+                options["cart_entries"],
+            )
+            # Без статистики по только что загруженным таблицам
+            # планировщик выбирает вложенные циклы, и денормализация
+            # идёт минутами. ANALYZE видит строки своей транзакции.
+            self.step("analyze", self.analyze)
+            self.step("denormalized data", self.denormalize)
+            transaction.on_commit(lambda: bump_version(RECIPE_INGREDIENTS))
+            transaction.on_commit(lambda: bump_version(TAGS_CATALOG))
+        self.step("trending", rollup)
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {time.monotonic() - started:.1f} s."
+        ))
+
+    def rng(self, stream):
+        """Отдельный генератор на каждый этап: данные этапа не зависят
+        от того, сколько случайных чисел взяли предыдущие."""
+        return random.Random(f"{self.seed}:{stream}")
+
+    def step(self, name, func, *args):
+        started = time.monotonic()
+        result = func(*args)
+        count = len(result) if isinstance(result, list) else result
+        rows = f"{count} rows, " if isinstance(count, int) else ""
+        self.stdout.write(
+            f"{name}: {rows}{time.monotonic() - started:.1f} s"
+        )
+        return result
+
+    def ensure_tags(self):
+        if not Tag.objects.exists():
+            for name, color, slug in DEFAULT_TAGS:
+                Tag.objects.create(name=name, color=color, slug=slug)
+        return list(Tag.objects.order_by("pk"))
+
+    def make_images(self):
+        """Несколько однотонных JPEG с готовыми уменьшенными копиями:
+        рецепты ссылаются на них по кругу. Хранилище адресует файлы по
+        содержимому, поэтому повторный запуск их не дублирует."""
+        rng = self.rng("images")
+        upload_to = Recipe._meta.get_field("image").upload_to
+        images = []
+        for _ in range(PLACEHOLDER_IMAGES):
+            buffer = BytesIO()
+            color = tuple(rng.randrange(256) for _ in range(3))
+            Image.new("RGB", (1200, 900), color).save(buffer, "JPEG")
+            name = default_storage.save(
+                posixpath.join(upload_to, "placeholder.jpg"),
+                ContentFile(buffer.getvalue()),
+            )
+            variants = render_variants(
+                name, RECIPE_SIZES, posixpath.join(upload_to, "variants")
+            )
+            images.append((name, json.dumps(variants)))
+        return images
+
+    def create_users(self, count):
+        rng = self.rng("users")
+        ids = reserve_ids(User, count)
+        password = make_password(PASSWORD)
+
+        def rows():
+            for number, pk in enumerate(ids):
+                joined = self.anchor - timedelta(days=rng.random() * 730)
+                yield (
+                    pk, password, False, False, True, joined,
+                    f"{self.prefix}-{number}@example.com",
+                    f"{self.prefix}-{number}",
+                    rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), "{}",
+                    0, 0,
+                )
+
+        copy_rows(
+            User._meta.db_table,
+            (
+                "id", "password", "is_superuser", "is_staff", "is_active",
+                "date_joined", "email", "username", "first_name",
+                "last_name", "avatar_variants", "recipes_count",
+                "followers_count",
+            ),
+            rows(),
+        )
+        return ids
+
+    def create_recipes(self, mean):
+        rng = self.rng("recipes")
+        authors = rng.sample(
+            self.user_ids, max(1, round(len(self.user_ids) * AUTHOR_SHARE))
+        )
+        counts = [
+            max(1, heavy_tail(rng, mean, round(mean * 50)))
+            for _ in authors
+        ]
+        self.authors = authors
+        self.recipe_ids = reserve_ids(Recipe, sum(counts))
+        # Время публикации (timestamp) и маска тегов по позиции рецепта.
+        self.pub_dates = array("d")
+        self.tag_masks = array("q")
+        anchor = self.anchor.timestamp()
+
+        def rows():
+            # Названия и изображения зависят от позиции рецепта, а не
+            # от pk: те же данные при любом состоянии последовательностей.
+            positions = enumerate(self.recipe_ids, 1)
+            for author, count in zip(authors, counts):
+                for _ in range(count):
+                    position, pk = next(positions)
+                    # Свежих рецептов больше, чем старых.
+                    pub_date = anchor - rng.random() ** 2 * 365 * 86400
+                    mask = 0
+                    for tag in rng.sample(self.tags, rng.randint(
+                        1, min(3, len(self.tags))
+                    )):
+                        mask |= tag.mask
+                    self.pub_dates.append(pub_date)
+                    self.tag_masks.append(mask)
+                    image, variants = self.images[position % len(self.images)]
+                    published = self.timestamp(pub_date)
+                    yield (
+                        pk, author,
+                        f"{rng.choice(ADJECTIVES).capitalize()} "
+                        f"{rng.choice(DISHES)} №{position}",
+                        image, variants, TEXT,
+                        rng.choice((5, 10, 15, 20, 30, 45, 60, 90, 120)),
+                        published, published, mask, 0, 0,
+                    )
+
+        copy_rows(
+            Recipe._meta.db_table,
+            (
+                "id", "author_id", "name", "image", "image_variants", "text",
+                "cooking_time", "pub_date", "updated_at", "tags_mask",
+                "favorites_count", "popularity",
+            ),
+            rows(),
+        )
+        return self.recipe_ids
+
+    def timestamp(self, value):
+        return self.anchor + timedelta(
+            seconds=value - self.anchor.timestamp()
+        )
+
+    def create_recipe_ingredients(self):
+        rng = self.rng("recipe ingredients")
+        ranking = self.ingredient_ids[:]
+        rng.shuffle(ranking)
+        weights = zipf_weights(len(ranking))
+
+        def rows():
+            for pk in self.recipe_ids:
+                for ingredient in pick(
+                    rng, ranking, weights, rng.randint(3, 12)
+                ):
+                    yield pk, ingredient, rng.choice(AMOUNTS)
+
+        return copy_rows(
+            RecipeIngredient._meta.db_table,
+            ("recipe_id", "ingredient_id", "amount"),
+            rows(),
+        )
+
+    def create_recipe_tags(self):
+        by_mask = {tag.mask: tag.pk for tag in self.tags}
+        links = Recipe.tags.through._meta
+
+        def rows():
+            for pk, mask in zip(self.recipe_ids, self.tag_masks):
+                for bit, tag in by_mask.items():
+                    if mask & bit:
+                        yield pk, tag
+
+        return copy_rows(
+            links.db_table,
+            (
+                links.get_field("recipe").column,
+                links.get_field("tag").column,
+            ),
+            rows(),
+        )
+
+    def create_follows(self, mean):
+        rng = self.rng("follows")
+        ranking = self.authors[:]
+        rng.shuffle(ranking)
+        weights = zipf_weights(len(ranking))
+        limit = len(ranking) - 1
+
+        def rows():
+            for user in self.user_ids:
+                count = heavy_tail(rng, mean, limit)
+                for author in pick(rng, ranking, weights, count, user):
+                    yield (
+                        user, author,
+                        self.anchor - timedelta(days=rng.random() * 365),
+                    )
+
+        return copy_rows(
+            Follow._meta.db_table, ("user_id", "author_id", "created_at"),
+            rows(),
+        )
+
+    def create_relations(self, model, stream, mean):
+        """Избранное или список покупок: популярные рецепты (по Ципфу)
+        встречаются чаще; связь появляется после публикации."""
+        rng = self.rng(stream)
+        ranking = list(range(len(self.recipe_ids)))
+        rng.shuffle(ranking)
+        weights = zipf_weights(len(ranking))
+        anchor = self.anchor.timestamp()
+
+        def rows():
+            for user in self.user_ids:
+                count = heavy_tail(rng, mean, len(ranking))
+                for index in pick(rng, ranking, weights, count):
+                    pub_date = self.pub_dates[index]
+                    yield (
+                        user, self.recipe_ids[index],
+                        self.timestamp(
+                            pub_date + (anchor - pub_date) * rng.random()
+                        ),
+                    )
+
+        return copy_rows(
+            model._meta.db_table, ("user_id", "recipe_id", "created_at"),
+            rows(),
+        )
+
+    def denormalize(self):
+        """Счётчики, поисковые векторы, сводные корзины, ленты
+        и почасовая активность для популярных."""
+        reconcile_favorites_count()
+        reconcile_recipes_count()
+        reconcile_followers_count()
+        Recipe.objects.filter(search_vector__isnull=True).update(
+            search_vector=recipe_search_vector()
+        )
+        for start in range(0, len(self.user_ids), USER_CHUNK):
+            chunk = self.user_ids[start:start + USER_CHUNK]
+            apply_to_carts(1, user_ids=chunk)
+            backfill_followers(chunk)
+        activity = RecipeActivity._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {activity} (recipe_id, hour, favorites, carts)
+                SELECT recipe_id, date_trunc('hour', created_at),
+                    SUM(favorites), SUM(carts)
+                FROM (
+                    SELECT recipe_id, created_at, 1 AS favorites, 0 AS carts
+                    FROM {Favorite._meta.db_table}
+                    WHERE created_at >= %s AND user_id = ANY(%s)
+                    UNION ALL
+                    SELECT recipe_id, created_at, 0, 1
+                    FROM {ShoppingCart._meta.db_table}
+                    WHERE created_at >= %s AND user_id = ANY(%s)
+                ) events
+                GROUP BY 1, 2
+                ON CONFLICT (recipe_id, hour) DO UPDATE SET
+                    favorites = {activity}.favorites + EXCLUDED.favorites,
+                    carts = {activity}.carts + EXCLUDED.carts
+                """,
+                [self.anchor - max(WINDOWS.values()), self.user_ids] * 2,
+            )
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            for model in (
+                User, Recipe, RecipeIngredient, Recipe.tags.through,
+                Follow, Favorite, ShoppingCart,
+            ):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
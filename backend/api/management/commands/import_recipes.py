@@ -0,0 +1,390 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+from api.counters import recipes_count_expression
+from api.feed import fan_out
+from api.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    Tag,
+    User,
+    recipe_search_vector,
+)
+from api.transfer_images import store_image
+from api.versions import (
+    INGREDIENTS_CATALOG,
+    RECIPE_INGREDIENTS,
+    TAGS_CATALOG,
+    bump_version,
+)
+
+IMAGE_DIRECTORY = Recipe._meta.get_field("image").upload_to
+AUTHOR_FIELDS = ("email", "username", "first_name", "last_name")
+
+
+class InlineExecutor:
+    """Выполняет задачи сразу: --workers 0."""
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def check_string(value, model, field, blank=False):
+    """Строка не длиннее поля модели; TypeError или ValueError."""
+    if not isinstance(value, str):
+        raise TypeError(f"{field}: expected a string")
+    if not blank and not value.strip():
+        raise ValueError(f"{field}: empty")
+    max_length = model._meta.get_field(field).max_length
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{field}: longer than {max_length} characters")
+
+
+def check_integer(value, model, field):
+    """Целое от 1 до верхней границы типа колонки."""
+    maximum = connection.ops.integer_field_range(
+        model._meta.get_field(field).get_internal_type()
+    )[1]
+    if (
+        not isinstance(value, int) or isinstance(value, bool)
+        or not 1 <= value <= maximum
+    ):
+        raise ValueError(f"{field}: expected an integer from 1 to {maximum}")
+
+
+def validate(record):
+    """
+    Проверяет запись export_recipes так же строго, как модели и
+    RecipeSerializer: типы, длины строк, диапазоны чисел, отсутствие
+    повторов. KeyError, TypeError или ValueError — запись пропускается,
+    а не роняет транзакцию пакета.
+    """
+    for field in AUTHOR_FIELDS:
+        check_string(record["author"][field], User, field)
+    check_string(record["name"], Recipe, "name")
+    check_string(record["text"], Recipe, "text")
+    check_integer(record["cooking_time"], Recipe, "cooking_time")
+    check_string(record["image"]["name"], Recipe, "image")
+    datetime.fromisoformat(record["pub_date"])
+    slugs = [tag["slug"] for tag in record["tags"]]
+    for tag in record["tags"]:
+        check_string(tag["slug"], Tag, "slug")
+        check_string(tag["name"], Tag, "name")
+        check_string(tag["color"], Tag, "color")
+    if len(set(slugs)) != len(slugs):
+        raise ValueError("tags: duplicate slug")
+    if not record["ingredients"]:
+        raise ValueError("ingredients: empty")
+    keys = set()
+    for item in record["ingredients"]:
+        check_string(item["name"], Ingredient, "name")
+        check_string(item["measurement_unit"], Ingredient, "measurement_unit")
+        check_integer(item["amount"], RecipeIngredient, "amount")
+        keys.add((item["name"], item["measurement_unit"]))
+    if len(keys) != len(record["ingredients"]):
+        raise ValueError("ingredients: duplicate ingredient")
+
+
+def read_records(path, start):
+    """Пары (номер строки, запись) после строки start."""
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if number > start and line.strip():
+                yield number, line
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports recipes from a JSON Lines file written by export_recipes. "
+        "Images are decoded and stored in a process pool; recipes, their "
+        "ingredients and tag links are bulk-created in batches, one "
+        "transaction per batch. Progress is saved to a checkpoint file "
+        "after each batch, so an interrupted import resumes where it "
+        "stopped. Run build_image_variants afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Image worker processes; 0 decodes in this process.",
+        )
+        parser.add_argument(
+            "--media-dir",
+            help=(
+                "MEDIA_ROOT of the source environment for images that "
+                "are referenced rather than inlined."
+            ),
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Checkpoint file. Defaults to <path>.checkpoint.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore an existing checkpoint and start from line 1.",
+        )
+
+    def handle(self, *args, **options):
+        self.path = options["path"]
+        if not os.path.exists(self.path):
+            raise CommandError(f"File not found: {self.path}")
+        self.checkpoint = (
+            options["checkpoint"] or f"{self.path}.checkpoint"
+        )
+        self.media_dir = options["media_dir"]
+        state = {"line": 0, "imported": 0, "skipped": 0}
+        if not options["restart"] and os.path.exists(self.checkpoint):
+            with open(self.checkpoint, encoding="utf-8") as file:
+                state = json.load(file)
+            self.stdout.write(f"Resuming after line {state['line']}.")
+        executor = (
+            ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("spawn"),
+                # Хранилище учитывает ссылки на файлы в БД.
+                initializer=django.setup,
+            )
+            if options["workers"] > 0 else InlineExecutor()
+        )
+        started = time.monotonic()
+        records = read_records(self.path, state["line"])
+        try:
+            while batch := list(islice(records, options["batch_size"])):
+                imported, skipped = self.import_batch(batch, executor)
+                state["line"] = batch[-1][0]
+                state["imported"] += imported
+                state["skipped"] += skipped
+                self.save_checkpoint(state)
+                self.stdout.write(
+                    f"Line {state['line']}: {state['imported']} recipes "
+                    f"imported, {state['skipped']} skipped."
+                )
+        finally:
+            executor.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {state['imported']} recipes, skipped "
+            f"{state['skipped']}, in {time.monotonic() - started:.1f} s."
+        ))
+
+    def save_checkpoint(self, state):
+        temporary = f"{self.checkpoint}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(temporary, self.checkpoint)
+
+    def skip(self, number, reason):
+        self.stderr.write(f"Line {number}: skipped, {reason}")
+
+    def parse(self, batch):
+        records = []
+        for number, line in batch:
+            try:
+                record = json.loads(line)
+                validate(record)
+            except (ValueError, KeyError, TypeError) as error:
+                self.skip(number, f"malformed record ({error!r}).")
+                continue
+            records.append((number, record))
+        return records
+
+    def store_images(self, records, executor):
+        """Декодирует и сохраняет изображения пакета параллельно;
+        записи с ошибкой пропускаются."""
+        futures = [
+            executor.submit(
+                store_image, record["image"], IMAGE_DIRECTORY, self.media_dir
+            )
+            for _, record in records
+        ]
+        stored = []
+        for (number, record), future in zip(records, futures):
+            try:
+                record["image"] = future.result()
+            except Exception as error:
+                self.skip(number, f"bad image ({error!r}).")
+                continue
+            stored.append((number, record))
+        return stored
+
+    def import_batch(self, batch, executor):
+        records = self.parse(batch)
+        records = self.store_images(records, executor)
+        with transaction.atomic():
+            authors = self.authors([record for _, record in records])
+            ingredients = self.ingredients(
+                [record for _, record in records]
+            )
+            tags, rejected = self.tags([record for _, record in records])
+            recipes, links, items = [], [], []
+            for number, record in records:
+                author = authors.get(record["author"]["email"])
+                if author is None:
+                    self.skip(number, "author username is taken.")
+                    continue
+                reasons = [
+                    rejected[tag["slug"]] for tag in record["tags"]
+                    if tag["slug"] in rejected
+                ]
+                if reasons:
+                    self.skip(number, reasons[0])
+                    continue
+                recipe = Recipe(
+                    author=author,
+                    name=record["name"],
+                    text=record["text"],
+                    cooking_time=record["cooking_time"],
+                    image=record["image"],
+                )
+                recipe_tags = [
+                    tags[tag["slug"]] for tag in record["tags"]
+                    if tag["slug"] in tags
+                ]
+                for tag in recipe_tags:
+                    recipe.tags_mask |= tag.mask
+                recipes.append((
+                    recipe,
+                    datetime.fromisoformat(record["pub_date"]),
+                    recipe_tags,
+                    [
+                        (
+                            ingredients[
+                                item["name"], item["measurement_unit"]
+                            ],
+                            item["amount"],
+                        )
+                        for item in record["ingredients"]
+                    ],
+                ))
+            Recipe.objects.bulk_create(
+                [recipe for recipe, *_ in recipes]
+            )
+            # pub_date с auto_now_add при создании всегда «сейчас»;
+            # bulk_update пишет значения как есть.
+            for recipe, pub_date, recipe_tags, recipe_items in recipes:
+                recipe.pub_date = pub_date
+                links.extend(
+                    Recipe.tags.through(recipe=recipe, tag=tag)
+                    for tag in recipe_tags
+                )
+                items.extend(
+                    RecipeIngredient(
+                        recipe=recipe, ingredient=ingredient, amount=amount
+                    )
+                    for ingredient, amount in recipe_items
+                )
+            Recipe.objects.bulk_update(
+                [recipe for recipe, *_ in recipes], ["pub_date"]
+            )
+            Recipe.tags.through.objects.bulk_create(links)
+            RecipeIngredient.objects.bulk_create(items)
+            recipe_ids = [recipe.pk for recipe, *_ in recipes]
+            Recipe.objects.filter(pk__in=recipe_ids).update(
+                search_vector=recipe_search_vector()
+            )
+            User.objects.filter(pk__in=[
+                author.pk for author in authors.values()
+            ]).update(recipes_count=recipes_count_expression())
+            fan_out(recipe_ids)
+            transaction.on_commit(lambda: bump_version(RECIPE_INGREDIENTS))
+        return len(recipes), len(batch) - len(recipes)
+
+    def authors(self, records):
+        """Авторы по email; отсутствующие создаются без пароля."""
+        data = {
+            record["author"]["email"]: record["author"] for record in records
+        }
+        User.objects.bulk_create(
+            [
+                User(
+                    password=make_password(None),
+                    **{field: author[field] for field in AUTHOR_FIELDS},
+                )
+                for author in data.values()
+            ],
+            ignore_conflicts=True,
+        )
+        return User.objects.in_bulk(list(data), field_name="email")
+
+    def ingredients(self, records):
+        keys = {
+            (item["name"], item["measurement_unit"])
+            for record in records
+            for item in record["ingredients"]
+        }
+        count = Ingredient.objects.count()
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in keys
+            ],
+            ignore_conflicts=True,
+        )
+        if Ingredient.objects.count() != count:
+            transaction.on_commit(lambda: bump_version(INGREDIENTS_CATALOG))
+        return {
+            (ingredient.name, ingredient.measurement_unit): ingredient
+            for ingredient in Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            )
+        }
+
+    def tags(self, records):
+        """
+        (теги, отклонённые): теги по slug и причины, по которым теги
+        не созданы. Отсутствующие теги создаются по одному, чтобы
+        получить бит маски (Tag.save); сверх MAX_TAGS тег не создаётся,
+        и рецепты с ним пропускаются.
+        """
+        data = {
+            tag["slug"]: tag
+            for record in records
+            for tag in record["tags"]
+        }
+        tags = Tag.objects.in_bulk(list(data), field_name="slug")
+        rejected = {}
+        for slug in data.keys() - tags.keys():
+            try:
+                with transaction.atomic():
+                    tags[slug] = Tag.objects.create(
+                        slug=slug,
+                        name=data[slug]["name"],
+                        color=data[slug]["color"],
+                    )
+            except IntegrityError:
+                self.stderr.write(
+                    f"Tag {slug} conflicts with an existing tag; "
+                    "dropped from imported recipes."
+                )
+                continue
+            except ValidationError as error:
+                rejected[slug] = (
+                    f"tag {slug} cannot be created ({error.messages[0]})."
+                )
+                continue
+            transaction.on_commit(lambda: bump_version(TAGS_CATALOG))
+        return tags, rejected
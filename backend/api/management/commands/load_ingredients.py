@@ -1,74 +1,234 @@
+import csv
 import json
-from django.core.management.base import BaseCommand
+import os
+import re
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.bulk import copy_rows
 from api.models import Ingredient
+from api.versions import INGREDIENTS_CATALOG, bump_version
+
+# Файлы ищутся по порядку: data_for_management — каталог data
+# репозитория внутри контейнера (infra/docker-compose.yml).
+DEFAULT_PATHS = (
+    "data_for_management/ingredients.csv",
+    "data_for_management/ingredients.json",
+    "../data/ingredients.csv",
+    "../data/ingredients.json",
+)
+
+SEPARATORS_RE = re.compile(r"[\s,]*")
+
+
+def read_csv(path):
+    """Строки «название,единица»; заголовок, если есть, пропускается."""
+    with open(path, encoding="utf-8", newline="") as file:
+        for number, row in enumerate(csv.reader(file)):
+            if number == 0 and row == ["name", "measurement_unit"]:
+                continue
+            yield dict(zip(("name", "measurement_unit"), row))
+
+
+def read_json(path, chunk_size=64 * 1024):
+    """Элементы JSON-массива по одному: файл читается кусками
+    и разбирается json.JSONDecoder.raw_decode, а не целиком."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as file:
+        buffer = file.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise CommandError(f"{path}: expected a JSON array.")
+        position = 1
+        while True:
+            position = SEPARATORS_RE.match(buffer, position).end()
+            if buffer.startswith("]", position):
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    raise CommandError(f"{path}: malformed JSON.")
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+
+
+READERS = {".csv": read_csv, ".json": read_json}
 
 
 class Command(BaseCommand):
-    help = '''Deletes all existing ingredients and loads fresh
-     ones from ingredients.json, stripping whitespace.'''
+    help = (
+        "Streams ingredients from a CSV (name,measurement_unit) or JSON "
+        "array file and adds the missing ones in batches. Existing "
+        "ingredients are never deleted or rewritten, so their ids stay "
+        "stable and recipes that use them are unaffected."
+    )
 
-    def handle(self, *args, **options):
-        try:
-            deleted_count, _ = Ingredient.objects.all().delete()
-            self.stdout.write(self.style.SUCCESS(f'''Successfully deleted
-             {deleted_count} existing ingredients.'''))
-        except Exception as e:
-            self.stdout.write(
-                self.style.ERROR
-                (f'Error deleting ingredients: {e}')
-            )
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            help=(
+                "CSV or JSON file. Defaults to the first existing of: "
+                + ", ".join(DEFAULT_PATHS)
+            ),
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--copy",
+            action="store_true",
+            help=(
+                "COPY the file into a temporary staging table and insert "
+                "from it in one statement. Faster for large files."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report which ingredients would be added.",
+        )
 
-        file_path = 'data_for_management/ingredients.json'
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                ingredients_data = json.load(f)
-        except FileNotFoundError:
-            self.stdout.write(
-                self.style.ERROR
-                (f'File not found: {file_path}')
-            )
-            return
-        except json.JSONDecodeError:
-            self.stdout.write(
-                self.style.ERROR
-                (f'Error decoding JSON from {file_path}')
+    def handle(self, *args, **options):
+        path = options["path"] or next(
+            (path for path in DEFAULT_PATHS if os.path.exists(path)), None
+        )
+        if path is None or not os.path.exists(path):
+            raise CommandError(
+                f"File not found: {path or ', '.join(DEFAULT_PATHS)}"
             )
-            return
-
-        ingredients_to_create = []
-        for item in ingredients_data:
-            name = item.get('name')
-            measurement_unit = item.get('measurement_unit')
-            if name and measurement_unit:
-                ingredients_to_create.append(
-                    Ingredient(
-                        name=name.strip(),
-                        measurement_unit=measurement_unit.strip()
-                    )
-                )
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError("Only .csv and .json files are supported.")
+        self.verbosity = options["verbosity"]
+        self.skipped = 0
+        self.seen = set()
+        started = time.monotonic()
+        rows = self.clean(reader(path))
+        with transaction.atomic():
+            if options["copy"]:
+                new = self.load_with_copy(rows, options["dry_run"])
             else:
-                self.stdout.write(self.style.WARNING(
-                    f'''Skipping item due to missing
-                     name or measurement_unit: {item}'''
-                ))
+                new = self.load_in_batches(
+                    rows, options["batch_size"], options["dry_run"]
+                )
+            if options["dry_run"]:
+                transaction.set_rollback(True)
+            elif new:
+                transaction.on_commit(
+                    lambda: bump_version(INGREDIENTS_CATALOG)
+                )
+        elapsed = time.monotonic() - started
+        self.report(new, options["dry_run"], elapsed)
 
-        if ingredients_to_create:
-            try:
+    def clean(self, items):
+        """Обрезает пробелы, пропускает неполные записи и повторы."""
+        for item in items:
+            name = (item.get("name") or "").strip()
+            unit = (item.get("measurement_unit") or "").strip()
+            if not name or not unit:
+                self.skipped += 1
+                if self.verbosity > 1:
+                    self.stderr.write(f"Skipping incomplete item: {item}")
+                continue
+            if (name, unit) in self.seen:
+                continue
+            self.seen.add((name, unit))
+            yield name, unit
+
+    def load_in_batches(self, rows, batch_size, dry_run):
+        new = 0
+        while batch := list(islice(rows, batch_size)):
+            existing = set(
+                Ingredient.objects.filter(
+                    name__in={name for name, _ in batch}
+                ).values_list("name", "measurement_unit")
+            )
+            missing = [row for row in batch if row not in existing]
+            self.show_new(missing)
+            if missing and not dry_run:
+                # Уникальный ключ (name, measurement_unit) покрывает все
+                # поля ингредиента: обновлять при конфликте нечего,
+                # а update_conflicts перезаписывал бы совпавшие строки.
+                # ON CONFLICT DO NOTHING не трогает существующие строки
+                # и их id, а заодно пропускает ингредиенты, добавленные
+                # параллельно после проверки выше.
                 Ingredient.objects.bulk_create(
-                    ingredients_to_create,
-                    ignore_conflicts=True
+                    [
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in missing
+                    ],
+                    ignore_conflicts=True,
                 )
-                self.stdout.write(self.style.SUCCESS(
-                    f'''Successfully loaded {len(ingredients_to_create)}
-                     ingredients.'''
-                ))
-            except Exception as e:
+            new += len(missing)
+            if self.verbosity > 0:
                 self.stdout.write(
-                    self.style.ERROR
-                    (f'Error saving ingredients: {e}')
+                    f"Processed {len(self.seen)} ingredients, "
+                    f"{new} new so far."
                 )
-        else:
+        return new
+
+    def load_with_copy(self, rows, dry_run):
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE ingredient_staging "
+                "(name text, measurement_unit text) ON COMMIT DROP"
+            )
+            copy_rows(
+                "ingredient_staging", ("name", "measurement_unit"), rows
+            )
+            if self.verbosity > 0:
+                self.stdout.write(
+                    f"Copied {len(self.seen)} ingredients to staging."
+                )
+            cursor.execute(
+                f"""
+                SELECT s.name, s.measurement_unit FROM ingredient_staging s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {table} i
+                    WHERE i.name = s.name
+                        AND i.measurement_unit = s.measurement_unit
+                )
+                """
+            )
+            missing = cursor.fetchall()
+            self.show_new(missing)
+            if missing and not dry_run:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table} (name, measurement_unit)
+                    SELECT name, measurement_unit FROM ingredient_staging
+                    ON CONFLICT (name, measurement_unit) DO NOTHING
+                    """
+                )
+        return len(missing)
+
+    def show_new(self, rows):
+        if self.verbosity > 1:
+            for name, unit in rows:
+                self.stdout.write(f"+ {name}, {unit}")
+
+    def report(self, new, dry_run, elapsed):
+        absent = sum(
+            1 for key in Ingredient.objects.values_list(
+                "name", "measurement_unit"
+            ).iterator(chunk_size=2000)
+            if key not in self.seen
+        )
+        verb = "Would add" if dry_run else "Added"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {new} ingredients, {len(self.seen) - new} already "
+            f"present, {self.skipped} incomplete items skipped. "
+            f"Processed {len(self.seen)} ingredients in {elapsed:.2f} s "
+            f"({len(self.seen) / max(elapsed, 1e-6):.0f}/s)."
+        ))
+        if absent:
             self.stdout.write(
-                self.style.WARNING
-                ('No ingredients to load.')
+                f"{absent} ingredients in the database are not in the "
+                "file; they are kept."
             )
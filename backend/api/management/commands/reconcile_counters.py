@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import (
+    reconcile_favorites_count,
+    reconcile_followers_count,
+    reconcile_recipes_count,
+    reconcile_tags_mask,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalculates Recipe.favorites_count, Recipe.tags_mask, "
+        "User.recipes_count and User.followers_count and fixes rows "
+        "that drifted from the actual values."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recipes = reconcile_favorites_count()
+            users = reconcile_recipes_count()
+            followed = reconcile_followers_count()
+            masks = reconcile_tags_mask()
+        self.stdout.write(self.style.SUCCESS(
+            f"Fixed favorites_count for {recipes} recipes, "
+            f"tags_mask for {masks} recipes, "
+            f"recipes_count for {users} users "
+            f"and followers_count for {followed} users."
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.trending import rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Compacts old hourly recipe activity into daily buckets, drops "
+        "buckets outside the longest window, recalculates "
+        "Recipe.popularity and caches the trending rankings. "
+        "Runs every 10 minutes in the scheduler service "
+        "(infra/docker-compose.yml)."
+    )
+
+    def handle(self, *args, **options):
+        updated = rollup()
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated popularity for {updated} recipes."
+        ))
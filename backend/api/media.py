@@ -0,0 +1,104 @@
+"""
+Освобождение медиафайлов. Из-за дедупликации (api/storage.py) один
+файл может принадлежать нескольким записям. Запись, переставшая
+ссылаться на файл, уменьшает его счётчик MediaFile в своей транзакции,
+а после фиксации файл удаляется под блокировкой строки счётчика —
+только если счётчик нулевой и в БД на файл никто не ссылается.
+Проверка по БД нужна для ссылок, поставленных в обход хранилища:
+generate_fixture_data раздаёт одни файлы многим рецептам, а
+import_recipes ссылается на уже лежащие в хранилище.
+"""
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .models import MediaFile
+from .tasks import run_after_commit
+
+MEDIA_FILES = MediaFile._meta.db_table
+
+
+def is_referenced(model, field, name):
+    return model.objects.filter(**{field: name}).exists()
+
+
+def variant_names(variants):
+    return [
+        name
+        for size, formats in variants.items()
+        if size != "source"
+        for name in formats.values()
+    ]
+
+
+def _release(names):
+    """Уменьшает счётчики names в текущей транзакции: по одному
+    на каждое вхождение имени."""
+    if not names:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {MEDIA_FILES} media
+            SET refcount = GREATEST(media.refcount - released.count, 0)
+            FROM (
+                SELECT name, COUNT(*) AS count
+                FROM unnest(%s::varchar[]) AS name GROUP BY name
+            ) AS released
+            WHERE media.name = released.name
+            """,
+            [list(names)],
+        )
+
+
+def _lock(names):
+    """Блокирует строки счётчиков names до конца транзакции и
+    возвращает {имя: счётчик}; недостающие строки создаются."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {MEDIA_FILES} (name, refcount)
+            SELECT name, 0 FROM unnest(%s::varchar[]) AS name
+            ORDER BY name
+            ON CONFLICT (name) DO UPDATE
+                SET refcount = {MEDIA_FILES}.refcount
+            RETURNING name, refcount
+            """,
+            [sorted(set(names))],
+        )
+        return dict(cursor.fetchall())
+
+
+def collect(model, field, source, names):
+    """
+    Удаляет файлы names без ссылок. Копии изображения одинаковы для
+    всех записей с тем же оригиналом, поэтому ни один файл не
+    удаляется, пока на оригинал source ссылается запись.
+    """
+    with transaction.atomic():
+        counts = _lock(names)
+        if is_referenced(model, field, source):
+            return
+        removed = [name for name, count in counts.items() if count == 0]
+        for name in removed:
+            default_storage.delete(name)
+        MediaFile.objects.filter(name__in=removed).delete()
+
+
+def release_variants(model, field, variants):
+    """Освобождает копии variants, построенные для одной записи."""
+    names = variant_names(variants)
+    if names:
+        _release(names)
+        run_after_commit(collect, model, field, variants["source"], names)
+
+
+def release_file(model, field, name, variants=None):
+    """Освобождает файл name поля field; копии variants — вместе с ним,
+    если они построены для этого файла."""
+    if not name:
+        return
+    names = [name]
+    if variants and variants.get("source") == name:
+        names += variant_names(variants)
+    _release(names)
+    run_after_commit(collect, model, field, name, names)
@@ -0,0 +1,138 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def through_model_operations(
+    model_name, field_name, old_table, options, field_options,
+    constraint, index
+):
+    """
+    Делает явной промежуточную модель M2M, сохраняя данные: модель
+    сначала описывается поверх существующей автоматической таблицы
+    (только состояние), затем таблица переименовывается и получает
+    created_at, ограничение уникальности и индекс (user, created_at).
+    """
+    return [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name=model_name,
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "recipe",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="api.recipe",
+                                verbose_name="Рецепт",
+                            ),
+                        ),
+                        (
+                            "user",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to=settings.AUTH_USER_MODEL,
+                                verbose_name="Пользователь",
+                            ),
+                        ),
+                    ],
+                    options={
+                        **options,
+                        "db_table": old_table,
+                        "unique_together": {("recipe", "user")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="recipe",
+                    name=field_name,
+                    field=models.ManyToManyField(
+                        blank=True,
+                        through=f"api.{model_name}",
+                        to=settings.AUTH_USER_MODEL,
+                        **field_options,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AlterModelTable(name=model_name, table=None),
+        migrations.AddField(
+            model_name=model_name,
+            name="created_at",
+            field=models.DateTimeField(
+                auto_now_add=True,
+                default=django.utils.timezone.now,
+                verbose_name="Дата добавления",
+            ),
+            preserve_default=False,
+        ),
+        migrations.AlterUniqueTogether(name=model_name, unique_together=set()),
+        migrations.AddConstraint(model_name=model_name, constraint=constraint),
+        migrations.AddIndex(model_name=model_name, index=index),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_shoppingcartitem"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        *through_model_operations(
+            "Favorite",
+            "favorited_by",
+            "api_recipe_favorited_by",
+            options={
+                "verbose_name": "Избранное",
+                "verbose_name_plural": "Избранное",
+                "ordering": ["-created_at"],
+                "abstract": False,
+                "default_related_name": "favorites",
+            },
+            field_options={
+                "related_name": "favorite_recipes",
+                "verbose_name": "Кто добавил в избранное",
+            },
+            constraint=models.UniqueConstraint(
+                fields=("user", "recipe"), name="unique_favorite"
+            ),
+            index=models.Index(
+                fields=["user", "created_at"],
+                name="favorite_user_created_idx",
+            ),
+        ),
+        *through_model_operations(
+            "ShoppingCart",
+            "in_shopping_cart_for_users",
+            "api_recipe_in_shopping_cart_for_users",
+            options={
+                "verbose_name": "Рецепт в списке покупок",
+                "verbose_name_plural": "Рецепты в списках покупок",
+                "ordering": ["-created_at"],
+                "abstract": False,
+                "default_related_name": "shopping_cart",
+            },
+            field_options={
+                "related_name": "shopping_cart_recipes",
+                "verbose_name": "Кто добавил в список покупок",
+            },
+            constraint=models.UniqueConstraint(
+                fields=("user", "recipe"), name="unique_shopping_cart"
+            ),
+            index=models.Index(
+                fields=["user", "created_at"],
+                name="shopping_cart_user_created_idx",
+            ),
+        ),
+    ]
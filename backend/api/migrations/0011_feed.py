@@ -0,0 +1,137 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_followers_count(apps, schema_editor):
+    User = apps.get_model("api", "User")
+    Follow = apps.get_model("api", "Follow")
+    User.objects.update(
+        followers_count=Coalesce(
+            Subquery(
+                Follow.objects.filter(author=OuterRef("pk"))
+                .order_by()
+                .values("author")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            Value(0),
+        )
+    )
+
+
+def fill_feed(apps, schema_editor):
+    # Как при подписке: последние 50 рецептов каждого автора.
+    FeedEntry = apps.get_model("api", "FeedEntry")
+    Follow = apps.get_model("api", "Follow")
+    Recipe = apps.get_model("api", "Recipe")
+    schema_editor.execute(
+        f"""
+        INSERT INTO {FeedEntry._meta.db_table}
+            (user_id, recipe_id, author_id, pub_date)
+        SELECT f.user_id, r.id, r.author_id, r.pub_date
+        FROM {Follow._meta.db_table} f
+        CROSS JOIN LATERAL (
+            SELECT id, author_id, pub_date FROM {Recipe._meta.db_table}
+            WHERE author_id = f.author_id
+            ORDER BY pub_date DESC, id DESC
+            LIMIT 50
+        ) r
+        ON CONFLICT DO NOTHING
+        """
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_image_variants"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="followers_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="Количество подписчиков",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["author", "-pub_date", "-id"],
+                name="recipe_author_pub_date_idx",
+            ),
+        ),
+        migrations.CreateModel(
+            name="FeedEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "pub_date",
+                    models.DateTimeField(verbose_name="Дата публикации"),
+                ),
+                (
+                    "author",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Автор рецепта",
+                    ),
+                ),
+                (
+                    "recipe",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feed_entries",
+                        to="api.recipe",
+                        verbose_name="Рецепт",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feed_entries",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Читатель",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Запись ленты",
+                "verbose_name_plural": "Записи ленты",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "recipe"), name="unique_feed_entry"
+                    )
+                ],
+                "indexes": [
+                    models.Index(
+                        fields=["user", "-pub_date", "-recipe"],
+                        name="feed_user_pub_date_idx",
+                    ),
+                    models.Index(
+                        fields=["user", "author", "-pub_date"],
+                        name="feed_user_author_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(fill_followers_count, migrations.RunPython.noop),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+    ]
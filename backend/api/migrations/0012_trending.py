@@ -0,0 +1,77 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_feed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="popularity",
+            field=models.PositiveIntegerField(
+                db_index=True,
+                default=0,
+                editable=False,
+                verbose_name="Популярность за неделю",
+            ),
+        ),
+        migrations.CreateModel(
+            name="RecipeActivity",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "hour",
+                    models.DateTimeField(verbose_name="Начало интервала"),
+                ),
+                (
+                    "favorites",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Добавлений в избранное"
+                    ),
+                ),
+                (
+                    "carts",
+                    models.PositiveIntegerField(
+                        default=0,
+                        verbose_name="Добавлений в список покупок",
+                    ),
+                ),
+                (
+                    "recipe",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="activity",
+                        to="api.recipe",
+                        verbose_name="Рецепт",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Активность по рецепту",
+                "verbose_name_plural": "Активность по рецептам",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("recipe", "hour"),
+                        name="unique_recipe_activity",
+                    )
+                ],
+                "indexes": [
+                    models.Index(
+                        fields=["hour"], name="recipe_activity_hour_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_trending"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="recipeingredient",
+            constraint=models.UniqueConstraint(
+                fields=("ingredient", "recipe"),
+                name="recipe_ingredient_lookup_idx",
+            ),
+        ),
+        migrations.RemoveConstraint(
+            model_name="recipeingredient",
+            name="unique_recipe_ingredient",
+        ),
+        migrations.AlterField(
+            model_name="recipeingredient",
+            name="ingredient",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="ingredient_recipes",
+                to="api.ingredient",
+                verbose_name="Ингредиент",
+            ),
+        ),
+    ]
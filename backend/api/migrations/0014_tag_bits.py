@@ -0,0 +1,70 @@
+from django.db import migrations, models
+
+MAX_TAGS = 63
+
+
+def assign_bits(apps, schema_editor):
+    Tag = apps.get_model("api", "Tag")
+    tags = list(Tag.objects.order_by("pk"))
+    if len(tags) > MAX_TAGS:
+        raise RuntimeError(
+            f"Маска тегов вмещает {MAX_TAGS} тегов, а их {len(tags)}."
+        )
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+    Tag.objects.bulk_update(tags, ["bit"])
+
+
+def fill_tags_mask(apps, schema_editor):
+    Recipe = apps.get_model("api", "Recipe")
+    Tag = apps.get_model("api", "Tag")
+    links = Recipe._meta.get_field("tags").remote_field.through
+    schema_editor.execute(
+        f"""
+        UPDATE {Recipe._meta.db_table} r SET tags_mask = s.mask
+        FROM (
+            SELECT rt.recipe_id, bit_or(1::bigint << t.bit) AS mask
+            FROM {links._meta.db_table} rt
+            JOIN {Tag._meta.db_table} t ON t.id = rt.tag_id
+            GROUP BY rt.recipe_id
+        ) s
+        WHERE r.id = s.recipe_id
+        """
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_recipe_ingredient_lookup_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tag",
+            name="bit",
+            field=models.PositiveSmallIntegerField(
+                editable=False,
+                null=True,
+                verbose_name="Бит в маске рецепта",
+            ),
+        ),
+        migrations.RunPython(assign_bits, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="tag",
+            name="bit",
+            field=models.PositiveSmallIntegerField(
+                editable=False,
+                unique=True,
+                verbose_name="Бит в маске рецепта",
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="tags_mask",
+            field=models.BigIntegerField(
+                default=0, editable=False, verbose_name="Маска тегов"
+            ),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+    ]
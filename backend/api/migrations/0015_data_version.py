@@ -0,0 +1,49 @@
+import time
+
+from django.db import migrations, models
+
+# Общие наборы данных api/versions.py; версии корзин создаются
+# при первом чтении.
+SCOPES = (
+    "catalog:ingredients",
+    "catalog:tags",
+    "index:recipe-ingredients",
+)
+
+
+def create_versions(apps, schema_editor):
+    DataVersion = apps.get_model("api", "DataVersion")
+    DataVersion.objects.bulk_create(
+        [DataVersion(scope=scope, value=time.time_ns()) for scope in SCOPES],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_tag_bits"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DataVersion",
+            fields=[
+                (
+                    "scope",
+                    models.CharField(
+                        max_length=64,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Набор данных",
+                    ),
+                ),
+                ("value", models.BigIntegerField(verbose_name="Версия")),
+            ],
+            options={
+                "verbose_name": "Версия данных",
+                "verbose_name_plural": "Версии данных",
+            },
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+import time
+
+from django.db import migrations
+
+
+def create_version(apps, schema_editor):
+    DataVersion = apps.get_model("api", "DataVersion")
+    DataVersion.objects.bulk_create(
+        [DataVersion(scope="ranking:trending", value=time.time_ns())],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_data_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_trending_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecipeIngredientChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("recipe_id", models.BigIntegerField(verbose_name="Рецепт")),
+                (
+                    "transaction",
+                    models.BigIntegerField(verbose_name="Транзакция"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(verbose_name="Время изменения"),
+                ),
+            ],
+            options={
+                "verbose_name": "Изменение состава рецепта",
+                "verbose_name_plural": "Изменения составов рецептов",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("transaction", "recipe_id"),
+                        name="unique_recipe_ingredient_change",
+                    )
+                ],
+                "indexes": [
+                    models.Index(
+                        fields=["created_at"],
+                        name="recipe_ingr_change_created_idx",
+                    )
+                ],
+            },
+        ),
+    ]
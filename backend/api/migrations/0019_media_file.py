@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0018_recipe_ingredient_change"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MediaFile",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        max_length=255,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Имя файла",
+                    ),
+                ),
+                (
+                    "refcount",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Число ссылок"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Медиафайл",
+                "verbose_name_plural": "Медиафайлы",
+                "db_table": "api_mediafile",
+            },
+        ),
+    ]
@@ -1,7 +1,15 @@
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.contrib.postgres.aggregates import BitOr
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .storage import MEDIA_FILES
 
 
 class User(AbstractUser):
@@ -20,6 +28,16 @@ class User(AbstractUser):
         verbose_name="Аватар", upload_to="users/avatars/",
         null=True, blank=True
     )
+    avatar_variants = models.JSONField(
+        verbose_name="Уменьшенные копии аватара",
+        default=dict, blank=True, editable=False
+    )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name="Количество рецептов", default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name="Количество подписчиков", default=0, editable=False
+    )
 
     groups = models.ManyToManyField(
         Group,
@@ -79,6 +97,10 @@ class Ingredient(models.Model):
         return f"{self.name}, {self.measurement_unit}"
 
 
+# Теги кодируются битами Recipe.tags_mask: bigint без знакового бита.
+MAX_TAGS = 63
+
+
 class Tag(models.Model):
     name = models.CharField(
         verbose_name="Название тега",
@@ -92,6 +114,11 @@ class Tag(models.Model):
         validators=[],
     )
     slug = models.SlugField(verbose_name="Слаг", max_length=50, unique=True)
+    bit = models.PositiveSmallIntegerField(
+        verbose_name="Бит в маске рецепта",
+        unique=True,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = "Тег"
@@ -101,6 +128,79 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        return 1 << self.bit
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            used = set(Tag.objects.values_list("bit", flat=True))
+            free = [bit for bit in range(MAX_TAGS) if bit not in used]
+            if not free:
+                raise ValidationError(
+                    f"Нельзя создать больше {MAX_TAGS} тегов."
+                )
+            self.bit = free[0]
+        super().save(*args, **kwargs)
+
+
+def recipe_tags_mask():
+    """Выражение Recipe.tags_mask по текущим тегам рецепта."""
+    links = Recipe.tags.through.objects.filter(recipe=OuterRef("pk"))
+    return Coalesce(
+        Subquery(
+            links.order_by()
+            .values("recipe")
+            .annotate(
+                mask=BitOr(
+                    Value(1, output_field=models.BigIntegerField())
+                    .bitleftshift(F("tag__bit"))
+                )
+            )
+            .values("mask")
+        ),
+        Value(0),
+    )
+
+
+RECIPE_SEARCH_CONFIG = "russian"
+
+
+def recipe_search_vector():
+    """Выражение tsvector для полнотекстового поиска по рецепту:
+    название весит больше описания."""
+    return SearchVector(
+        "name", weight="A", config=RECIPE_SEARCH_CONFIG
+    ) + SearchVector("text", weight="B", config=RECIPE_SEARCH_CONFIG)
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами текущего пользователя
+        (is_favorited, is_in_shopping_cart, author_is_subscribed),
+        чтобы сериализатор не делал запросов на каждую строку."""
+        if user is None or not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_is_subscribed=Value(False),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(
+                    recipe=OuterRef("pk"), user=user
+                )
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(
+                    recipe=OuterRef("pk"), user=user
+                )
+            ),
+            author_is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef("author"))
+            ),
+        )
+
 
 class Recipe(models.Model):
     author = models.ForeignKey(
@@ -114,6 +214,10 @@ class Recipe(models.Model):
         verbose_name="Изображение",
         upload_to="recipes/images/",
     )
+    image_variants = models.JSONField(
+        verbose_name="Уменьшенные копии изображения",
+        default=dict, blank=True, editable=False
+    )
     text = models.TextField(verbose_name="Описание рецепта")
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -133,27 +237,71 @@ class Recipe(models.Model):
         verbose_name="Дата публикации",
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        verbose_name="Дата изменения",
+        auto_now=True
+    )
     favorited_by = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
+        through="Favorite",
         related_name="favorite_recipes",
         verbose_name="Кто добавил в избранное",
         blank=True,
     )
     in_shopping_cart_for_users = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
+        through="ShoppingCart",
         related_name="shopping_cart_recipes",
         verbose_name="Кто добавил в список покупок",
         blank=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name="В избранном", default=0, editable=False, db_index=True
+    )
+    popularity = models.PositiveIntegerField(
+        verbose_name="Популярность за неделю",
+        default=0, editable=False, db_index=True
+    )
+    search_vector = SearchVectorField(
+        verbose_name="Поисковый вектор", null=True, editable=False
+    )
+    # Биты Tag.bit тегов рецепта; фильтр по тегам — одна проверка
+    # tags_mask & маска <> 0 без JOIN. Поддерживается сигналом
+    # m2m_changed (api/signals.py).
+    tags_mask = models.BigIntegerField(
+        verbose_name="Маска тегов", default=0, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(
+                fields=["-pub_date", "-id"], name="recipe_pub_date_id_idx"
+            ),
+            models.Index(
+                fields=["author", "-pub_date", "-id"],
+                name="recipe_author_pub_date_idx",
+            ),
+            GinIndex(
+                fields=["search_vector"], name="recipe_search_vector_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"name", "text"} & set(update_fields):
+            Recipe.objects.filter(pk=self.pk).update(
+                search_vector=recipe_search_vector()
+            )
+
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
@@ -162,11 +310,14 @@ class RecipeIngredient(models.Model):
         related_name="recipe_ingredients",
         verbose_name="Рецепт",
     )
+    # Отдельный индекс по ingredient не нужен: его покрывает
+    # recipe_ingredient_lookup_idx.
     ingredient = models.ForeignKey(
         Ingredient,
         on_delete=models.PROTECT,
         related_name="ingredient_recipes",
         verbose_name="Ингредиент",
+        db_index=False,
     )
     amount = models.PositiveIntegerField(
         verbose_name="Количество", validators=[MinValueValidator(1)]
@@ -176,9 +327,14 @@ class RecipeIngredient(models.Model):
         verbose_name = "Ингредиент в рецепте"
         verbose_name_plural = "Ингредиенты в рецептах"
         constraints = [
+            # Один индекс и для уникальности, и для фильтров
+            # ingredients / exclude_ingredients (api/filters.py): второй
+            # составной индекс (recipe, ingredient) перехватывал у него
+            # проверки составов. Выборки по рецепту идут по индексу
+            # внешнего ключа recipe.
             models.UniqueConstraint(
-                fields=["recipe", "ingredient"],
-                name="unique_recipe_ingredient"
+                fields=["ingredient", "recipe"],
+                name="recipe_ingredient_lookup_idx",
             )
         ]
 
@@ -188,6 +344,70 @@ class RecipeIngredient(models.Model):
         in "{self.recipe.name}"'''
 
 
+class UserRecipeRelation(models.Model):
+    """Связь пользователя с рецептом (избранное, список покупок).
+    Добавление и удаление — api/relations.py."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name="Рецепт",
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Дата добавления"
+    )
+
+    class Meta:
+        abstract = True
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.user}: {self.recipe}"
+
+
+class Favorite(UserRecipeRelation):
+    class Meta(UserRecipeRelation.Meta):
+        verbose_name = "Избранное"
+        verbose_name_plural = "Избранное"
+        default_related_name = "favorites"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"],
+                name="unique_favorite"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "created_at"], name="favorite_user_created_idx"
+            )
+        ]
+
+
+class ShoppingCart(UserRecipeRelation):
+    class Meta(UserRecipeRelation.Meta):
+        verbose_name = "Рецепт в списке покупок"
+        verbose_name_plural = "Рецепты в списках покупок"
+        default_related_name = "shopping_cart"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"],
+                name="unique_shopping_cart"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "created_at"],
+                name="shopping_cart_user_created_idx"
+            )
+        ]
+
+
 class Follow(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -223,3 +443,185 @@ class Follow(models.Model):
 
     def __str__(self):
         return f"{self.user} follows {self.author}"
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписок пользователя (см. api/feed.py).
+    pub_date и author скопированы из рецепта, чтобы лента читалась
+    по индексу без соединения с рецептами."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+        verbose_name="Читатель",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+        verbose_name="Рецепт",
+    )
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Автор рецепта",
+    )
+    pub_date = models.DateTimeField(verbose_name="Дата публикации")
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи ленты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"], name="unique_feed_entry"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-pub_date", "-recipe"],
+                name="feed_user_pub_date_idx",
+            ),
+            models.Index(
+                fields=["user", "author", "-pub_date"],
+                name="feed_user_author_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.recipe}"
+
+
+class RecipeActivity(models.Model):
+    """Сколько раз рецепт добавили в избранное и в список покупок
+    за час (старые часы сворачиваются в сутки, см. api/trending.py)."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="activity",
+        verbose_name="Рецепт",
+    )
+    hour = models.DateTimeField(verbose_name="Начало интервала")
+    favorites = models.PositiveIntegerField(
+        verbose_name="Добавлений в избранное", default=0
+    )
+    carts = models.PositiveIntegerField(
+        verbose_name="Добавлений в список покупок", default=0
+    )
+
+    class Meta:
+        verbose_name = "Активность по рецепту"
+        verbose_name_plural = "Активность по рецептам"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipe", "hour"], name="unique_recipe_activity"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["hour"], name="recipe_activity_hour_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.recipe} @ {self.hour}: {self.favorites}/{self.carts}"
+
+
+class ShoppingCartItem(models.Model):
+    """Сумма ингредиента по всем рецептам в списке покупок
+    пользователя (см. api/shopping_cart.py)."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="shopping_cart_items",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_cart_items",
+        verbose_name="Ингредиент",
+    )
+    amount = models.IntegerField(verbose_name="Количество")
+
+    class Meta:
+        verbose_name = "Позиция списка покупок"
+        verbose_name_plural = "Позиции списка покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_cart_item"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.ingredient} x {self.amount}"
+
+
+class DataVersion(models.Model):
+    """Версия набора данных (см. api/versions.py). Хранится в БД, чтобы
+    сдвиг версии из любого процесса — веб-воркера, фоновой задачи или
+    команды управления — сразу видели все остальные."""
+
+    scope = models.CharField(
+        verbose_name="Набор данных", max_length=64, primary_key=True
+    )
+    value = models.BigIntegerField(verbose_name="Версия")
+
+    class Meta:
+        verbose_name = "Версия данных"
+        verbose_name_plural = "Версии данных"
+
+    def __str__(self):
+        return f"{self.scope}: {self.value}"
+
+
+class RecipeIngredientChange(models.Model):
+    """Рецепт, состав которого изменился в транзакции transaction.
+    По этому журналу процессы обновляют индекс «что приготовить»
+    точечно (см. api/recipe_ingredient_index.py). Связи с рецептом
+    нет: удаление рецепта тоже записывается в журнал."""
+
+    recipe_id = models.BigIntegerField(verbose_name="Рецепт")
+    transaction = models.BigIntegerField(verbose_name="Транзакция")
+    created_at = models.DateTimeField(verbose_name="Время изменения")
+
+    class Meta:
+        verbose_name = "Изменение состава рецепта"
+        verbose_name_plural = "Изменения составов рецептов"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["transaction", "recipe_id"],
+                name="unique_recipe_ingredient_change",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["created_at"],
+                name="recipe_ingr_change_created_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id} @ {self.transaction}"
+
+
+class MediaFile(models.Model):
+    """Число записей, которым хранилище выдало файл name
+    (см. api/media.py)."""
+
+    name = models.CharField(
+        verbose_name="Имя файла", max_length=255, primary_key=True
+    )
+    refcount = models.PositiveIntegerField(
+        verbose_name="Число ссылок", default=0
+    )
+
+    class Meta:
+        db_table = MEDIA_FILES
+        verbose_name = "Медиафайл"
+        verbose_name_plural = "Медиафайлы"
+
+    def __str__(self):
+        return f"{self.name}: {self.refcount}"
@@ -0,0 +1,13 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class FileFormatContentNegotiation(DefaultContentNegotiation):
+    """
+    Для выгрузок параметр ?format= выбирает формат файла, а не рендерер
+    DRF, поэтому служебные ответы (ошибки) всегда отдаются первым
+    рендерером представления.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderer = renderers[0]
+        return renderer, renderer.media_type
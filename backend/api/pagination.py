@@ -1,5 +1,142 @@
-from rest_framework.pagination import PageNumberPagination
+from datetime import datetime
+
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    Cursor,
+    CursorPagination,
+    PageNumberPagination,
+)
+
+from .feed import read_feed
+
+# Ключи — bigint в БД: курсор с номером больше не дойдёт до запроса.
+MAX_KEY_ID = 2 ** 63 - 1
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = "limit"
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset-пагинация по ключу (pub_date, id) от новых к старым.
+    Курсор DRF хранит первое поле порядка и смещение среди строк с тем
+    же значением; здесь он несёт обе части ключа крайней строки
+    страницы, а следующая страница выбирается сравнением строк
+    (pub_date, id) < (%s, %s) по индексу, без OFFSET. Подклассы
+    читают страницу в fetch().
+    """
+
+    page_size_query_param = "limit"
+
+    def fetch(self, source, key, reverse, limit):
+        """До limit строк source с ключом меньше key по убыванию, при
+        reverse — больше key по возрастанию; key None — с начала."""
+        raise NotImplementedError
+
+    def row_key(self, row):
+        return row
+
+    def encode_key(self, key):
+        pub_date, pk = key
+        return f"{pub_date.isoformat()} {pk}"
+
+    def decode_key(self, position):
+        if position is None:
+            return None
+        try:
+            pub_date, pk = position.split(" ")
+            pub_date, pk = datetime.fromisoformat(pub_date), int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not 0 < pk <= MAX_KEY_ID:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        self.key = self.decode_key(self.cursor and self.cursor.position)
+        rows = list(
+            self.fetch(queryset, self.key, reverse, self.page_size + 1)
+        )
+        more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = self.key is not None, more
+        else:
+            self.has_next, self.has_previous = more, self.key is not None
+        return self.page
+
+    def _link(self, row, reverse):
+        key = self.key if row is None else self.row_key(row)
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=reverse, position=self.encode_key(key))
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self._link(self.page[-1] if self.page else None, False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self._link(self.page[0] if self.page else None, True)
+
+
+class RecipeCursorPagination(KeysetCursorPagination):
+    """
+    Keyset-пагинация ленты рецептов по (-pub_date, -id) и индексу
+    recipe_pub_date_id_idx. Включается параметром ?pagination=cursor
+    (или наличием ?cursor=), не выполняет COUNT(*) и OFFSET и даёт
+    стабильные страницы при добавлении новых рецептов.
+    """
+
+    ordering = ("-pub_date", "-id")
+    mode_query_param = "pagination"
+    mode_query_value = "cursor"
+
+    @classmethod
+    def is_requested(cls, request):
+        params = request.query_params
+        return (
+            params.get(cls.mode_query_param) == cls.mode_query_value
+            or cls.cursor_query_param in params
+        )
+
+    def fetch(self, queryset, key, reverse, limit):
+        if key is not None:
+            table = queryset.model._meta.db_table
+            queryset = queryset.filter(
+                RawSQL(
+                    f'("{table}"."pub_date", "{table}"."id") '
+                    f'{">" if reverse else "<"} (%s, %s)',
+                    key,
+                    output_field=BooleanField(),
+                )
+            )
+        # Порядок фиксирован: под него построен индекс.
+        ordering = ("pub_date", "id") if reverse else self.ordering
+        return queryset.order_by(*ordering)[:limit]
+
+    def row_key(self, row):
+        return row.pub_date, row.pk
+
+
+class FeedCursorPagination(KeysetCursorPagination):
+    """Лента подписок (api/feed.py): source — id читателя, строки —
+    пары (pub_date, recipe_id)."""
+
+    ordering = ("-pub_date", "-recipe_id")
+
+    def fetch(self, source, key, reverse, limit):
+        return read_feed(source, key, reverse, limit)
@@ -0,0 +1,58 @@
+"""
+Кэш независимой от пользователя части представления рецепта.
+Ссылки на файлы хранятся относительными и дополняются хостом
+при выдаче, поэтому запись годится для любого запроса.
+
+Ключ содержит Recipe.updated_at: рецепт и так читается из БД перед
+сериализацией, а изменение updated_at в транзакции правки делает
+прежнюю запись недостижимой для всех процессов сразу после коммита,
+даже если кэш у каждого процесса свой.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Recipe
+from .versions import INGREDIENTS_CATALOG, get_version
+
+RECIPE_CACHE_KEY = "recipe:repr:{pk}:{updated}:{catalog}"
+RECIPE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _keys(recipes):
+    # Названия ингредиентов входят в представление, поэтому ключ
+    # привязан и к версии каталога ингредиентов.
+    catalog = get_version(INGREDIENTS_CATALOG)
+    return {
+        recipe.pk: RECIPE_CACHE_KEY.format(
+            pk=recipe.pk,
+            updated=recipe.updated_at.timestamp(),
+            catalog=catalog,
+        )
+        for recipe in recipes
+    }
+
+
+def get_cached_recipes(recipes):
+    """Возвращает {pk: представление} для найденных в кэше рецептов
+    одним multi-get."""
+    keys = _keys(recipes)
+    found = cache.get_many(keys.values())
+    return {pk: found[key] for pk, key in keys.items() if key in found}
+
+
+def cache_recipes(representations):
+    """representations — {рецепт: представление}."""
+    keys = _keys(representations)
+    cache.set_many(
+        {keys[recipe.pk]: data for recipe, data in representations.items()},
+        RECIPE_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_recipes(pks):
+    """Делает кэш рецептов устаревшим, сдвигая их updated_at в текущей
+    транзакции; параллельный запрос до коммита кэширует данные под
+    прежним ключом."""
+    pks = list(pks)
+    if pks:
+        Recipe.objects.filter(pk__in=pks).update(updated_at=timezone.now())
@@ -0,0 +1,270 @@
+"""
+Обратный индекс «ингредиент -> рецепты» в памяти процесса для поиска
+«что приготовить из того, что есть». Списки рецептов хранятся
+отсортированными массивами array("l"), состав рецептов — тоже, поэтому
+запрос обходится подсчётом вхождений по спискам нужных ингредиентов
+без обращения к БД.
+
+Целиком индекс строится при первом обращении, после массовых загрузок
+(они сдвигают версию RECIPE_INGREDIENTS) и после долгого простоя.
+Остальные изменения записываются в журнал RecipeIngredientChange в
+той же транзакции — одна запись на рецепт за транзакцию (см.
+api/recipe_ingredients.py и api/signals.py), а каждый процесс при
+обращении к индексу читает из журнала новые записи и перечитывает
+составы только этих рецептов. Граница чтения — xmin снимка БД: записи
+транзакций, зафиксированных не по порядку номеров, не теряются.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, namedtuple
+from datetime import timedelta
+from itertools import chain, groupby
+from operator import itemgetter
+
+from django.db import connection, transaction
+
+from .models import RecipeIngredient, RecipeIngredientChange
+from .versions import RECIPE_INGREDIENTS, get_version
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_INGREDIENTS = 200
+
+# Записи журнала старше этого удаляются; процесс, не читавший журнал
+# дольше половины срока, строит индекс заново.
+CHANGES_RETENTION = timedelta(days=1)
+RESYNC_AFTER = CHANGES_RETENTION.total_seconds() / 2
+
+CHANGES = RecipeIngredientChange._meta.db_table
+
+
+class RecipeIngredientIndex:
+    def __init__(self, postings, compositions):
+        self._postings = postings
+        self._compositions = compositions
+
+    @classmethod
+    def from_rows(cls, rows):
+        """rows — пары (ingredient_id, recipe_id), отсортированные
+        по ingredient_id, recipe_id."""
+        postings = {}
+        compositions = {}
+        for ingredient_id, group in groupby(rows, key=itemgetter(0)):
+            recipes = array("l", (recipe_id for _, recipe_id in group))
+            postings[ingredient_id] = recipes
+            for recipe_id in recipes:
+                compositions.setdefault(recipe_id, array("l")).append(
+                    ingredient_id
+                )
+        return cls(postings, compositions)
+
+    def __len__(self):
+        return len(self._compositions)
+
+    def replace(self, compositions):
+        """
+        Новый индекс, в котором составы рецептов заменены на
+        compositions {recipe_id: [ingredient_id]}; пустой состав
+        убирает рецепт. Изменённые списки копируются, остальные общие
+        с этим индексом, поэтому поиск по нему продолжает работать.
+        """
+        postings = dict(self._postings)
+        recipes = dict(self._compositions)
+        copied = set()
+
+        def posting(ingredient_id):
+            if ingredient_id not in copied:
+                copied.add(ingredient_id)
+                postings[ingredient_id] = array(
+                    "l", postings.get(ingredient_id, ())
+                )
+            return postings[ingredient_id]
+
+        for recipe_id, ingredient_ids in compositions.items():
+            for ingredient_id in recipes.pop(recipe_id, ()):
+                listed = posting(ingredient_id)
+                position = bisect_left(listed, recipe_id)
+                if position < len(listed) and listed[position] == recipe_id:
+                    del listed[position]
+            if ingredient_ids:
+                recipes[recipe_id] = array("l", sorted(set(ingredient_ids)))
+                for ingredient_id in recipes[recipe_id]:
+                    insort(posting(ingredient_id), recipe_id)
+        for ingredient_id in copied:
+            if not postings[ingredient_id]:
+                del postings[ingredient_id]
+        return RecipeIngredientIndex(postings, recipes)
+
+    def search(self, ingredient_ids, limit):
+        """
+        Рецепты, в которых есть хотя бы один из ingredient_ids, по
+        убыванию доли имеющихся ингредиентов, затем по числу
+        недостающих. Возвращает (recipe_id, coverage, missing_ids).
+        """
+        on_hand = set(ingredient_ids)
+        matches = Counter(
+            chain.from_iterable(
+                self._postings[pk] for pk in on_hand if pk in self._postings
+            )
+        )
+        ranked = sorted(
+            matches.items(),
+            key=lambda item: (
+                -item[1] / len(self._compositions[item[0]]),
+                len(self._compositions[item[0]]) - item[1],
+                -item[0],
+            ),
+        )[:limit]
+        return [
+            (
+                recipe_id,
+                matched / len(self._compositions[recipe_id]),
+                [
+                    pk for pk in self._compositions[recipe_id]
+                    if pk not in on_hand
+                ],
+            )
+            for recipe_id, matched in ranked
+        ]
+
+
+class _Recorded:
+    """Рецепты, уже записанные в журнал текущей транзакцией. Хранится
+    в очереди on_commit соединения, поэтому при откате точки
+    сохранения пропадает вместе с записями журнала."""
+
+    def __init__(self, recipe_ids):
+        self.recipe_ids = recipe_ids
+
+    def __call__(self):
+        pass
+
+
+def _recorded():
+    return set().union(
+        *(
+            func.recipe_ids
+            for _, func, _ in connection.run_on_commit
+            if isinstance(func, _Recorded)
+        )
+    )
+
+
+def record_changes(recipe_ids):
+    """Записывает в журнал рецепты, состав которых меняет текущая
+    транзакция, и удаляет записи старше CHANGES_RETENTION. Рецепт,
+    уже записанный этой транзакцией, повторно не пишется."""
+    recipe_ids = set(recipe_ids)
+    if connection.in_atomic_block:
+        recipe_ids -= _recorded()
+    if not recipe_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH expired AS (
+                DELETE FROM {CHANGES} WHERE created_at < now() - %s
+            )
+            INSERT INTO {CHANGES} (recipe_id, transaction, created_at)
+            SELECT recipe_id, txid_current(), now()
+            FROM unnest(%s::bigint[]) AS recipe_id
+            ON CONFLICT (transaction, recipe_id) DO NOTHING
+            """,
+            [CHANGES_RETENTION, sorted(recipe_ids)],
+        )
+    if connection.in_atomic_block:
+        transaction.on_commit(_Recorded(recipe_ids))
+
+
+def read_changes(since):
+    """
+    (xmin, own, записи): xmin снимка БД, номер текущей транзакции,
+    если она уже что-то записала, и записи журнала (транзакция,
+    рецепт) из транзакций с номером не меньше since (без since — не
+    меньше xmin). Транзакции младше xmin в снимке уже зафиксированы
+    или отменены, поэтому следующему чтению достаточно начать с xmin.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT snapshot.xmin, txid_current_if_assigned(), ARRAY(
+                SELECT ARRAY[transaction, recipe_id] FROM {CHANGES}
+                WHERE transaction >= COALESCE(%s::bigint, snapshot.xmin)
+            )
+            FROM (
+                SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin
+            ) AS snapshot
+            """,
+            [since],
+        )
+        xmin, own, changes = cursor.fetchone()
+    return xmin, own, {tuple(change) for change in changes}
+
+
+def read_compositions(recipe_ids):
+    compositions = {recipe_id: [] for recipe_id in recipe_ids}
+    rows = RecipeIngredient.objects.filter(recipe__in=recipe_ids)
+    for recipe_id, ingredient_id in rows.values_list("recipe", "ingredient"):
+        compositions[recipe_id].append(ingredient_id)
+    return compositions
+
+
+# applied — записи журнала не младше xmin, уже учтённые в index.
+# Записи своей транзакции в applied не попадают: она может изменить
+# те же рецепты ещё раз, не добавляя записей.
+_State = namedtuple("_State", "version xmin applied index synced_at")
+
+_lock = threading.Lock()
+_state = None
+
+
+def _build(version):
+    # Журнал читается до составов: изменения, зафиксированные между
+    # двумя запросами, применятся ещё раз, а это безопасно.
+    xmin, own, changes = read_changes(None)
+    applied = {change for change in changes if change[0] != own}
+    rows = (
+        RecipeIngredient.objects.order_by("ingredient", "recipe")
+        .values_list("ingredient", "recipe")
+        .iterator(chunk_size=10000)
+    )
+    index = RecipeIngredientIndex.from_rows(rows)
+    return _State(version, xmin, applied, index, time.monotonic())
+
+
+def _update(state):
+    xmin, own, changes = read_changes(state.xmin)
+    index = state.index
+    changed = {change[1] for change in changes - state.applied}
+    if changed:
+        index = index.replace(read_compositions(changed))
+    applied = {
+        change for change in changes
+        if change[0] >= xmin and change[0] != own
+    }
+    return _State(state.version, xmin, applied, index, time.monotonic())
+
+
+def get_recipe_ingredient_index():
+    global _state
+    version = get_version(RECIPE_INGREDIENTS)
+    state = _state
+    # Первый запрос ждёт построения; остальные, пока другой поток
+    # обновляет индекс, получают текущий.
+    if not _lock.acquire(blocking=state is None):
+        return state.index
+    try:
+        state = _state
+        if (
+            state is None
+            or state.version != version
+            or time.monotonic() - state.synced_at > RESYNC_AFTER
+        ):
+            _state = _build(version)
+        else:
+            _state = _update(state)
+        return _state.index
+    finally:
+        _lock.release()
@@ -0,0 +1,35 @@
+"""
+Состав рецептов. Строки RecipeIngredient пишутся пакетно
+(bulk_create и DELETE без сигналов), поэтому всё, что зависит от
+состава, обновляется один раз на рецепт: сводные корзины, кэш
+представления, индекс «что приготовить» и версии корзин.
+"""
+from .models import RecipeIngredient, ShoppingCart
+from .recipe_cache import invalidate_recipes
+from .recipe_ingredient_index import record_changes
+from .shopping_cart import apply_to_carts
+from .versions import bump_cart_versions
+
+
+def ingredients_changed(recipe_ids):
+    """Вызывается в транзакции, изменившей составы recipe_ids."""
+    recipe_ids = list(recipe_ids)
+    invalidate_recipes(recipe_ids)
+    record_changes(recipe_ids)
+    bump_cart_versions(
+        ShoppingCart.objects.filter(recipe__in=recipe_ids).values_list(
+            "user_id", flat=True
+        )
+    )
+
+
+def set_ingredients(recipe, items):
+    """Заменяет состав рецепта на items — пары (ингредиент, количество)."""
+    apply_to_carts(-1, recipe_ids=[recipe.pk])
+    RecipeIngredient.objects.filter(recipe=recipe).delete()
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient, amount in items
+    )
+    apply_to_carts(1, recipe_ids=[recipe.pk])
+    ingredients_changed([recipe.pk])
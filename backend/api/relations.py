@@ -0,0 +1,88 @@
+"""
+Избранное и список покупок: добавление одним INSERT ... ON CONFLICT
+DO NOTHING, удаление одним DELETE. RETURNING сообщает, какие связи
+действительно изменились, поэтому повторные и одновременные запросы
+не требуют предварительной проверки. Счётчики, сводная корзина,
+версия корзины и рейтинг популярных (api/trending.py) обновляются
+только для изменившихся связей.
+Изменения через менеджеры M2M обслуживаются m2m_changed
+(api/signals.py).
+"""
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Favorite, Recipe, ShoppingCart
+from .shopping_cart import apply_to_cart
+from .trending import record_activity
+from .versions import bump_cart_versions
+
+
+def _favorites_changed(user_id, recipe_ids, sign):
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        favorites_count=F("favorites_count") + sign
+    )
+    if sign > 0:
+        record_activity(recipe_ids, favorites=1)
+
+
+def _shopping_cart_changed(user_id, recipe_ids, sign):
+    apply_to_cart(sign, user_id, recipe_ids)
+    bump_cart_versions([user_id])
+    if sign > 0:
+        record_activity(recipe_ids, carts=1)
+
+
+ON_CHANGE = {
+    Favorite: _favorites_changed,
+    ShoppingCart: _shopping_cart_changed,
+}
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def add_recipes(model, user, recipe_ids):
+    """Добавляет существующие рецепты из recipe_ids в связь model
+    пользователя и возвращает множество добавленных id."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {model._meta.db_table}
+                (user_id, recipe_id, created_at)
+            SELECT %s, id, %s FROM {Recipe._meta.db_table}
+            WHERE id IN ({_placeholders(recipe_ids)})
+            ON CONFLICT (user_id, recipe_id) DO NOTHING
+            RETURNING recipe_id
+            """,
+            [user.pk, timezone.now(), *recipe_ids],
+        )
+        added = {row[0] for row in cursor.fetchall()}
+        if added:
+            ON_CHANGE[model](user.pk, added, 1)
+    return added
+
+
+def remove_recipes(model, user, recipe_ids):
+    """Удаляет рецепты recipe_ids из связи model пользователя
+    и возвращает множество удалённых id."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {model._meta.db_table}
+            WHERE user_id = %s AND recipe_id IN ({_placeholders(recipe_ids)})
+            RETURNING recipe_id
+            """,
+            [user.pk, *recipe_ids],
+        )
+        removed = {row[0] for row in cursor.fetchall()}
+        if removed:
+            ON_CHANGE[model](user.pk, removed, -1)
+    return removed
@@ -1,5 +1,9 @@
+import json
+
 from rest_framework import serializers
 from django.db import transaction
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from drf_extra_fields.fields import Base64ImageField
 from django.contrib.auth.validators import (
     UnicodeUsernameValidator,
@@ -7,6 +11,9 @@ from django.contrib.auth.validators import (
 from rest_framework.validators import (
     UniqueValidator,
 )
+from .media import release_file
+from .recipe_cache import cache_recipes, get_cached_recipes
+from .recipe_ingredients import set_ingredients
 from .models import (
     Ingredient,
     Recipe,
@@ -15,11 +22,77 @@ from .models import (
     User,
     Follow,
 )
+from django.core.files.storage import default_storage
 from django.core.validators import (
     MinValueValidator,
 )
 
 
+def variant_urls(variants, absolute=None):
+    """{размер: {формат: имя файла}} -> {размер: {формат: url}}."""
+    return {
+        size: {
+            image_format: absolute(url) if absolute else url
+            for image_format, url in formats.items()
+        }
+        for size, formats in variants.items()
+    }
+
+
+class ImageUploadField(Base64ImageField):
+    """Изображение строкой base64 (JSON) или файлом
+    (multipart/form-data): файл не декодируется в память целиком."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            return super().to_internal_value(data)
+        return serializers.ImageField.to_internal_value(self, data)
+
+
+def multipart_to_dict(data, list_fields):
+    """
+    QueryDict из multipart/form-data -> обычный словарь. Поля
+    list_fields принимаются повторяющимися ключами или одной
+    JSON-строкой (вложенные объекты, например ингредиенты, иначе
+    в форме не передать).
+    """
+    result = {key: data.get(key) for key in data}
+    for key in list_fields:
+        if key not in data:
+            continue
+        values = data.getlist(key)
+        if len(values) == 1 and isinstance(values[0], str) and (
+            values[0].lstrip().startswith("[")
+        ):
+            try:
+                values = json.loads(values[0])
+            except ValueError:
+                raise serializers.ValidationError(
+                    {key: "Некорректный JSON."}
+                )
+        result[key] = values
+    return result
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Уменьшенные копии изображения (см. api/images.py); пустой
+    словарь, пока копии не построены."""
+
+    def to_representation(self, value):
+        request = self.context.get("request")
+        return variant_urls(
+            {
+                size: {
+                    image_format: default_storage.url(name)
+                    for image_format, name in formats.items()
+                }
+                for size, formats in value.items()
+                if size != "source"
+            },
+            request.build_absolute_uri if request is not None else None,
+        )
+
+
 class CustomUserCreateSerializer(serializers.ModelSerializer):
     username = serializers.CharField(
         validators=[
@@ -58,6 +131,7 @@ class CustomUserSerializer(serializers.ModelSerializer):
         required=False,
         allow_null=True
     )
+    avatar_variants = ImageVariantsField()
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -70,6 +144,7 @@ class CustomUserSerializer(serializers.ModelSerializer):
             "last_name",
             "is_subscribed",
             "avatar",
+            "avatar_variants",
         )
 
     def get_is_subscribed(self, obj):
@@ -94,6 +169,7 @@ class CustomUserSerializer(serializers.ModelSerializer):
                 "last_name": "",
                 "is_subscribed": False,
                 "avatar": None,
+                "avatar_variants": {},
             }
         return super().to_representation(instance)
 
@@ -131,12 +207,113 @@ class IngredientSerializer(
         fields = ("id", "name", "measurement_unit")
 
 
+class RecipeCachedSerializer(serializers.ModelSerializer):
+    """
+    Независимая от пользователя часть представления рецепта.
+    Сериализуется без request, поэтому ссылки на файлы относительные,
+    а флаги пользователя не заполняются.
+    """
+
+    author = CustomUserSerializer(read_only=True)
+    image = serializers.ImageField(read_only=True)
+    image_variants = ImageVariantsField()
+    ingredients = RecipeIngredientReadSerializer(
+        source="recipe_ingredients", many=True, read_only=True
+    )
+
+    class Meta:
+        model = Recipe
+        fields = (
+            "id",
+            "author",
+            "name",
+            "image",
+            "image_variants",
+            "text",
+            "cooking_time",
+            "ingredients",
+        )
+
+
+def build_cached_recipes(pks):
+    """Сериализует общую часть рецептов pks двумя запросами
+    и кладёт результат в кэш."""
+    representations = {
+        recipe: RecipeCachedSerializer(recipe).data
+        for recipe in Recipe.objects.filter(pk__in=pks)
+        .select_related("author")
+        .prefetch_related(
+            Prefetch(
+                "recipe_ingredients",
+                queryset=RecipeIngredient.objects.select_related(
+                    "ingredient"
+                ),
+            )
+        )
+    }
+    cache_recipes(representations)
+    return {recipe.pk: data for recipe, data in representations.items()}
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """
+    Собирает страницу рецептов из кэша одним multi-get; промахи
+    дочитываются одним запросом с prefetch, а флаги пользователя для
+    рецептов без аннотаций with_user_flags получаются пакетно.
+    """
+
+    def to_representation(self, data):
+        recipes = list(data.all() if hasattr(data, "all") else data)
+        bases = get_cached_recipes(recipes)
+        missing = [recipe.pk for recipe in recipes if recipe.pk not in bases]
+        if missing:
+            bases.update(build_cached_recipes(missing))
+        self.load_user_flags(recipes)
+        return [
+            self.child.apply_user_fields(bases[recipe.pk], recipe)
+            for recipe in recipes
+            if recipe.pk in bases
+        ]
+
+    def load_user_flags(self, recipes):
+        pending = [
+            recipe for recipe in recipes
+            if not hasattr(recipe, "is_favorited")
+        ]
+        if not pending:
+            return
+        request = self.context.get("request")
+        user = getattr(request, "user", None)
+        favorited, in_cart, subscribed = set(), set(), set()
+        if user and user.is_authenticated:
+            pks = [recipe.pk for recipe in pending]
+            favorited = set(
+                user.favorite_recipes.filter(pk__in=pks)
+                .values_list("pk", flat=True)
+            )
+            in_cart = set(
+                user.shopping_cart_recipes.filter(pk__in=pks)
+                .values_list("pk", flat=True)
+            )
+            subscribed = set(
+                Follow.objects.filter(
+                    user=user,
+                    author__in={recipe.author_id for recipe in pending},
+                ).values_list("author_id", flat=True)
+            )
+        for recipe in pending:
+            recipe.is_favorited = recipe.pk in favorited
+            recipe.is_in_shopping_cart = recipe.pk in in_cart
+            recipe.author_is_subscribed = recipe.author_id in subscribed
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
-    image = Base64ImageField(required=True)
+    image = ImageUploadField(required=True)
+    image_variants = ImageVariantsField()
     cooking_time = serializers.IntegerField(
         validators=[
             MinValueValidator(
@@ -167,13 +344,22 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_variants",
             "text",
             "cooking_time",
             "tags",
             "ingredients",
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_internal_value(self, data):
+        if hasattr(data, "getlist"):
+            data = multipart_to_dict(data, ("tags", "ingredients"))
+        return super().to_internal_value(data)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
         request = self.context.get("request")
         user = getattr(request, "user", None)
         if user and user.is_authenticated:
@@ -181,6 +367,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
         request = self.context.get("request")
         user = getattr(request, "user", None)
         if user and user.is_authenticated:
@@ -189,22 +377,46 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         """Готовим данные для вывода (JSON ответа),
-        чтобы соответствовать RecipeList."""
-        representation = super().to_representation(
-            instance
-        )
-        representation["ingredients"] = RecipeIngredientReadSerializer(
-            instance.recipe_ingredients.all(),
-            many=True,
-            context=self.context,
-        ).data
-
-        representation.pop(
-            "tags_for_processing", None
-        )
-        representation.pop("ingredients_for_processing", None)
+        чтобы соответствовать RecipeList: общая часть берётся
+        из кэша, поверх неё кладутся поля текущего пользователя."""
+        base = get_cached_recipes([instance]).get(instance.pk)
+        if base is None:
+            base = build_cached_recipes([instance.pk])[instance.pk]
+        return self.apply_user_fields(base, instance)
+
+    def apply_user_fields(self, base, instance):
+        request = self.context.get("request")
 
-        return representation
+        def absolute(url):
+            if url and request is not None:
+                return request.build_absolute_uri(url)
+            return url
+
+        if hasattr(instance, "author_is_subscribed"):
+            is_subscribed = instance.author_is_subscribed
+        else:
+            is_subscribed = CustomUserSerializer(
+                context=self.context
+            ).get_is_subscribed(instance.author)
+        return {
+            "id": base["id"],
+            "author": {
+                **base["author"],
+                "is_subscribed": is_subscribed,
+                "avatar": absolute(base["author"]["avatar"]),
+                "avatar_variants": variant_urls(
+                    base["author"]["avatar_variants"], absolute
+                ),
+            },
+            "is_favorited": self.get_is_favorited(instance),
+            "is_in_shopping_cart": self.get_is_in_shopping_cart(instance),
+            "name": base["name"],
+            "image": absolute(base["image"]),
+            "image_variants": variant_urls(base["image_variants"], absolute),
+            "text": base["text"],
+            "cooking_time": base["cooking_time"],
+            "ingredients": base["ingredients"],
+        }
 
     def validate(self, data):
 
@@ -295,8 +507,9 @@ class RecipeSerializer(serializers.ModelSerializer):
             f'''[DEBUG CREATE RECIPE] Validated data BEFORE POP:
             {validated_data}'''
         )
-        ingredients_list_data = validated_data.pop
-        ("ingredients_for_processing")
+        ingredients_list_data = validated_data.pop(
+            "ingredients_for_processing"
+        )
         tags_list_data = validated_data.pop("tags_for_processing", None)
         print(
             f"[DEBUG CREATE RECIPE] Ingredients data: {ingredients_list_data}"
@@ -326,8 +539,9 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_list_data = validated_data.pop
-        ("ingredients_for_processing", None)
+        ingredients_list_data = validated_data.pop(
+            "ingredients_for_processing", None
+        )
         tags_list_data = validated_data.pop("tags_for_processing", None)
 
         instance.name = validated_data.get("name", instance.name)
@@ -336,23 +550,24 @@ class RecipeSerializer(serializers.ModelSerializer):
             "cooking_time", instance.cooking_time
         )
 
+        old_image = instance.image.name
         if "image" in validated_data:
             instance.image = validated_data["image"]
 
         instance.save()
+        if "image" in validated_data:
+            # Хранилище засчитало новой картинке ссылку, даже если
+            # содержимое не изменилось.
+            release_file(Recipe, "image", old_image)
 
         if ingredients_list_data is not None:
-            RecipeIngredient.objects.filter(recipe=instance).delete()
-            recipe_ingredients_to_create = []
-            for item_data in ingredients_list_data:
-                recipe_ingredients_to_create.append(
-                    RecipeIngredient(
-                        recipe=instance,
-                        ingredient=item_data["id"],
-                        amount=item_data["amount"],
-                    )
-                )
-            RecipeIngredient.objects.bulk_create(recipe_ingredients_to_create)
+            set_ingredients(
+                instance,
+                [
+                    (item_data["id"], item_data["amount"])
+                    for item_data in ingredients_list_data
+                ],
+            )
 
         if (
             tags_list_data is not None
@@ -366,6 +581,17 @@ class RecipeSerializer(serializers.ModelSerializer):
         return instance
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного изменения избранного
+    и списка покупок."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
     """
     Минимальный сериализатор для рецептов, используемый при добавлении
@@ -373,11 +599,43 @@ class RecipeMinifiedSerializer(serializers.ModelSerializer):
     """
 
     image = serializers.ImageField(read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
-        read_only_fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
+        read_only_fields = fields
+
+
+class UserWithRecipesListSerializer(serializers.ListSerializer):
+    """
+    Подгружает первые recipes_limit рецептов всех авторов страницы
+    одним запросом с ROW_NUMBER() OVER (PARTITION BY author).
+    """
+
+    def to_representation(self, data):
+        authors = list(data.all() if hasattr(data, "all") else data)
+        recipes = Recipe.objects.filter(
+            author__in=[author.pk for author in authors]
+        ).only(
+            "id", "name", "image", "image_variants", "cooking_time",
+            "author_id",
+        )
+        recipes_limit = self.child.get_recipes_limit()
+        if recipes_limit:
+            recipes = recipes.annotate(
+                row_number=Window(
+                    RowNumber(),
+                    partition_by=F("author"),
+                    order_by=(F("pub_date").desc(), F("id").desc()),
+                )
+            ).filter(row_number__lte=recipes_limit)
+        previews = {author.pk: [] for author in authors}
+        for recipe in recipes.order_by("-pub_date", "-id"):
+            previews[recipe.author_id].append(recipe)
+        for author in authors:
+            author.preview_recipes = previews[author.pk]
+        return super().to_representation(authors)
 
 
 class UserWithRecipesSerializer(serializers.ModelSerializer):
@@ -389,10 +647,10 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
 
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
     avatar = serializers.ImageField(
         read_only=True, required=False, allow_null=True
     )
+    avatar_variants = ImageVariantsField()
 
     class Meta:
         model = User
@@ -406,6 +664,7 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
             "recipes",
             "recipes_count",
             "avatar",
+            "avatar_variants",
         )
         read_only_fields = (
             "email",
@@ -417,9 +676,15 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
             "recipes",
             "recipes_count",
             "avatar",
+            "avatar_variants",
         )
+        list_serializer_class = UserWithRecipesListSerializer
 
     def get_is_subscribed(self, obj):
+        # Список подписок и ответ на подписку передают is_subscribed
+        # в контексте: там он заведомо истинен.
+        if "is_subscribed" in self.context:
+            return self.context["is_subscribed"]
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             return Follow.objects.filter(
@@ -427,33 +692,43 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
             ).exists()
         return False
 
-    def get_recipes(self, obj):
+    def get_recipes_limit(self):
         request = self.context.get("request")
         recipes_limit_str = (
             request.query_params.get("recipes_limit")
             if request else None
         )
-        queryset = obj.recipes.all()
         if recipes_limit_str:
             try:
                 recipes_limit = int(recipes_limit_str)
                 if recipes_limit > 0:
-                    queryset = queryset[:recipes_limit]
+                    return recipes_limit
             except ValueError:
                 pass
+        return None
+
+    def get_recipes(self, obj):
+        queryset = getattr(obj, "preview_recipes", None)
+        if queryset is None:
+            queryset = obj.recipes.all()[:self.get_recipes_limit()]
         return RecipeMinifiedSerializer(
             queryset, many=True, context=self.context
         ).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class UserAvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(
+    avatar = ImageUploadField(
         required=True
     )
+    avatar_variants = ImageVariantsField()
 
     class Meta:
         model = User
-        fields = ("avatar",)
+        fields = ("avatar", "avatar_variants")
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        old_avatar = instance.avatar.name
+        instance = super().update(instance, validated_data)
+        release_file(User, "avatar", old_avatar)
+        return instance
@@ -0,0 +1,103 @@
+"""
+Сводная корзина: для каждого пользователя хранится сумма
+каждого ингредиента по всем рецептам в его списке покупок
+(ShoppingCartItem). Суммы меняются на месте одним INSERT ... ON CONFLICT
+в той же транзакции, что и изменение корзины или состава рецепта.
+"""
+from django.db import connection
+
+from .models import RecipeIngredient, ShoppingCart, ShoppingCartItem
+
+
+def _in_clause(column, values):
+    values = list(values)
+    return f"{column} IN ({', '.join(['%s'] * len(values))})", values
+
+
+def apply_to_carts(sign, recipe_ids=None, user_ids=None):
+    """
+    Прибавляет (sign=1) или вычитает (sign=-1) ингредиенты рецептов
+    recipe_ids в сводных корзинах пользователей user_ids, у которых эти
+    рецепты лежат в списке покупок. None означает «без ограничения».
+    Вычитать нужно до удаления связей, прибавлять — после добавления.
+    """
+    if recipe_ids is not None:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+
+    cart_table = ShoppingCart._meta.db_table
+    items_table = ShoppingCartItem._meta.db_table
+    conditions, params = ["TRUE"], [sign]
+    if recipe_ids is not None:
+        clause, values = _in_clause("cart.recipe_id", recipe_ids)
+        conditions.append(clause)
+        params.extend(values)
+    if user_ids is not None:
+        clause, values = _in_clause("cart.user_id", user_ids)
+        conditions.append(clause)
+        params.extend(values)
+    where = " AND ".join(conditions)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {items_table} (user_id, ingredient_id, amount)
+            SELECT cart.user_id, ri.ingredient_id, %s * SUM(ri.amount)
+            FROM {cart_table} cart
+            JOIN {RecipeIngredient._meta.db_table} ri
+                ON ri.recipe_id = cart.recipe_id
+            WHERE {where}
+            GROUP BY cart.user_id, ri.ingredient_id
+            ON CONFLICT (user_id, ingredient_id)
+            DO UPDATE SET amount = {items_table}.amount + EXCLUDED.amount
+            """,
+            params,
+        )
+        if sign < 0:
+            cursor.execute(
+                f"""
+                DELETE FROM {items_table}
+                WHERE amount <= 0 AND user_id IN (
+                    SELECT cart.user_id FROM {cart_table} cart
+                    WHERE {where}
+                )
+                """,
+                params[1:],
+            )
+
+
+def apply_to_cart(sign, user_id, recipe_ids):
+    """
+    Как apply_to_carts, но для одного пользователя и без сверки со
+    связями корзины: вызывается, когда уже известно, какие связи
+    действительно добавлены или удалены (api/relations.py).
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    items_table = ShoppingCartItem._meta.db_table
+    clause, values = _in_clause("ri.recipe_id", recipe_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {items_table} (user_id, ingredient_id, amount)
+            SELECT %s, ri.ingredient_id, %s * SUM(ri.amount)
+            FROM {RecipeIngredient._meta.db_table} ri
+            WHERE {clause}
+            GROUP BY ri.ingredient_id
+            ON CONFLICT (user_id, ingredient_id)
+            DO UPDATE SET amount = {items_table}.amount + EXCLUDED.amount
+            """,
+            [user_id, sign, *values],
+        )
+        if sign < 0:
+            cursor.execute(
+                f"DELETE FROM {items_table} "
+                "WHERE user_id = %s AND amount <= 0",
+                [user_id],
+            )
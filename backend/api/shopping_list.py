@@ -0,0 +1,153 @@
+"""
+Выгрузка списка покупок в txt, csv и pdf.
+
+Строки берутся из сводной корзины (ShoppingCartItem) итератором
+(на PostgreSQL — серверным курсором) и сразу отдаются клиенту через
+StreamingHttpResponse. Готовый файл кладётся в кэш под ключом с версией
+корзины пользователя, поэтому повторная выгрузка не выполняет ни
+чтение корзины, ни рендеринг. Шапка и подпись файла (имя пользователя
+и адрес сайта) входят в ключ хэшем: они уже есть в запросе, поэтому
+ключ по-прежнему строится без обращения к БД.
+"""
+import csv
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from .models import ShoppingCartItem
+from .versions import INGREDIENTS_CATALOG, cart_scope, get_version
+
+SHOPPING_LIST_CACHE_KEY = (
+    "shopping-list:{user}:{format}:{cart}:{catalog}:{header}"
+)
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+SHOPPING_LIST_CHUNK_SIZE = 500
+SEPARATOR = "-" * 50
+
+
+def shopping_list_rows(user):
+    """Итератор (название, единица измерения, сумма) по корзине."""
+    return (
+        ShoppingCartItem.objects.filter(user=user)
+        .values_list(
+            "ingredient__name", "ingredient__measurement_unit", "amount"
+        )
+        .order_by("ingredient__name")
+        .iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+    )
+
+
+def _title(user):
+    return (
+        "Список покупок для пользователя: "
+        f"{user.get_full_name() or user.username}"
+    )
+
+
+def render_txt(user, rows, site_url):
+    yield f"{_title(user)}\n{SEPARATOR}\n".encode()
+    for name, measurement_unit, amount in rows:
+        yield f"- {name} ({measurement_unit}) — {amount}\n".encode()
+    yield f"{SEPARATOR}\nFoodgram, {site_url}\n".encode()
+
+
+def render_csv(user, rows, site_url):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, чтобы Excel распознал UTF-8.
+    buffer.write("\ufeff")
+    writer.writerow(("Ингредиент", "Единица измерения", "Количество"))
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def render_pdf(user, rows, site_url):
+    font = "Helvetica"
+    if os.path.exists(settings.SHOPPING_LIST_PDF_FONT):
+        # Без шрифта с кириллицей названия будут нечитаемы,
+        # но файл всё равно сформируется.
+        font = "ShoppingListFont"
+        pdfmetrics.registerFont(
+            TTFont(font, settings.SHOPPING_LIST_PDF_FONT)
+        )
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin, line_height = 50, 16
+    y = height - margin
+
+    def write_line(text, size=11):
+        nonlocal y
+        if y < margin:
+            pdf.showPage()
+            y = height - margin
+        pdf.setFont(font, size)
+        pdf.drawString(margin, y, text)
+        y -= line_height
+
+    write_line(_title(user), size=14)
+    write_line(SEPARATOR)
+    for name, measurement_unit, amount in rows:
+        write_line(f"- {name} ({measurement_unit}) — {amount}")
+    write_line(SEPARATOR)
+    write_line(f"Foodgram, {site_url}")
+    pdf.save()
+    yield buffer.getvalue()
+
+
+SHOPPING_LIST_FORMATS = {
+    "txt": (render_txt, "text/plain; charset=utf-8"),
+    "csv": (render_csv, "text/csv; charset=utf-8"),
+    "pdf": (render_pdf, "application/pdf"),
+}
+
+
+def _cache_when_complete(key, chunks):
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, b"".join(parts), SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def shopping_list_response(user, file_format, site_url):
+    """Ответ с файлом из кэша, либо None, если корзина пуста."""
+    renderer, content_type = SHOPPING_LIST_FORMATS[file_format]
+    key = SHOPPING_LIST_CACHE_KEY.format(
+        user=user.pk,
+        format=file_format,
+        cart=get_version(cart_scope(user.pk)),
+        catalog=get_version(INGREDIENTS_CATALOG),
+        header=hashlib.md5(
+            f"{_title(user)}\n{site_url}".encode()
+        ).hexdigest(),
+    )
+    content = cache.get(key)
+    if content is not None:
+        response = HttpResponse(content, content_type=content_type)
+    elif not user.shopping_cart_items.exists():
+        return None
+    else:
+        response = StreamingHttpResponse(
+            _cache_when_complete(
+                key, renderer(user, shopping_list_rows(user), site_url)
+            ),
+            content_type=content_type,
+        )
+    response["Content-Disposition"] = (
+        f'attachment; filename="shopping_list.{file_format}"'
+    )
+    return response
@@ -0,0 +1,247 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from .feed import backfill, fan_out, remove_author
+from .images import schedule_variants, variants_outdated
+from .media import release_file
+from .models import (
+    Favorite,
+    Follow,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+    Tag,
+    User,
+    recipe_tags_mask,
+)
+from .recipe_cache import invalidate_recipes
+from .recipe_ingredient_index import record_changes
+from .shopping_cart import apply_to_carts
+from .tasks import run_after_commit
+from .versions import (
+    INGREDIENTS_CATALOG,
+    TAGS_CATALOG,
+    bump_cart_versions,
+    bump_version,
+)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(INGREDIENTS_CATALOG))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(TAGS_CATALOG))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    # save() сам сдвигает updated_at (auto_now), а с ним и ключ кэша
+    # представления; save(update_fields=...) без него — нет.
+    update_fields = kwargs.get("update_fields")
+    if update_fields is not None and "updated_at" not in update_fields:
+        invalidate_recipes([instance.pk])
+    # Состав пишется без сигналов (api/recipe_ingredients.py): новый
+    # рецепт и удалённый вместе с составом попадают в журнал здесь.
+    if kwargs.get("created") or kwargs["signal"] is post_delete:
+        record_changes([instance.pk])
+
+
+# Поля автора, которые входят в представление рецепта.
+AUTHOR_REPRESENTATION_FIELDS = {
+    "email", "username", "first_name", "last_name", "avatar"
+}
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    if created or (
+        update_fields is not None
+        and not AUTHOR_REPRESENTATION_FIELDS & set(update_fields)
+    ):
+        return
+    invalidate_recipes(instance.recipes.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F("recipes_count") + 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=F("recipes_count") - 1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    if created:
+        run_after_commit(fan_out, [instance.pk])
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            followers_count=F("followers_count") + 1
+        )
+        run_after_commit(backfill, instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        followers_count=F("followers_count") - 1
+    )
+    remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Поддерживает Recipe.tags_mask при любом изменении тегов
+    (recipe.tags.set в RecipeSerializer, админка, tag.recipes)."""
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            Recipe.objects.filter(pk=instance.pk).update(
+                tags_mask=recipe_tags_mask()
+            )
+        return
+    if action == "post_add":
+        Recipe.objects.filter(pk__in=pk_set).update(
+            tags_mask=F("tags_mask").bitor(instance.mask)
+        )
+    elif action in ("pre_remove", "pre_clear"):
+        recipes = instance.recipes.all()
+        if action == "pre_remove":
+            recipes = recipes.filter(pk__in=pk_set)
+        Recipe.objects.filter(pk__in=recipes.values("pk")).update(
+            tags_mask=F("tags_mask").bitand(~instance.mask)
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    # Связи с рецептами удаляются каскадом без m2m_changed.
+    Recipe.objects.filter(tags=instance).update(
+        tags_mask=F("tags_mask").bitand(~instance.mask)
+    )
+
+
+@receiver(m2m_changed, sender=Favorite)
+def favorites_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Поддерживает Recipe.favorites_count при изменении через менеджеры
+    M2M (recipe.favorited_by.add и т. п.). Менеджеры вызывают сигнал
+    внутри своей транзакции, поэтому счётчик меняется атомарно вместе
+    со связями. Действия API идут через api/relations.py."""
+    links = sender.objects.filter(
+        **{"user" if reverse else "recipe": instance}
+    )
+    if action == "post_add":
+        if reverse:
+            recipes = Recipe.objects.filter(pk__in=pk_set)
+            delta = 1
+        else:
+            recipes = Recipe.objects.filter(pk=instance.pk)
+            delta = len(pk_set)
+    elif action == "pre_remove":
+        if reverse:
+            recipes = Recipe.objects.filter(
+                pk__in=links.filter(recipe__in=pk_set).values("recipe")
+            )
+            delta = -1
+        else:
+            recipes = Recipe.objects.filter(pk=instance.pk)
+            delta = -links.filter(user__in=pk_set).count()
+    elif action == "pre_clear":
+        if reverse:
+            recipes = Recipe.objects.filter(pk__in=links.values("recipe"))
+            delta = -1
+        else:
+            recipes = Recipe.objects.filter(pk=instance.pk)
+            delta = -links.count()
+    else:
+        return
+    if delta:
+        recipes.update(favorites_count=F("favorites_count") + delta)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Связи избранного удаляются каскадом без m2m_changed.
+    Recipe.objects.filter(
+        pk__in=instance.favorite_recipes.values("pk")
+    ).update(favorites_count=F("favorites_count") - 1)
+
+
+@receiver(m2m_changed, sender=ShoppingCart)
+def shopping_cart_changed(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    # Сводная корзина: прибавляем после добавления связей,
+    # вычитаем до их удаления.
+    sign = {"post_add": 1, "pre_remove": -1, "pre_clear": -1}.get(action)
+    if sign is not None:
+        recipes, users = (pk_set, [instance.pk]) if reverse else (
+            [instance.pk], pk_set
+        )
+        apply_to_carts(sign, recipe_ids=recipes, user_ids=users)
+
+    if reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            bump_cart_versions([instance.pk])
+    elif action in ("post_add", "post_remove"):
+        bump_cart_versions(pk_set)
+    elif action == "pre_clear":
+        bump_cart_versions(
+            sender.objects.filter(recipe=instance).values_list(
+                "user_id", flat=True
+            )
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_removed_from_carts(sender, instance, **kwargs):
+    # Связи корзины удаляются каскадом без m2m_changed: версии
+    # корзин сдвигаем здесь, пока связи ещё видны.
+    apply_to_carts(-1, recipe_ids=[instance.pk])
+    bump_cart_versions(
+        ShoppingCart.objects.filter(recipe=instance.pk).values_list(
+            "user_id", flat=True
+        )
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def image_changed(sender, instance, **kwargs):
+    if variants_outdated(instance):
+        schedule_variants(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_released(sender, instance, **kwargs):
+    release_file(Recipe, "image", instance.image.name, instance.image_variants)
+
+
+@receiver(post_delete, sender=User)
+def avatar_released(sender, instance, **kwargs):
+    release_file(
+        User, "avatar", instance.avatar.name, instance.avatar_variants
+    )
@@ -0,0 +1,59 @@
+"""
+Хранилище медиафайлов с именами по содержимому: файл сохраняется как
+<каталог>/<xx>/<sha256><расширение>. Одинаковые загрузки занимают
+место один раз, а содержимое по одному URL никогда не меняется, поэтому
+nginx отдаёт такие файлы с Cache-Control: immutable.
+
+Один файл может принадлежать нескольким записям, поэтому save() до
+проверки, есть ли уже файл, увеличивает его счётчик ссылок MediaFile
+(таблица MEDIA_FILES). Удаление файла (api/media.py) идёт под
+блокировкой той же строки: одновременная загрузка того же содержимого
+дождётся его и запишет файл заново. Модели импортируют этот модуль,
+поэтому таблица счётчиков задана здесь именем.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+
+MEDIA_FILES = "api_mediafile"
+
+
+def claim(name):
+    """Увеличивает счётчик ссылок на файл name. В транзакции строка
+    счётчика остаётся заблокированной до её завершения."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {MEDIA_FILES} (name, refcount) VALUES (%s, 1)
+            ON CONFLICT (name) DO UPDATE
+                SET refcount = {MEDIA_FILES}.refcount + 1
+            """,
+            [name],
+        )
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        digest = hashlib.sha256()
+        if hasattr(content, "seek"):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, "seek"):
+            content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(directory, digest[:2], digest + extension)
+        claim(name)
+        try:
+            # Файл уже есть: продлеваем его льготный срок в сборщике.
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return super().save(name, content, max_length)
+        return name
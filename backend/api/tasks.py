@@ -0,0 +1,52 @@
+"""
+Фоновые задачи без внешнего брокера: локальный пул потоков в каждом
+процессе. Задачи ставятся после фиксации транзакции, поэтому видят
+её результат. Задачи, не выполненные до перезапуска процесса,
+теряются — для них есть команды досчёта (build_image_variants).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def run_after_commit(func, *args):
+    """Выполняет func(*args) в пуле после фиксации текущей транзакции.
+    При BACKGROUND_WORKERS = 0 — сразу в вызывающем потоке."""
+    transaction.on_commit(lambda: submit(func, *args))
+
+
+def submit(func, *args):
+    global _executor
+    if settings.BACKGROUND_WORKERS <= 0:
+        _run(func, *args)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_WORKERS,
+                thread_name_prefix="background",
+            )
+    _executor.submit(_run_in_worker, func, *args)
+
+
+def _run(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Фоновая задача %s завершилась ошибкой", func)
+
+
+def _run_in_worker(func, *args):
+    try:
+        _run(func, *args)
+    finally:
+        # Соединения с БД у каждого потока свои.
+        connections.close_all()
@@ -0,0 +1,1577 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from . import recipe_ingredient_index
+from .management.commands.load_ingredients import read_json
+from .models import (
+    MAX_TAGS,
+    DataVersion,
+    Favorite,
+    Follow,
+    RecipeActivity,
+    Ingredient,
+    MediaFile,
+    Recipe,
+    RecipeIngredient,
+    RecipeIngredientChange,
+    ShoppingCartItem,
+    Tag,
+    User,
+)
+from .recipe_ingredient_index import RecipeIngredientIndex, record_changes
+from .versions import INGREDIENTS_CATALOG, RECIPE_INGREDIENTS, bump_version
+
+
+class RecipeQueryCountTests(APITestCase):
+    """Количество запросов к списку и карточке рецепта
+    не должно зависеть от числа рецептов на странице."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            email="reader@example.com",
+            username="reader",
+            first_name="Reader",
+            last_name="Reader",
+            password="password",
+        )
+        cls.tag = Tag.objects.create(
+            name="Завтрак", color="#E26C2D", slug="breakfast"
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"ингредиент {i}", measurement_unit="г")
+            for i in range(3)
+        )
+        for i in range(12):
+            author = User.objects.create_user(
+                email=f"author{i}@example.com",
+                username=f"author{i}",
+                first_name="Author",
+                last_name=str(i),
+                password="password",
+            )
+            recipe = Recipe.objects.create(
+                author=author,
+                name=f"Рецепт {i}",
+                image="recipes/images/test.png",
+                text="Описание",
+                cooking_time=10,
+            )
+            recipe.tags.add(cls.tag)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+                for ingredient in ingredients
+            )
+            if i % 2:
+                recipe.favorited_by.add(cls.reader)
+                Follow.objects.create(user=cls.reader, author=author)
+            if i % 3:
+                recipe.in_shopping_cart_for_users.add(cls.reader)
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def assert_constant_list_queries(self):
+        small, _ = self.count_queries("/api/recipes/?limit=2")
+        large, response = self.count_queries("/api/recipes/?limit=12")
+        self.assertEqual(len(response.data["results"]), 12)
+        self.assertEqual(small, large)
+        return large
+
+    def test_anonymous_list_uses_constant_queries(self):
+        # Версия каталога, COUNT, страница, промахи кэша: рецепты
+        # с авторами, ингредиенты.
+        self.assertEqual(self.assert_constant_list_queries(), 5)
+
+    def test_authenticated_list_uses_constant_queries(self):
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.assert_constant_list_queries(), 5)
+
+    def test_cached_list_needs_only_the_page_query(self):
+        self.client.force_authenticate(self.reader)
+        self.count_queries("/api/recipes/?limit=12")
+        queries, _ = self.count_queries("/api/recipes/?limit=12")
+        # COUNT, страница с флагами пользователя и версия каталога.
+        self.assertEqual(queries, 3)
+
+    def test_detail_uses_constant_queries(self):
+        self.client.force_authenticate(self.reader)
+        recipe = Recipe.objects.first()
+        queries, _ = self.count_queries(f"/api/recipes/{recipe.id}/")
+        # Версия каталога, ETag, рецепт с флагами, промах кэша: рецепт,
+        # ингредиенты. Версия читается один раз за запрос.
+        self.assertEqual(queries, 5)
+        queries, _ = self.count_queries(f"/api/recipes/{recipe.id}/")
+        self.assertEqual(queries, 3)
+
+    def test_cache_is_invalidated_on_change(self):
+        recipe = Recipe.objects.first()
+        url = f"/api/recipes/{recipe.id}/"
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = "Новое название"
+            recipe.save()
+        self.assertEqual(self.client.get(url).data["name"], "Новое название")
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.author.first_name = "Иван"
+            recipe.author.save()
+        self.assertEqual(
+            self.client.get(url).data["author"]["first_name"], "Иван"
+        )
+
+    def test_user_flags_come_from_annotations(self):
+        self.client.force_authenticate(self.reader)
+        _, response = self.count_queries("/api/recipes/?limit=12")
+        for item in response.data["results"]:
+            recipe = Recipe.objects.get(pk=item["id"])
+            self.assertEqual(
+                item["is_favorited"],
+                recipe.favorited_by.filter(pk=self.reader.pk).exists(),
+            )
+            self.assertEqual(
+                item["is_in_shopping_cart"],
+                recipe.in_shopping_cart_for_users.filter(
+                    pk=self.reader.pk
+                ).exists(),
+            )
+            self.assertEqual(
+                item["author"]["is_subscribed"],
+                Follow.objects.filter(
+                    user=self.reader, author=recipe.author
+                ).exists(),
+            )
+            self.assertEqual(len(item["ingredients"]), 3)
+            self.assertEqual(
+                item["image"],
+                "http://testserver/media/recipes/images/test.png",
+            )
+
+    def test_cursor_pagination_is_stable_under_inserts(self):
+        first = self.client.get("/api/recipes/?pagination=cursor&limit=5")
+        self.assertNotIn("count", first.data)
+        Recipe.objects.create(
+            author=self.reader,
+            name="Новый рецепт",
+            image="recipes/images/test.png",
+            text="Описание",
+            cooking_time=5,
+        )
+        second = self.client.get(first.data["next"])
+        first_ids = [item["id"] for item in first.data["results"]]
+        second_ids = [item["id"] for item in second.data["results"]]
+        self.assertEqual(len(second_ids), 5)
+        self.assertFalse(set(first_ids) & set(second_ids))
+        expected = list(
+            Recipe.objects.order_by("-pub_date", "-id")
+            .exclude(name="Новый рецепт")
+            .values_list("id", flat=True)[:10]
+        )
+        self.assertEqual(first_ids + second_ids, expected)
+
+    def test_cursor_pagination_with_tied_timestamps(self):
+        # Импорт и массовые загрузки дают рецептам одинаковый pub_date.
+        Recipe.objects.update(pub_date=timezone.now())
+        expected = list(
+            Recipe.objects.order_by("-id").values_list("id", flat=True)
+        )
+        url, pages = "/api/recipes/?pagination=cursor&limit=5", []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            pages.append([item["id"] for item in response.data["results"]])
+            url = response.data["next"]
+        self.assertEqual(sum(pages, []), expected)
+        page_query = queries[0]["sql"]
+        self.assertIn(
+            '("api_recipe"."pub_date", "api_recipe"."id") <', page_query
+        )
+        self.assertNotIn("OFFSET", page_query)
+        self.assertEqual(
+            [
+                item["id"] for item in self.client.get(
+                    response.data["previous"]
+                ).data["results"]
+            ],
+            pages[-2],
+        )
+
+    def test_search_uses_full_text_ranking(self):
+        first = Recipe.objects.create(
+            author=self.reader,
+            name="Салат",
+            image="recipes/images/test.png",
+            text="Много картофеля и немного моркови",
+            cooking_time=5,
+        )
+        second = Recipe.objects.create(
+            author=self.reader,
+            name="Картофельное пюре",
+            image="recipes/images/test.png",
+            text="Картофель, молоко",
+            cooking_time=5,
+        )
+        response = self.client.get("/api/recipes/?search=картоф")
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]],
+            [second.id, first.id],
+        )
+
+
+class IngredientAutocompleteTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ("Сахар", "сахарная пудра", "ванильный сахар", "соль")
+        )
+
+    def test_name_filter_is_served_from_memory(self):
+        self.client.get("/api/ingredients/?name=с")
+        # Только версия каталога.
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/ingredients/?name=САХ")
+        self.assertEqual(
+            [item["name"] for item in response.data],
+            ["Сахар", "сахарная пудра", "ванильный сахар"],
+        )
+
+    def test_index_is_rebuilt_after_catalog_change(self):
+        self.client.get("/api/ingredients/?name=мёд")
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name="мёд", measurement_unit="г")
+        response = self.client.get("/api/ingredients/?name=мёд")
+        self.assertEqual([item["name"] for item in response.data], ["мёд"])
+
+    def test_version_bump_from_another_process_is_seen(self):
+        self.client.get("/api/ingredients/?name=мёд")
+        # Другой процесс (например, load_ingredients) пишет в БД мимо
+        # сигналов и кэша этого процесса.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {Ingredient._meta.db_table} "
+                "(name, measurement_unit) VALUES ('мёд', 'г')"
+            )
+            cursor.execute(
+                f"UPDATE {DataVersion._meta.db_table} SET value = value + 1 "
+                "WHERE scope = %s",
+                [INGREDIENTS_CATALOG],
+            )
+        response = self.client.get("/api/ingredients/?name=мёд")
+        self.assertEqual([item["name"] for item in response.data], ["мёд"])
+
+
+class ConditionalGetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email="author@example.com",
+            username="author",
+            first_name="Author",
+            last_name="Author",
+            password="password",
+        )
+        Tag.objects.create(name="Обед", color="#49B64E", slug="lunch")
+        cls.recipe = Recipe.objects.create(
+            author=cls.author,
+            name="Суп",
+            image="recipes/images/test.png",
+            text="Описание",
+            cooking_time=30,
+        )
+
+    def test_catalog_returns_not_modified_by_version(self):
+        etag = self.client.get("/api/tags/")["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/tags/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name="Ужин", color="#8775D2", slug="dinner")
+        response = self.client.get("/api/tags/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_recipe_etag_follows_user_state(self):
+        url = f"/api/recipes/{self.recipe.id}/"
+        self.client.force_authenticate(self.author)
+        etag = self.client.get(url)["ETag"]
+        # Версия каталога и состояние рецепта.
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.recipe.favorited_by.add(self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["is_favorited"])
+
+
+class CounterTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email="author@example.com",
+            username="author",
+            first_name="Author",
+            last_name="Author",
+            password="password",
+        )
+        cls.reader = User.objects.create_user(
+            email="reader@example.com",
+            username="reader",
+            first_name="Reader",
+            last_name="Reader",
+            password="password",
+        )
+
+    def create_recipe(self):
+        return Recipe.objects.create(
+            author=self.author,
+            name="Суп",
+            image="recipes/images/test.png",
+            text="Описание",
+            cooking_time=30,
+        )
+
+    def test_counters_follow_changes(self):
+        recipe = self.create_recipe()
+        self.create_recipe().delete()
+        self.client.force_authenticate(self.reader)
+        self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        self.author.refresh_from_db()
+        recipe.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+        self.assertEqual(recipe.favorites_count, 1)
+        self.client.delete(f"/api/recipes/{recipe.id}/favorite/")
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        recipe.favorited_by.add(self.reader, self.author)
+        self.reader.delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_toggles_report_affected_rows(self):
+        recipe = self.create_recipe()
+        url = f"/api/recipes/{recipe.id}/favorite/"
+        self.client.force_authenticate(self.reader)
+        statuses = [self.client.post(url).status_code for _ in range(2)]
+        statuses += [self.client.delete(url).status_code for _ in range(2)]
+        self.assertEqual(statuses, [201, 400, 204, 400])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        for pk in ("999999", "²", "١", str(2 ** 63)):
+            self.assertEqual(
+                self.client.post(f"/api/recipes/{pk}/favorite/").status_code,
+                404,
+            )
+
+    def test_reconcile_counters_fixes_drift(self):
+        recipe = self.create_recipe()
+        recipe.favorited_by.add(self.reader)
+        Recipe.objects.update(favorites_count=7, tags_mask=-1)
+        User.objects.update(recipes_count=0)
+        call_command("reconcile_counters", stdout=StringIO())
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.tags_mask, 0)
+        self.assertEqual(self.author.recipes_count, 1)
+
+
+class SubscriptionsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            email="reader@example.com",
+            username="reader",
+            first_name="Reader",
+            last_name="Reader",
+            password="password",
+        )
+        for i in range(8):
+            author = User.objects.create_user(
+                email=f"author{i}@example.com",
+                username=f"author{i}",
+                first_name="Author",
+                last_name=str(i),
+                password="password",
+            )
+            Follow.objects.create(user=cls.reader, author=author)
+            for j in range(i % 4):
+                Recipe.objects.create(
+                    author=author,
+                    name=f"Рецепт {i}.{j}",
+                    image="recipes/images/test.png",
+                    text="Описание",
+                    cooking_time=10,
+                )
+
+    def test_subscriptions_use_constant_queries(self):
+        self.client.force_authenticate(self.reader)
+        url = "/api/users/subscriptions/?recipes_limit=2&limit={}"
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url.format(2))
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url.format(8))
+        # COUNT, страница авторов, превью рецептов.
+        self.assertEqual(len(small.captured_queries), 3)
+        self.assertEqual(len(large.captured_queries), 3)
+        for item in response.data["results"]:
+            author = User.objects.get(pk=item["id"])
+            self.assertTrue(item["is_subscribed"])
+            self.assertEqual(item["recipes_count"], author.recipes.count())
+            self.assertEqual(
+                [recipe["id"] for recipe in item["recipes"]],
+                list(author.recipes.values_list("id", flat=True)[:2]),
+            )
+
+
+class ShoppingListDownloadTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email="user@example.com",
+            username="user",
+            first_name="Иван",
+            last_name="Петров",
+            password="password",
+        )
+        salt, sugar = Ingredient.objects.bulk_create([
+            Ingredient(name="соль", measurement_unit="г"),
+            Ingredient(name="сахар", measurement_unit="г"),
+        ])
+        for amount in (5, 10):
+            recipe = Recipe.objects.create(
+                author=cls.user,
+                name="Рецепт",
+                image="recipes/images/test.png",
+                text="Описание",
+                cooking_time=10,
+            )
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(recipe=recipe, ingredient=salt, amount=1),
+                RecipeIngredient(
+                    recipe=recipe, ingredient=sugar, amount=amount
+                ),
+            ])
+            recipe.in_shopping_cart_for_users.add(cls.user)
+        cls.recipe = recipe
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format):
+        response = self.client.get(
+            f"/api/recipes/download_shopping_cart/?format={file_format}"
+        )
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            return b"".join(response.streaming_content)
+        return response.content
+
+    def test_formats(self):
+        text = self.download("txt").decode()
+        self.assertIn("- сахар (г) — 15", text)
+        self.assertIn("- соль (г) — 2", text)
+        rows = self.download("csv").decode("utf-8-sig").splitlines()
+        self.assertEqual(rows[1:], ["сахар,г,15", "соль,г,2"])
+        self.assertTrue(self.download("pdf").startswith(b"%PDF"))
+        response = self.client.get(
+            "/api/recipes/download_shopping_cart/?format=doc"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_repeat_download_is_cached_until_cart_changes(self):
+        self.download("txt")
+        # Версии корзины и каталога.
+        with self.assertNumQueries(2):
+            self.download("txt")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.in_shopping_cart_for_users.remove(self.user)
+        self.assertIn("- сахар (г) — 5", self.download("txt").decode())
+
+    def test_download_follows_name_and_site(self):
+        self.download("txt")
+        self.user.first_name = "Пётр"
+        self.user.save(update_fields=["first_name"])
+        self.client.force_authenticate(self.user)
+        self.assertIn("Пётр Петров", self.download("txt").decode())
+        response = self.client.get(
+            "/api/recipes/download_shopping_cart/?format=txt", secure=True
+        )
+        self.assertIn(
+            "Foodgram, https://testserver",
+            b"".join(response.streaming_content).decode(),
+        )
+
+    def test_deleting_recipe_in_cart_invalidates_download(self):
+        self.download("txt")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        self.assertIn("- сахар (г) — 5", self.download("txt").decode())
+
+    def cart_totals(self):
+        return dict(
+            ShoppingCartItem.objects.filter(user=self.user).values_list(
+                "ingredient__name", "amount"
+            )
+        )
+
+    def test_aggregated_cart_follows_changes(self):
+        self.assertEqual(self.cart_totals(), {"соль": 2, "сахар": 15})
+        salt = Ingredient.objects.get(name="соль")
+        response = self.client.patch(
+            f"/api/recipes/{self.recipe.id}/",
+            {"ingredients": [{"id": salt.id, "amount": 4}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_totals(), {"соль": 5, "сахар": 5})
+        self.client.delete(f"/api/recipes/{self.recipe.id}/shopping_cart/")
+        self.assertEqual(self.cart_totals(), {"соль": 1, "сахар": 5})
+        self.user.shopping_cart_recipes.clear()
+        self.assertEqual(self.cart_totals(), {})
+
+    def test_bulk_cart_and_favorites(self):
+        other = Recipe.objects.exclude(pk=self.recipe.pk).get()
+        self.user.shopping_cart_recipes.remove(other)
+        url = "/api/recipes/shopping_cart/bulk/"
+        response = self.client.post(
+            url, {"recipes": [other.id, self.recipe.id, 10**9]},
+            format="json",
+        )
+        self.assertEqual(
+            [item["status"] for item in response.data["results"]],
+            ["added", "already_added", "not_found"],
+        )
+        self.assertEqual(self.cart_totals(), {"соль": 2, "сахар": 15})
+        response = self.client.delete(
+            url, {"recipes": [other.id, other.id]}, format="json"
+        )
+        self.assertEqual(
+            response.data["results"], [{"id": other.id, "status": "removed"}]
+        )
+        response = self.client.post(
+            "/api/recipes/favorite/bulk/",
+            {"recipes": [other.id, self.recipe.id]},
+            format="json",
+        )
+        other.refresh_from_db()
+        self.assertEqual(other.favorites_count, 1)
+        self.assertEqual(self.user.favorite_recipes.count(), 2)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, BACKGROUND_WORKERS=0)
+class ImageVariantsTests(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="cook@example.com",
+            username="cook",
+            first_name="Cook",
+            last_name="Cook",
+        )
+        self.client.force_authenticate(self.user)
+        self.ingredient = Ingredient.objects.create(
+            name="мука", measurement_unit="г"
+        )
+
+    def image_file(self, size=(2000, 1500)):
+        buffer = BytesIO()
+        Image.new("RGBA", size, (200, 100, 50, 128)).save(buffer, "PNG")
+        buffer.name = "photo.png"
+        buffer.seek(0)
+        return buffer
+
+    def image_data(self, size=(2000, 1500)):
+        encoded = base64.b64encode(self.image_file(size).read()).decode()
+        return f"data:image/png;base64,{encoded}"
+
+    def test_multipart_upload(self):
+        tags = [
+            Tag.objects.create(name=name, color=color, slug=name)
+            for name, color in (("a", "#000000"), ("b", "#ffffff"))
+        ]
+        response = self.client.post(
+            "/api/recipes/",
+            {
+                "name": "Хлеб",
+                "text": "Описание",
+                "cooking_time": 60,
+                "image": self.image_file(),
+                "tags": [tag.id for tag in tags],
+                "ingredients": json.dumps(
+                    [{"id": self.ingredient.id, "amount": 500}]
+                ),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = Recipe.objects.get(pk=response.data["id"])
+        self.assertEqual(recipe.tags.count(), 2)
+        self.assertEqual(recipe.recipe_ingredients.get().amount, 500)
+        self.assertTrue(recipe.image.name.endswith(".png"))
+
+        response = self.client.patch(
+            f"/api/recipes/{recipe.id}/",
+            {"ingredients": "[{"}, format="multipart",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.put(
+            "/api/users/me/avatar/",
+            {"avatar": self.image_file((300, 300))},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar)
+
+    def test_variants_are_built_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/recipes/",
+                {
+                    "name": "Хлеб",
+                    "text": "Описание",
+                    "cooking_time": 60,
+                    "image": self.image_data(),
+                    "ingredients": [
+                        {"id": self.ingredient.id, "amount": 500}
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["image_variants"], {})
+        recipe = Recipe.objects.get(pk=response.data["id"])
+        self.assertEqual(recipe.image_variants["source"], recipe.image.name)
+        with default_storage.open(
+            recipe.image_variants["card"]["webp"]
+        ) as file:
+            self.assertLessEqual(Image.open(file).size, (480, 360))
+
+        data = self.client.get(f"/api/recipes/{recipe.id}/").data
+        self.assertEqual(set(data["image_variants"]), {"card", "detail"})
+        self.assertTrue(
+            data["image_variants"]["detail"]["jpeg"].startswith("http://")
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                "/api/users/me/avatar/",
+                {"avatar": self.image_data((300, 300))},
+                format="json",
+            )
+        data = self.client.get(f"/api/recipes/{recipe.id}/").data
+        self.assertEqual(
+            set(data["author"]["avatar_variants"]["avatar"]),
+            {"webp", "jpeg"},
+        )
+
+        variants = dict(recipe.image_variants)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image = ""
+            recipe.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, {})
+        self.assertFalse(default_storage.exists(variants["card"]["jpeg"]))
+
+    def test_identical_uploads_are_stored_once(self):
+        def create():
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    "/api/recipes/",
+                    {
+                        "name": "Хлеб",
+                        "text": "Описание",
+                        "cooking_time": 60,
+                        "image": self.image_data((600, 400)),
+                        "ingredients": [
+                            {"id": self.ingredient.id, "amount": 500}
+                        ],
+                    },
+                    format="json",
+                )
+            return Recipe.objects.get(pk=response.data["id"])
+
+        first, second = create(), create()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r"^recipes/images/../[0-9a-f]{64}")
+        self.assertEqual(first.image_variants, second.image_variants)
+        shared = first.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f"/api/recipes/{first.id}/",
+                {
+                    "image": self.image_data((500, 500)),
+                    "ingredients": [
+                        {"id": self.ingredient.id, "amount": 500}
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(default_storage.exists(shared))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(shared))
+        self.assertFalse(MediaFile.objects.filter(name=shared).exists())
+
+    def test_pending_upload_keeps_released_file(self):
+        recipe = Recipe.objects.create(
+            author=self.user,
+            name="Хлеб",
+            image=ContentFile(b"shared", name="a.png"),
+            text="Описание",
+            cooking_time=60,
+        )
+        name = recipe.image.name
+        # Другой запрос получил то же имя, но его запись ещё
+        # не зафиксирована.
+        self.assertEqual(
+            default_storage.save(
+                "recipes/images/b.png", ContentFile(b"shared")
+            ),
+            name,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(MediaFile.objects.get(name=name).refcount, 1)
+
+    def test_media_garbage_collector(self):
+        recipe = Recipe.objects.create(
+            author=self.user,
+            name="Хлеб",
+            image=ContentFile(b"kept", name="kept.png"),
+            text="Описание",
+            cooking_time=60,
+        )
+        old = default_storage.save("recipes/images/old.png", ContentFile(b"1"))
+        new = default_storage.save("users/avatars/new.png", ContentFile(b"2"))
+        path = default_storage.path(old)
+        os.utime(path, (time.time() - 2 * 86400,) * 2)
+
+        out = StringIO()
+        call_command("collect_media_garbage", stdout=out)
+        self.assertIn(old, out.getvalue())
+        self.assertTrue(default_storage.exists(old))
+        call_command("collect_media_garbage", "--delete", stdout=StringIO())
+        self.assertFalse(default_storage.exists(old))
+        self.assertTrue(default_storage.exists(new))
+        self.assertTrue(default_storage.exists(recipe.image.name))
+
+    def test_reupload_of_orphan_survives_garbage_collector(self):
+        # Запись, получившая уже существующий файл, ещё не
+        # зафиксирована, и сборщик не видит ссылки на него.
+        name = default_storage.save(
+            "recipes/images/a.png", ContentFile(b"same")
+        )
+        path = default_storage.path(name)
+        os.utime(path, (time.time() - 2 * 86400,) * 2)
+        self.assertEqual(
+            default_storage.save(
+                "recipes/images/b.png", ContentFile(b"same")
+            ),
+            name,
+        )
+        call_command("collect_media_garbage", "--delete", stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+
+@override_settings(BACKGROUND_WORKERS=0, FEED_FANOUT_MAX_FOLLOWERS=1)
+class FeedTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.author, cls.star, cls.fan = (
+            User.objects.create_user(
+                email=f"{name}@example.com",
+                username=name,
+                first_name=name,
+                last_name=name,
+            )
+            for name in ("reader", "author", "star", "fan")
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+
+    def publish(self, author, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            # Без картинки: копии изображения здесь не нужны.
+            return Recipe.objects.create(
+                author=author,
+                name=name,
+                text="Описание",
+                cooking_time=5,
+            )
+
+    def follow(self, user, author):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(user=user, author=author)
+
+    def feed_names(self, url="/api/recipes/feed/?limit=2"):
+        names = []
+        while url:
+            data = self.client.get(url).data
+            names += [recipe["name"] for recipe in data["results"]]
+            url = data["next"]
+        return names
+
+    def test_feed(self):
+        self.publish(self.author, "старый")
+        self.follow(self.reader, self.author)
+        self.follow(self.reader, self.star)
+        self.follow(self.fan, self.star)
+        self.star.refresh_from_db()
+        self.assertEqual(self.star.followers_count, 2)
+
+        self.publish(self.author, "новый")
+        popular = self.publish(self.star, "популярный")
+        # Популярный автор не раскладывается при публикации.
+        self.assertFalse(popular.feed_entries.exists())
+        self.publish(self.fan, "чужой")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                self.feed_names(), ["популярный", "новый", "старый"]
+            )
+        # Рецепты популярных авторов сливаются с лентой при чтении,
+        # ничего не записывая.
+        self.assertFalse(
+            [query for query in queries if "INSERT" in query["sql"]]
+        )
+        self.assertFalse(popular.feed_entries.exists())
+        last = self.client.get(
+            self.client.get("/api/recipes/feed/?limit=2").data["next"]
+        ).data
+        self.assertEqual(
+            [recipe["name"] for recipe in self.client.get(
+                last["previous"]
+            ).data["results"]],
+            ["популярный", "новый"],
+        )
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertEqual(self.feed_names(), ["популярный"])
+
+
+class TrendingTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f"user{i}@example.com",
+                username=f"user{i}",
+                first_name="User",
+                last_name="User",
+            )
+            for i in range(3)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.users[0],
+                name=f"Рецепт {i}",
+                image="recipes/images/test.png",
+                text="Описание",
+                cooking_time=5,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def add(self, user, recipe, relation):
+        self.client.force_authenticate(user)
+        self.client.post(f"/api/recipes/{recipe.id}/{relation}/")
+
+    def test_rankings_and_popularity(self):
+        first, second, third = self.recipes
+        for user in self.users:
+            self.add(user, second, "favorite")
+        self.add(self.users[0], first, "shopping_cart")
+        self.add(self.users[1], first, "favorite")
+        # Повторное добавление не считается.
+        self.add(self.users[1], first, "favorite")
+        RecipeActivity.objects.create(
+            recipe=third,
+            hour=timezone.now() - timedelta(days=3, minutes=90),
+            favorites=5,
+        )
+
+        self.client.force_authenticate(None)
+        names = [
+            recipe["name"] for recipe in self.client.get(
+                "/api/recipes/trending/?window=24h"
+            ).data["results"]
+        ]
+        self.assertEqual(names, ["Рецепт 1", "Рецепт 0"])
+
+        call_command("rollup_trending", stdout=StringIO())
+        # Старые часы свёрнуты в сутки.
+        old = RecipeActivity.objects.get(recipe=third)
+        self.assertEqual(old.hour.hour, 0)
+        response = self.client.get("/api/recipes/trending/?window=7d")
+        self.assertEqual(response.data["results"][0]["name"], "Рецепт 2")
+        response = self.client.get("/api/recipes/?ordering=-popularity")
+        self.assertEqual(
+            [recipe["name"] for recipe in response.data["results"]],
+            ["Рецепт 2", "Рецепт 1", "Рецепт 0"],
+        )
+        self.assertEqual(
+            self.client.get("/api/recipes/trending/?window=1y").status_code,
+            400,
+        )
+        response = self.client.get("/api/recipes/trending/?window=7d&limit=²")
+        self.assertEqual(len(response.data["results"]), 3)
+        response = self.client.get("/api/recipes/trending/?window=7d&limit=1")
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_rollup_from_scheduler_refreshes_rankings(self):
+        first, second, _ = self.recipes
+        self.add(self.users[0], first, "favorite")
+        url = "/api/recipes/trending/?window=24h"
+        self.assertEqual(
+            self.client.get(url).data["results"][0]["name"], "Рецепт 0"
+        )
+        for user in self.users:
+            self.add(user, second, "favorite")
+        # Планировщик работает в своём контейнере со своим кэшем.
+        with mock.patch("api.trending.cache", LocMemCache("scheduler", {})):
+            call_command("rollup_trending", stdout=StringIO())
+        self.assertEqual(
+            self.client.get(url).data["results"][0]["name"], "Рецепт 1"
+        )
+
+
+class CookSearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email="cook@example.com",
+            username="cook",
+            first_name="Cook",
+            last_name="Cook",
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ("яйцо", "молоко", "мука", "соль")
+        )
+        cls.egg, cls.milk, cls.flour, cls.salt = ingredients
+        cls.omelette = cls.create_recipe("Омлет", [cls.egg, cls.milk])
+        cls.pancakes = cls.create_recipe(
+            "Блины", [cls.egg, cls.milk, cls.flour]
+        )
+        cls.create_recipe("Соль", [cls.salt])
+
+    @classmethod
+    def create_recipe(cls, name, ingredients):
+        recipe = Recipe.objects.create(
+            author=cls.author,
+            name=name,
+            image="recipes/images/test.png",
+            text="Описание",
+            cooking_time=5,
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients
+        )
+        return recipe
+
+    def setUp(self):
+        cache.clear()
+        # Индекс процесса пережил откат транзакции прошлого теста.
+        recipe_ingredient_index._state = None
+
+    def set_ingredients(self, recipe, ingredients):
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f"/api/recipes/{recipe.id}/",
+            {
+                "ingredients": [
+                    {"id": ingredient.id, "amount": 1}
+                    for ingredient in ingredients
+                ]
+            },
+            format="json",
+        )
+        self.client.force_authenticate(None)
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_update_touches_dependents_once_per_recipe(self):
+        def update_queries(ingredients):
+            with CaptureQueriesContext(connection) as queries:
+                self.set_ingredients(self.omelette, ingredients)
+            # Без проверки ингредиентов при валидации: она по запросу
+            # на ингредиент.
+            return len([
+                query for query in queries
+                if not query["sql"].startswith('SELECT "api_ingredient"')
+            ])
+
+        self.assertEqual(
+            update_queries([self.egg]),
+            update_queries([self.egg, self.milk, self.flour, self.salt]),
+        )
+
+    def test_journal_records_recipe_once_per_transaction(self):
+        def journal_writes(*batches):
+            with CaptureQueriesContext(connection) as queries:
+                for recipe_ids in batches:
+                    record_changes(recipe_ids)
+            return len([
+                query for query in queries
+                if "INSERT INTO api_recipeingredientchange" in query["sql"]
+            ])
+
+        # Рецепты из setUpTestData уже записаны транзакцией теста, а
+        # связи журнала с рецептом нет.
+        recipes = [10 ** 9, 10 ** 9 + 1]
+        self.assertEqual(journal_writes(recipes, recipes[:1]), 1)
+        recipes = [10 ** 9 + 2]
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    journal_writes(recipes)
+                    raise ValueError
+            except ValueError:
+                pass
+            # Записи отменённой точки сохранения пишутся заново.
+            self.assertEqual(journal_writes(recipes), 1)
+            self.assertEqual(
+                RecipeIngredientChange.objects.filter(
+                    recipe_id__in=recipes
+                ).count(),
+                1,
+            )
+
+    def search(self, ids):
+        return self.client.get(
+            "/api/recipes/cook/?ingredients="
+            + ",".join(str(ingredient.id) for ingredient in ids)
+        )
+
+    def test_ranked_by_coverage(self):
+        results = self.search([self.egg, self.milk]).data["results"]
+        self.assertEqual(
+            [
+                (item["name"], item["coverage"], item["missing_ingredients"])
+                for item in results
+            ],
+            [("Омлет", 1.0, []), ("Блины", 0.667, [self.flour.id])],
+        )
+        for value in ("x", "²", "١", str(2 ** 63)):
+            self.assertEqual(
+                self.client.get(
+                    "/api/recipes/cook/?ingredients=" + value
+                ).status_code,
+                400,
+            )
+        self.assertEqual(
+            self.client.get(
+                f"/api/recipes/cook/?ingredients={self.egg.id}&limit=²"
+            ).status_code,
+            200,
+        )
+
+    def test_index_follows_recipe_changes(self):
+        self.search([self.flour])
+        # Изменения применяются из журнала, без полной перестройки.
+        with mock.patch.object(
+            RecipeIngredientIndex, "from_rows", side_effect=AssertionError
+        ):
+            bread = self.create_recipe("Хлеб", [self.flour, self.salt])
+            self.pancakes.delete()
+            self.set_ingredients(
+                self.omelette, [self.egg, self.milk, self.flour]
+            )
+            results = self.search([self.flour]).data["results"]
+        self.assertEqual(
+            [(item["id"], item["coverage"]) for item in results],
+            [(bread.id, 0.5), (self.omelette.id, 0.333)],
+        )
+
+    def test_bulk_load_rebuilds_index(self):
+        self.search([self.flour])
+        # Массовые загрузки пишут составы без сигналов и журнала.
+        RecipeIngredient.objects.bulk_create(
+            [
+                RecipeIngredient(
+                    recipe=self.omelette, ingredient=self.flour, amount=1
+                )
+            ]
+        )
+        bump_version(RECIPE_INGREDIENTS)
+        names = [
+            item["name"]
+            for item in self.search([self.flour]).data["results"]
+        ]
+        self.assertEqual(names, ["Блины", "Омлет"])
+
+    def test_include_and_exclude_ingredient_filters(self):
+        def names(query):
+            return sorted(
+                recipe["name"] for recipe in self.client.get(
+                    "/api/recipes/?" + query
+                ).data["results"]
+            )
+
+        self.assertEqual(
+            names(f"ingredients={self.egg.id},{self.milk.id}"),
+            ["Блины", "Омлет"],
+        )
+        self.assertEqual(
+            names(
+                f"ingredients={self.egg.id}"
+                f"&exclude_ingredients={self.flour.id},{self.salt.id}"
+            ),
+            ["Омлет"],
+        )
+        self.assertEqual(
+            names(f"exclude_ingredients={self.egg.id}"), ["Соль"]
+        )
+
+
+class TagFilterTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email="tags@example.com",
+            username="tags",
+            first_name="Tags",
+            last_name="Tags",
+        )
+        cls.breakfast, cls.lunch, cls.dinner = (
+            Tag.objects.create(name=slug, color=color, slug=slug)
+            for slug, color in (
+                ("breakfast", "#E26C2D"),
+                ("lunch", "#49B64E"),
+                ("dinner", "#8775D2"),
+            )
+        )
+        for name, tags in (
+            ("Каша", [cls.breakfast, cls.lunch]),
+            ("Суп", [cls.lunch]),
+            ("Стейк", [cls.dinner]),
+        ):
+            recipe = Recipe.objects.create(
+                author=author,
+                name=name,
+                image="recipes/images/test.png",
+                text="Описание",
+                cooking_time=5,
+            )
+            recipe.tags.set(tags)
+
+    def names(self, query):
+        return sorted(
+            recipe["name"] for recipe in self.client.get(
+                "/api/recipes/?" + query
+            ).data["results"]
+        )
+
+    def test_any_of_tags_without_duplicates(self):
+        self.assertEqual(
+            self.names("tags=breakfast&tags=lunch"), ["Каша", "Суп"]
+        )
+        self.assertEqual(self.names("tags=dinner"), ["Стейк"])
+
+    def test_mask_follows_tag_changes(self):
+        recipe = Recipe.objects.get(name="Стейк")
+        recipe.tags.set([self.lunch])
+        self.assertEqual(self.names("tags=dinner"), [])
+        self.lunch.delete()
+        self.assertEqual(self.names("tags=breakfast"), ["Каша"])
+        self.assertEqual(Recipe.objects.get(name="Стейк").tags_mask, 0)
+
+
+class LoadIngredientsTests(APITestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.salt = Ingredient.objects.create(
+            name="соль", measurement_unit="г"
+        )
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def load(self, *args):
+        out = StringIO()
+        call_command("load_ingredients", *args, stdout=out)
+        return out.getvalue()
+
+    def catalog(self):
+        return set(
+            Ingredient.objects.values_list("name", "measurement_unit")
+        )
+
+    def test_adds_missing_and_keeps_ids(self):
+        csv_path = self.write(
+            "ingredients.csv", "соль,г\n сахар ,г\nсахар,г\n,шт\n"
+        )
+        self.assertIn("Would add 1 ingredients", self.load(
+            csv_path, "--dry-run"
+        ))
+        self.assertEqual(self.catalog(), {("соль", "г")})
+        self.load(csv_path, "--batch-size", "1")
+        json_path = self.write(
+            "ingredients.json",
+            json.dumps([
+                {"name": "соль", "measurement_unit": "г"},
+                {"name": "мёд", "measurement_unit": "мл"},
+            ]),
+        )
+        self.load(json_path, "--copy")
+        self.assertEqual(
+            self.catalog(), {("соль", "г"), ("сахар", "г"), ("мёд", "мл")}
+        )
+        self.assertEqual(Ingredient.objects.get(name="соль").pk, self.salt.pk)
+
+    def test_json_is_read_in_chunks(self):
+        items = [
+            {"name": f"ингредиент {number}", "measurement_unit": "г"}
+            for number in range(50)
+        ]
+        path = self.write("ingredients.json", json.dumps(items, indent=1))
+        self.assertEqual(list(read_json(path, chunk_size=7)), items)
+
+
+class BenchmarkIngredientFiltersTests(TransactionTestCase):
+    """Прогон на крошечных данных: сырые INSERT команды должны
+    поспевать за схемой. VACUUM не работает внутри транзакции,
+    поэтому TransactionTestCase."""
+
+    def test_runs_on_tiny_dataset(self):
+        out = StringIO()
+        # На сотнях строк планировщик вправе читать составы иначе,
+        # поэтому планы здесь только выводятся.
+        call_command(
+            "benchmark_ingredient_filters",
+            "--rows",
+            "200",
+            "--ingredients",
+            "10",
+            "--repeat",
+            "1",
+            "--report-only",
+            stdout=out,
+        )
+        self.assertIn("exclude popular", out.getvalue())
+        # Повторные случайные пары схлопываются ON CONFLICT.
+        self.assertRegex(out.getvalue(), r"Generated [1-9]\d* recipe ingr")
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_fails_without_index_only_scan(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_indexonlyscan = off")
+        try:
+            with self.assertRaisesMessage(
+                CommandError, "recipe_ingredient_lookup_idx"
+            ):
+                call_command(
+                    "benchmark_ingredient_filters",
+                    "--rows",
+                    "200",
+                    "--ingredients",
+                    "10",
+                    "--repeat",
+                    "1",
+                    stdout=StringIO(),
+                )
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("RESET enable_indexonlyscan")
+        self.assertFalse(Recipe.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, BACKGROUND_WORKERS=0)
+class RecipeTransferTests(APITestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        author = User.objects.create_user(
+            email="transfer@example.com",
+            username="transfer",
+            first_name="Transfer",
+            last_name="Transfer",
+        )
+        buffer = BytesIO()
+        Image.new("RGB", (40, 30), (10, 20, 30)).save(buffer, "PNG")
+        self.recipe = Recipe.objects.create(
+            author=author,
+            name="Гречневая каша",
+            image=ContentFile(buffer.getvalue(), name="photo.png"),
+            text="Описание",
+            cooking_time=20,
+        )
+        self.recipe.tags.set([
+            Tag.objects.create(name="Обед", color="#49B64E", slug="lunch")
+        ])
+        RecipeIngredient.objects.create(
+            recipe=self.recipe,
+            ingredient=Ingredient.objects.create(
+                name="гречка", measurement_unit="г"
+            ),
+            amount=200,
+        )
+        self.recipe.refresh_from_db()
+
+    def test_export_and_import(self):
+        path = os.path.join(self.directory, "recipes.jsonl")
+        call_command(
+            "export_recipes", path, "--inline-images", stderr=StringIO()
+        )
+        with open(path, "a", encoding="utf-8") as file:
+            file.write("{broken\n")
+        original = self.recipe
+        original.delete()
+        Tag.objects.all().delete()
+
+        def run():
+            call_command(
+                "import_recipes",
+                path,
+                "--workers",
+                "0",
+                stdout=StringIO(),
+                stderr=StringIO(),
+            )
+
+        run()
+        run()  # Чекпойнт: повторный запуск ничего не добавляет.
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.name, original.name)
+        self.assertEqual(recipe.pub_date, original.pub_date)
+        self.assertEqual(recipe.image.name, original.image.name)
+        self.assertEqual(recipe.author.recipes_count, 1)
+        self.assertEqual(recipe.tags_mask, Tag.objects.get().mask)
+        self.assertEqual(
+            list(recipe.recipe_ingredients.values_list(
+                "ingredient__name", "amount"
+            )),
+            [("гречка", 200)],
+        )
+        response = self.client.get("/api/recipes/?search=каша&tags=lunch")
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]], [recipe.id]
+        )
+
+    def test_import_skips_invalid_records_in_batch(self):
+        path = os.path.join(self.directory, "recipes.jsonl")
+        call_command(
+            "export_recipes", path, "--inline-images", stderr=StringIO()
+        )
+        with open(path, encoding="utf-8") as file:
+            good = json.loads(file.readline())
+        self.recipe.delete()
+        bad = []
+        for change in (
+            {"cooking_time": "abc"},
+            {"cooking_time": 0},
+            {"name": "x" * 129},
+            {"ingredients": [dict(good["ingredients"][0], amount=0)]},
+            {"ingredients": good["ingredients"] * 2},
+        ):
+            bad.append(dict(good, **change))
+        with open(path, "w", encoding="utf-8") as file:
+            for record in bad[:3] + [good] + bad[3:]:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        errors = StringIO()
+        call_command(
+            "import_recipes",
+            path,
+            "--workers",
+            "0",
+            stdout=StringIO(),
+            stderr=errors,
+        )
+        self.assertEqual(Recipe.objects.get().name, good["name"])
+        for number in (1, 2, 3, 5, 6):
+            self.assertIn(f"Line {number}: skipped", errors.getvalue())
+
+    def test_import_skips_recipes_with_tags_over_limit(self):
+        path = os.path.join(self.directory, "recipes.jsonl")
+        call_command(
+            "export_recipes", path, "--inline-images", stderr=StringIO()
+        )
+        with open(path, encoding="utf-8") as file:
+            good = json.loads(file.readline())
+        self.recipe.delete()
+        Tag.objects.bulk_create(
+            Tag(name=f"Тег {bit}", color=f"#{bit:06}", slug=f"t{bit}", bit=bit)
+            for bit in range(1, MAX_TAGS)
+        )
+        extra = dict(
+            good, tags=[{"name": "Новый", "color": "#000000", "slug": "new"}]
+        )
+        with open(path, "w", encoding="utf-8") as file:
+            for record in (extra, good):
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        errors = StringIO()
+        call_command(
+            "import_recipes",
+            path,
+            "--workers",
+            "0",
+            stdout=StringIO(),
+            stderr=errors,
+        )
+        self.assertEqual(Recipe.objects.get().tags.get().slug, "lunch")
+        self.assertIn(
+            "Line 1: skipped, tag new cannot be created", errors.getvalue()
+        )
+        self.assertFalse(Tag.objects.filter(slug="new").exists())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, BACKGROUND_WORKERS=0)
+class GenerateFixtureDataTests(APITestCase):
+    def generate(self, prefix):
+        call_command(
+            "generate_fixture_data",
+            "--users",
+            "30",
+            "--prefix",
+            prefix,
+            stdout=StringIO(),
+        )
+        return sorted(
+            Recipe.objects.filter(
+                author__username__startswith=f"{prefix}-"
+            ).values_list("name", "cooking_time", "tags_mask")
+        )
+
+    def test_generated_data_is_deterministic_and_consistent(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f"ингредиент {number}", measurement_unit="г")
+            for number in range(50)
+        )
+        first = self.generate("first")
+        self.assertTrue(first)
+        self.assertEqual(self.generate("second"), first)
+        for user in User.objects.all():
+            self.assertEqual(user.recipes_count, user.recipes.count())
+        for recipe in Recipe.objects.all():
+            self.assertEqual(
+                recipe.favorites_count, recipe.favorites.count()
+            )
+            self.assertTrue(default_storage.exists(recipe.image.name))
+        user = User.objects.filter(username__startswith="first-").first()
+        self.assertTrue(user.check_password("fixture-password"))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, BACKGROUND_WORKERS=0)
+class BenchmarkEndpointsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f"ингредиент {number}", measurement_unit="г")
+            for number in range(50)
+        )
+        call_command(
+            "generate_fixture_data", "--users", "30", stdout=StringIO()
+        )
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.budgets = os.path.join(self.directory, "budgets.json")
+        self.report = os.path.join(self.directory, "report.json")
+
+    def benchmark(self, *args):
+        call_command(
+            "benchmark_endpoints",
+            "--iterations",
+            "2",
+            "--warmup",
+            "0",
+            "--budgets",
+            self.budgets,
+            "--report",
+            self.report,
+            *args,
+            stdout=StringIO(),
+            stderr=StringIO(),
+        )
+        with open(self.report, encoding="utf-8") as file:
+            return json.load(file)
+
+    def activity(self):
+        return (
+            RecipeActivity.objects.count(),
+            RecipeActivity.objects.aggregate(
+                favorites=Sum("favorites"), carts=Sum("carts")
+            ),
+            list(Recipe.objects.order_by("pk").values_list(
+                "pk", "popularity", "favorites_count"
+            )),
+        )
+
+    def test_report_covers_routes_and_restores_data(self):
+        favorites = list(Favorite.objects.values_list("pk", flat=True))
+        activity = self.activity()
+        report = self.benchmark("--write-budgets")
+        self.assertEqual(report["uncovered_routes"], [])
+        result = report["results"]["recipes"]
+        self.assertGreater(result["queries"], 0)
+        self.assertGreater(result["bytes"], 0)
+        self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+        self.assertEqual(result["violations"], [])
+        self.assertIn("favorite: add", report["results"])
+        self.assertEqual(
+            list(Favorite.objects.values_list("pk", flat=True)), favorites
+        )
+        self.assertEqual(self.activity(), activity)
+
+    def test_exceeded_budget_fails(self):
+        with open(self.budgets, "w", encoding="utf-8") as file:
+            json.dump({"recipes": {"queries": 0}}, file)
+        with self.assertRaises(CommandError):
+            self.benchmark()
+        with open(self.report, encoding="utf-8") as file:
+            report = json.load(file)
+        self.assertEqual(
+            len(report["results"]["recipes"]["violations"]), 1
+        )
+        self.assertIsNone(report["results"]["tags"]["budget"])
@@ -0,0 +1,40 @@
+"""
+Изображения рецептов для import_recipes. Функции выполняются в пуле
+процессов (spawn), поэтому модуль не импортирует модели: дочернему
+процессу достаточно настроек и хранилища по умолчанию.
+"""
+import base64
+import os
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+
+def store_image(image, directory, media_dir=None):
+    """
+    Сохраняет изображение записи экспорта и возвращает его имя
+    в хранилище. image — {"name": имя в исходном хранилище} и, если
+    изображение встроено, "data" в base64. Без "data" файл берётся из
+    media_dir, а если его нет — должен уже лежать в хранилище под тем
+    же именем. Изображение полностью декодируется, чтобы битые файлы
+    не попали в хранилище.
+    """
+    name = image["name"]
+    if "data" in image:
+        content = base64.b64decode(image["data"], validate=True)
+    elif media_dir:
+        with open(os.path.join(media_dir, name), "rb") as file:
+            content = file.read()
+    elif default_storage.exists(name):
+        return name
+    else:
+        raise FileNotFoundError(name)
+    with Image.open(BytesIO(content)) as picture:
+        picture.load()
+    return default_storage.save(
+        posixpath.join(directory, posixpath.basename(name)),
+        ContentFile(content),
+    )
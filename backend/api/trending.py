@@ -0,0 +1,159 @@
+"""
+Популярные рецепты. Успешные добавления в избранное и в список покупок
+(api/relations.py) прибавляются к почасовым счётчикам RecipeActivity
+одним upsert. Команда rollup_trending периодически сворачивает старые
+часы в сутки, удаляет данные старше самого длинного окна, пересчитывает
+Recipe.popularity и кладёт готовые рейтинги в кэш, откуда их читает
+/api/recipes/trending/. Команда запускается по расписанию отдельным
+сервисом (infra/docker-compose.yml), поэтому ключи рейтингов содержат
+версию TRENDING: с кэшем в памяти процесса веб-воркеры не видят
+рейтинги планировщика, но после каждого rollup пересчитывают свои.
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Recipe, RecipeActivity
+from .versions import TRENDING, bump_version, get_version
+
+WINDOWS = {
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+}
+DEFAULT_WINDOW = "24h"
+# Окно для Recipe.popularity (ordering=popularity).
+POPULARITY_WINDOW = "7d"
+# Часы старше этого сворачиваются в сутки: окну 24h нужна
+# почасовая точность, остальным хватает суточной.
+HOURLY_RETENTION = timedelta(hours=48)
+
+RANKING_SIZE = 100
+RANKING_CACHE_KEY = "trending:{window}:{version}"
+RANKING_CACHE_TIMEOUT = 60 * 60
+
+ACTIVITY = RecipeActivity._meta.db_table
+
+
+def record_activity(recipe_ids, favorites=0, carts=0):
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+    placeholders = ", ".join(["%s"] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {ACTIVITY} (recipe_id, hour, favorites, carts)
+            SELECT id, %s, %s, %s FROM {Recipe._meta.db_table}
+            WHERE id IN ({placeholders})
+            ON CONFLICT (recipe_id, hour) DO UPDATE SET
+                favorites = {ACTIVITY}.favorites + EXCLUDED.favorites,
+                carts = {ACTIVITY}.carts + EXCLUDED.carts
+            """,
+            [hour, favorites, carts, *recipe_ids],
+        )
+
+
+def scores(window, now=None):
+    """Запрос {recipe, score} за окно, по убыванию счёта."""
+    since = (now or timezone.now()) - WINDOWS[window]
+    return (
+        RecipeActivity.objects.filter(hour__gte=since)
+        .values("recipe")
+        .annotate(score=Sum(F("favorites") + F("carts")))
+        .order_by("-score", "-recipe")
+    )
+
+
+def compute_ranking(window, version):
+    ranking = list(
+        scores(window)[:RANKING_SIZE].values_list("recipe", flat=True)
+    )
+    cache.set(
+        RANKING_CACHE_KEY.format(window=window, version=version),
+        ranking,
+        RANKING_CACHE_TIMEOUT,
+    )
+    return ranking
+
+
+def get_ranking(window):
+    """id рецептов окна по убыванию популярности: из кэша, а если
+    рейтинга текущей версии в нём нет — пересчитывает окно."""
+    version = get_version(TRENDING)
+    ranking = cache.get(
+        RANKING_CACHE_KEY.format(window=window, version=version)
+    )
+    if ranking is None:
+        ranking = compute_ranking(window, version)
+    return ranking
+
+
+def compact(now):
+    """Сворачивает часы старше HOURLY_RETENTION в сутки и удаляет
+    данные старше самого длинного окна."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {ACTIVITY} WHERE hour < %s",
+            [now - max(WINDOWS.values())],
+        )
+        cursor.execute(
+            f"""
+            WITH old AS (
+                DELETE FROM {ACTIVITY}
+                WHERE hour < %s AND hour <> date_trunc('day', hour)
+                RETURNING recipe_id, hour, favorites, carts
+            )
+            INSERT INTO {ACTIVITY} (recipe_id, hour, favorites, carts)
+            SELECT recipe_id, date_trunc('day', hour),
+                SUM(favorites), SUM(carts)
+            FROM old
+            GROUP BY recipe_id, date_trunc('day', hour)
+            ON CONFLICT (recipe_id, hour) DO UPDATE SET
+                favorites = {ACTIVITY}.favorites + EXCLUDED.favorites,
+                carts = {ACTIVITY}.carts + EXCLUDED.carts
+            """,
+            [now - HOURLY_RETENTION],
+        )
+
+
+def update_popularity(now):
+    """Пересчитывает Recipe.popularity за POPULARITY_WINDOW. Трогает
+    только рецепты с активностью в окне и те, у кого популярность
+    ещё не обнулена."""
+    since = now - WINDOWS[POPULARITY_WINDOW]
+    recipes = Recipe._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {recipes} r SET popularity = COALESCE(
+                (
+                    SELECT SUM(a.favorites + a.carts) FROM {ACTIVITY} a
+                    WHERE a.recipe_id = r.id AND a.hour >= %s
+                ),
+                0
+            )
+            WHERE r.id IN (
+                SELECT id FROM {recipes} WHERE popularity > 0
+                UNION
+                SELECT recipe_id FROM {ACTIVITY} WHERE hour >= %s
+            )
+            """,
+            [since, since],
+        )
+        return cursor.rowcount
+
+
+def rollup():
+    now = timezone.now()
+    with transaction.atomic():
+        compact(now)
+        updated = update_popularity(now)
+    version = bump_version(TRENDING)
+    for window in WINDOWS:
+        compute_ranking(window, version)
+    return updated
@@ -0,0 +1,112 @@
+"""
+Версии наборов данных: кэши, ETag и индексы в памяти строят ключи
+из версии и считают устаревшим всё, что построено для прежней.
+
+Версии хранятся в таблице DataVersion, а не в кэше Django: кэш по
+умолчанию — память процесса, и сдвиг версии из команды управления
+или другого воркера до веб-процесса бы не дошёл. Внутри запроса
+прочитанная версия запоминается до его конца, поэтому запрос
+платит за каждый набор данных не больше одного чтения по ключу.
+"""
+import time
+from contextvars import ContextVar
+
+from django.core.signals import request_finished, request_started
+from django.db import connection, transaction
+
+from .models import DataVersion
+
+INGREDIENTS_CATALOG = "catalog:ingredients"
+TAGS_CATALOG = "catalog:tags"
+# Составы рецептов (api/recipe_ingredient_index.py): сдвигается после
+# массовых загрузок, чтобы процессы перестроили индекс целиком.
+RECIPE_INGREDIENTS = "index:recipe-ingredients"
+# Рейтинги популярных рецептов (api/trending.py).
+TRENDING = "ranking:trending"
+
+VERSIONS = DataVersion._meta.db_table
+
+# Версии, прочитанные в текущем запросе; вне запроса — None.
+_request_versions = ContextVar("request_versions", default=None)
+
+
+def _start_request(**kwargs):
+    _request_versions.set({})
+
+
+def _finish_request(**kwargs):
+    _request_versions.set(None)
+
+
+request_started.connect(_start_request)
+request_finished.connect(_finish_request)
+
+
+def cart_scope(user_id):
+    """Версия корзины пользователя: меняется при любом изменении
+    состава корзины или ингредиентов рецептов в ней."""
+    return f"cart:{user_id}"
+
+
+def get_version(scope):
+    """
+    Текущая версия набора данных scope. Отсутствующая версия создаётся
+    из времени, а не с нуля, чтобы не совпасть с выданной до отката
+    или очистки таблицы.
+    """
+    memo = _request_versions.get()
+    if memo is not None and scope in memo:
+        return memo[scope]
+    version = (
+        DataVersion.objects.filter(scope=scope)
+        .values_list("value", flat=True)
+        .first()
+    )
+    if version is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {VERSIONS} (scope, value) VALUES (%s, %s)
+                ON CONFLICT (scope) DO UPDATE SET value = {VERSIONS}.value
+                RETURNING value
+                """,
+                [scope, time.time_ns()],
+            )
+            version = cursor.fetchone()[0]
+    if memo is not None:
+        memo[scope] = version
+    return version
+
+
+def bump_versions(scopes):
+    """Сдвигает версии scopes одним запросом, делая устаревшими все
+    зависящие от них кэши и индексы."""
+    scopes = sorted(set(scopes))
+    if not scopes:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {VERSIONS} (scope, value)
+            SELECT scope, %s FROM unnest(%s::varchar[]) AS scope
+            ON CONFLICT (scope) DO UPDATE SET value = {VERSIONS}.value + 1
+            RETURNING scope, value
+            """,
+            [time.time_ns(), scopes],
+        )
+        versions = dict(cursor.fetchall())
+    memo = _request_versions.get()
+    if memo is not None:
+        memo.update(versions)
+    return versions
+
+
+def bump_version(scope):
+    return bump_versions([scope])[scope]
+
+
+def bump_cart_versions(user_ids):
+    """Сдвигает версии корзин после фиксации транзакции."""
+    scopes = [cart_scope(user_id) for user_id in user_ids]
+    if scopes:
+        transaction.on_commit(lambda: bump_versions(scopes))
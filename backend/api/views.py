@@ -1,3 +1,7 @@
+import re
+
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework import (
     viewsets,
@@ -9,10 +13,11 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .models import (
+    Favorite,
     Ingredient,
     Recipe,
+    ShoppingCart,
     Tag,
-    RecipeIngredient,
     User,
     Follow,
 )
@@ -20,18 +25,53 @@ from .serializers import (
     IngredientSerializer,
     RecipeSerializer,
     TagSerializer,
+    RecipeIdsSerializer,
     RecipeMinifiedSerializer,
     UserWithRecipesSerializer,
     UserAvatarSerializer,
 )
-from .filters import RecipeFilter, IngredientNameFilter
-from django.http import HttpResponse
-from django.db.models import Sum
+from .filters import RecipeFilter, RecipeSearchFilter, IngredientNameFilter
+from .etags import ingredients_etag, recipe_etag, tags_etag
+from .ingredient_index import get_ingredient_index
+from .recipe_ingredient_index import (
+    SEARCH_DEFAULT_LIMIT,
+    SEARCH_MAX_INGREDIENTS,
+    SEARCH_MAX_LIMIT,
+    get_recipe_ingredient_index,
+)
+from .negotiation import FileFormatContentNegotiation
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from djoser.views import UserViewSet as DjoserUserViewSet
-from .pagination import CustomPageNumberPagination
+from .pagination import (
+    CustomPageNumberPagination,
+    FeedCursorPagination,
+    RecipeCursorPagination,
+)
+from .media import release_file
 from .permissions import IsAuthorOrReadOnly
+from .relations import add_recipes, remove_recipes
+from .trending import DEFAULT_WINDOW, WINDOWS, get_ranking
+from .shopping_list import SHOPPING_LIST_FORMATS, shopping_list_response
+
+
+# Идентификаторы — bigint в БД. str.isdigit() пропускает «²» и
+# цифры других алфавитов, на которых int() падает или выходит за bigint.
+ID_PATTERN = re.compile(r"\d{1,19}", re.ASCII)
+MAX_ID = 2 ** 63 - 1
+
+
+def parse_id(value):
+    """Целое из ASCII-цифр в пределах bigint или None."""
+    value = str(value)
+    if ID_PATTERN.fullmatch(value) and int(value) <= MAX_ID:
+        return int(value)
+    return None
 
 
+@method_decorator(condition(etag_func=ingredients_etag), name="list")
+@method_decorator(condition(etag_func=ingredients_etag), name="retrieve")
 class IngredientViewSet(
     viewsets.ReadOnlyModelViewSet
 ):
@@ -47,7 +87,16 @@ class IngredientViewSet(
     def get_queryset(self):
         return Ingredient.objects.all()
 
+    def list(self, request, *args, **kwargs):
+        # Автодополнение вызывается на каждое нажатие клавиши,
+        # поэтому ?name= обслуживается индексом в памяти без БД.
+        return Response(
+            get_ingredient_index().search(request.query_params.get("name", ""))
+        )
+
 
+@method_decorator(condition(etag_func=tags_etag), name="list")
+@method_decorator(condition(etag_func=tags_etag), name="retrieve")
 class TagViewSet(
     viewsets.ReadOnlyModelViewSet
 ):
@@ -57,8 +106,9 @@ class TagViewSet(
     pagination_class = None
 
 
+@method_decorator(vary_on_headers("Authorization"), name="retrieve")
+@method_decorator(condition(etag_func=recipe_etag), name="retrieve")
 class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [
         IsAuthorOrReadOnly
@@ -66,147 +116,251 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     filter_backends = (
         DjangoFilterBackend,
-        drf_filters.SearchFilter,
+        RecipeSearchFilter,
         drf_filters.OrderingFilter,
     )
     filterset_class = RecipeFilter
-    search_fields = ("name", "text")
-    ordering_fields = ("pub_date", "name")
+    ordering_fields = ("pub_date", "name", "favorites_count", "popularity")
 
-    @action(
-        detail=True,
-        methods=["post", "delete"],
-        permission_classes=[permissions.IsAuthenticated],
-    )
-    def favorite(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        user = request.user
+    def get_queryset(self):
+        # Ингредиенты не подгружаются заранее: представление рецепта
+        # обычно берётся из кэша (см. RecipeListSerializer).
+        return Recipe.objects.select_related("author").with_user_flags(
+            self.request.user
+        )
 
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if RecipeCursorPagination.is_requested(self.request):
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def update_relation(self, request, pk, model, errors):
+        """
+        Добавляет (POST) или удаляет (DELETE) рецепт в связи model
+        одним запросом; решение принимает сама БД по числу изменённых
+        строк, поэтому повторные клики не создают дублей. Рецепт
+        читается отдельно только для ответа или для выбора между
+        404 и 400.
+        """
+        pk = parse_id(pk)
+        if pk is None:
+            raise Http404
         if request.method == "POST":
-            if recipe.favorited_by.filter(id=user.id).exists():
+            if add_recipes(model, request.user, [pk]):
+                recipe = get_object_or_404(Recipe, pk=pk)
+                serializer = RecipeMinifiedSerializer(recipe)
                 return Response(
-                    {"errors": "Рецепт уже в избранном"},
-                    status=status.HTTP_400_BAD_REQUEST,
+                    serializer.data, status=status.HTTP_201_CREATED
                 )
-            recipe.favorited_by.add(user)
-            serializer = RecipeMinifiedSerializer(
-                recipe
+            get_object_or_404(Recipe, pk=pk)
+            return Response(
+                {"errors": errors["already_added"]},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        elif request.method == "DELETE":
-            if not recipe.favorited_by.filter(id=user.id).exists():
-                return Response(
-                    {"errors": "Рецепта нет в избранном"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            recipe.favorited_by.remove(user)
+        if remove_recipes(model, request.user, [pk]):
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, pk=pk)
+        return Response(
+            {"errors": errors["not_added"]},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
     @action(
         detail=True,
         methods=["post", "delete"],
         permission_classes=[permissions.IsAuthenticated],
     )
-    def shopping_cart(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        user = request.user
+    def favorite(self, request, pk=None):
+        return self.update_relation(
+            request, pk, Favorite,
+            {
+                "already_added": "Рецепт уже в избранном",
+                "not_added": "Рецепта нет в избранном",
+            },
+        )
 
-        if request.method == "POST":
-            if recipe.in_shopping_cart_for_users.filter(id=user.id).exists():
-                return Response(
-                    {"errors": "Рецепт уже в списке покупок"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            recipe.in_shopping_cart_for_users.add(user)
-            serializer = RecipeMinifiedSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+    @action(
+        detail=True,
+        methods=["post", "delete"],
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def shopping_cart(self, request, pk=None):
+        return self.update_relation(
+            request, pk, ShoppingCart,
+            {
+                "already_added": "Рецепт уже в списке покупок",
+                "not_added": "Рецепта нет в списке покупок",
+            },
+        )
 
-        elif request.method == "DELETE":
-            print(
-                f"[DEBUG] Attempting to remove recipe {pk} \
-                from shopping cart for user {user.id} ({user.username})"
+    def bulk_update_relation(self, request, model):
+        """
+        Добавляет (POST) или удаляет (DELETE) пачку рецептов в связи
+        model одной транзакцией: один INSERT ... ON CONFLICT или один
+        DELETE (см. api/relations.py), плюс запрос существующих id,
+        чтобы отличить not_found от неизменившихся связей.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+
+        with transaction.atomic():
+            if request.method == "POST":
+                changed = add_recipes(model, request.user, recipe_ids)
+                outcomes = {"changed": "added", "unchanged": "already_added"}
+            else:
+                changed = remove_recipes(model, request.user, recipe_ids)
+                outcomes = {"changed": "removed", "unchanged": "not_added"}
+            found = changed | set(
+                Recipe.objects.filter(
+                    pk__in=set(recipe_ids) - changed
+                ).values_list("pk", flat=True)
             )
-            recipe_in_cart = recipe.in_shopping_cart_for_users.filter(
-                id=user.id
-            ).exists()
-            print(f"[DEBUG] Recipe in cart for user? {recipe_in_cart}")
-
-            if not recipe_in_cart:
-                print(
-                    f"[DEBUG] Condition ({not recipe_in_cart}) is True. \
-                    Recipe not in cart or user mismatch."
-                )
-                return Response(
-                    {"errors": "Рецепта нет в списке покупок"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
 
-            print(
-                f"[DEBUG] Attempting recipe. \
-                in_shopping_cart_for_users.remove({user})"
+        results = []
+        for recipe_id in recipe_ids:
+            if recipe_id not in found:
+                outcome = "not_found"
+            elif recipe_id in changed:
+                outcome = outcomes["changed"]
+            else:
+                outcome = outcomes["unchanged"]
+            results.append({"id": recipe_id, "status": outcome})
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        permission_classes=[permissions.IsAuthenticated],
+        url_path="favorite/bulk",
+        url_name="favorite-bulk",
+    )
+    def favorite_bulk(self, request):
+        return self.bulk_update_relation(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        permission_classes=[permissions.IsAuthenticated],
+        url_path="shopping_cart/bulk",
+        url_name="shopping-cart-bulk",
+    )
+    def shopping_cart_bulk(self, request):
+        return self.bulk_update_relation(request, ShoppingCart)
+
+    @action(detail=False, methods=["get"])
+    def trending(self, request):
+        """Самые добавляемые в избранное и список покупок рецепты
+        за окно ?window=24h|7d|30d (см. api/trending.py)."""
+        window = request.query_params.get("window", DEFAULT_WINDOW)
+        if window not in WINDOWS:
+            return Response(
+                {"detail": "Поддерживаемые окна: " + ", ".join(WINDOWS)},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            try:
-                recipe.in_shopping_cart_for_users.remove(user)
-                print(
-                    f"[DEBUG] recipe.in_shopping_cart_for_users. \
-                    remove({user}) EXECUTED successfully."
-                )
-            except Exception as e:
-                print(f"[DEBUG] EXCEPTION during .remove(user): {str(e)}")
-                return Response(
-                    {"errors": f"Ошибка при удалении: {str(e)}"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )
+        ranking = get_ranking(window)
+        limit = parse_id(request.query_params.get("limit", ""))
+        if limit:
+            ranking = ranking[:limit]
+        recipes = self.get_queryset().in_bulk(ranking)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ranking if pk in recipes], many=True
+        )
+        return Response({"window": window, "results": serializer.data})
+
+    @action(detail=False, methods=["get"])
+    def cook(self, request):
+        """Что приготовить из имеющихся ингредиентов
+        ?ingredients=1,2,3: рецепты по убыванию доли имеющихся
+        ингредиентов (см. api/recipe_ingredient_index.py)."""
+        values = ",".join(request.query_params.getlist("ingredients"))
+        parts = [part.strip() for part in values.split(",") if part.strip()]
+        ids = {parse_id(part) for part in parts}
+        if not parts or None in ids:
+            return Response(
+                {"ingredients": ["Укажите id ингредиентов через запятую."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(parts) > SEARCH_MAX_INGREDIENTS:
+            return Response(
+                {
+                    "ingredients": [
+                        "Не больше {} ингредиентов.".format(
+                            SEARCH_MAX_INGREDIENTS
+                        )
+                    ]
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = parse_id(request.query_params.get("limit", ""))
+        limit = (
+            min(limit, SEARCH_MAX_LIMIT) if limit else SEARCH_DEFAULT_LIMIT
+        )
+        matches = get_recipe_ingredient_index().search(ids, limit)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in matches]
+        )
+        matches = [match for match in matches if match[0] in recipes]
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _, _ in matches], many=True
+        )
+        results = serializer.data
+        for data, (_, coverage, missing) in zip(results, matches):
+            data["coverage"] = round(coverage, 3)
+            data["missing_ingredients"] = missing
+        return Response({"results": results})
 
-            return Response(status=status.HTTP_204_NO_CONTENT)
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь
+        (см. api/feed.py), от новых к старым."""
+        paginator = FeedCursorPagination()
+        keys = paginator.paginate_queryset(
+            request.user.pk, request, view=self
+        )
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for _, recipe_id in keys]
+        )
+        serializer = self.get_serializer(
+            [
+                recipes[recipe_id] for _, recipe_id in keys
+                if recipe_id in recipes
+            ],
+            many=True,
+        )
+        return paginator.get_paginated_response(serializer.data)
 
     @action(
         detail=False, methods=["get"], permission_classes=[
             permissions.IsAuthenticated
-        ]
+        ],
+        content_negotiation_class=FileFormatContentNegotiation,
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        shopping_list_items = (
-            RecipeIngredient.objects.filter(
-                recipe__in_shopping_cart_for_users=user
+        file_format = request.query_params.get("format", "txt")
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {"detail": "Поддерживаемые форматы: "
+                 f"{', '.join(SHOPPING_LIST_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            .values("ingredient__name", "ingredient__measurement_unit")
-            .annotate(total_amount=Sum("amount"))
-            .order_by("ingredient__name")
+        response = shopping_list_response(
+            request.user, file_format, request.build_absolute_uri("/")[:-1]
         )
-
-        if not shopping_list_items:
+        if response is None:
             return Response(
                 {"detail": "Список покупок пуст."},
                 status=status.HTTP_404_NOT_FOUND
             )
-
-        content = []
-        content.append(
-            f'''Список покупок для пользователя:
-            {user.get_full_name() or user.username}\n'''
-        )
-        content.append("--------------------------------------------------\n")
-        for item in shopping_list_items:
-            content.append(
-                f'''- {item['ingredient__name']}
-                ({item['ingredient__measurement_unit']})
-                - {item['total_amount']}\n'''
-            )
-        content.append("--------------------------------------------------\n")
-        content.append(
-            f'Foodgram, {request.build_absolute_uri("/")[:-1]}\n'
-        )
-
-        response_content = "".join(content)
-        response = HttpResponse(
-            response_content, content_type="text/plain; charset=utf-8"
-        )
-        response[
-            "Content-Disposition"
-        ] = 'attachment; filename="shopping_list.txt"'
         return response
 
     @action(
@@ -261,15 +415,17 @@ class CustomUserViewSet(DjoserUserViewSet):
         user = request.user
         followed_authors = User.objects.filter(following__user=user)
 
+        context = {"request": request, "is_subscribed": True}
+
         page = self.paginate_queryset(followed_authors)
         if page is not None:
             serializer = UserWithRecipesSerializer(
-                page, many=True, context={"request": request}
+                page, many=True, context=context
             )
             return self.get_paginated_response(serializer.data)
 
         serializer = UserWithRecipesSerializer(
-            followed_authors, many=True, context={"request": request}
+            followed_authors, many=True, context=context
         )
         return Response(serializer.data)
 
@@ -299,7 +455,8 @@ class CustomUserViewSet(DjoserUserViewSet):
                 )
             Follow.objects.create(user=current_user, author=author_to_follow)
             serializer = UserWithRecipesSerializer(
-                author_to_follow, context={"request": request}
+                author_to_follow,
+                context={"request": request, "is_subscribed": True},
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -336,7 +493,13 @@ class CustomUserViewSet(DjoserUserViewSet):
             )
         elif request.method == "DELETE":
             if user.avatar:
-                user.avatar.delete()
+                # Файл может быть общим с другими пользователями
+                # (api/storage.py), поэтому удаляется через release_file.
+                # Копии освободит build_variants.
+                old_avatar = user.avatar.name
+                user.avatar = None
+                user.save(update_fields=["avatar"])
+                release_file(User, "avatar", old_avatar)
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(
                 {"detail": "Аватар не найден."},